@@ -0,0 +1,652 @@
+"""
+Offline benchmark for the FlacLossless backend.
+
+yt-dlp is replaced by StubYoutubeDL, which "extracts" synthetic tracks and
+downloads them over HTTP from a local media server that serves generated
+WAV audio. Nothing leaves the machine, so runs are repeatable and can be
+compared against each other.
+
+The server module is imported in-process (with AUDIO_DIR and the library
+database pointed at a scratch directory) and served by a threaded werkzeug
+server on an ephemeral port. Scenarios:
+
+  job_manager  jobs created directly on JobManager, timed until their done event
+  jobs_sse     POST /jobs then follow /jobs/<id>/events until a terminal status
+  download     GET /download for new tracks (cold) and again for the same ones (warm)
+  stream       random Range reads (or whole files) from /stream
+  search       GET /search with a configurable share of repeated queries
+  sse_fanout   many subscribers on one job; time from completion to each delivery
+
+Results are written as JSON (stdout or --output); --compare checks them
+against an earlier result file and exits non-zero on a regression.
+
+    python benchmark.py --jobs 100 --concurrency 16 --output bench.json
+    python benchmark.py --compare bench.json --tolerance 0.15
+"""
+
+import argparse
+import http.client
+import json
+import logging
+import math
+import os
+import platform
+import random
+import shutil
+import socket
+import struct
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Callable, Dict, List, Optional
+
+SAMPLE_RATE = 44100
+
+
+def synthetic_wav(seconds: float, frequency: float = 440.0) -> bytes:
+    """16-bit mono PCM sine wave with a RIFF header."""
+    frames = int(seconds * SAMPLE_RATE)
+    period = [int(12000 * math.sin(2 * math.pi * frequency * i / SAMPLE_RATE)) for i in range(SAMPLE_RATE)]
+    pcm = struct.pack(f'<{SAMPLE_RATE}h', *period) * (frames // SAMPLE_RATE)
+    pcm += struct.pack(f'<{frames % SAMPLE_RATE}h', *period[:frames % SAMPLE_RATE])
+    header = struct.pack('<4sI4s4sIHHIIHH4sI', b'RIFF', 36 + len(pcm), b'WAVE', b'fmt ', 16, 1, 1,
+                         SAMPLE_RATE, SAMPLE_RATE * 2, 2, 16, b'data', len(pcm))
+    return header + pcm
+
+
+class MediaServer:
+    """
+    Local HTTP origin for stub downloads. /media/<id>.wav returns the same
+    payload with the id stamped over its last bytes, so every track is a
+    distinct blob in the content-addressed store.
+    """
+
+    def __init__(self, payload: bytes, bytes_per_sec: float = 0, chunk_size: int = 64 * 1024):
+        self.payload = payload
+        self.bytes_per_sec = bytes_per_sec
+        self.chunk_size = chunk_size
+        self.requests = 0
+        media = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def log_message(self, *args):
+                pass
+
+            def do_GET(self):
+                media.requests += 1
+                stamp = os.path.basename(self.path).rsplit('.', 1)[0].encode()
+                payload = media.payload[:-len(stamp)] + stamp
+                self.send_response(200)
+                self.send_header('Content-Type', 'audio/wav')
+                self.send_header('Content-Length', str(len(payload)))
+                self.end_headers()
+                for offset in range(0, len(payload), media.chunk_size):
+                    self.wfile.write(payload[offset:offset + media.chunk_size])
+                    if media.bytes_per_sec:
+                        time.sleep(media.chunk_size / media.bytes_per_sec)
+
+        self.httpd = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self.httpd.daemon_threads = True
+        self.base_url = f"http://127.0.0.1:{self.httpd.server_address[1]}"
+        threading.Thread(target=self.httpd.serve_forever, daemon=True).start()
+
+    def close(self):
+        self.httpd.shutdown()
+
+
+class StubYoutubeDL:
+    """
+    Stand-in for yt_dlp.YoutubeDL with the surface the server uses
+    (params, progress hooks, extract_info with process=False,
+    process_ie_result). Downloads stream from the MediaServer and report
+    progress the way yt-dlp does, including the .part rename.
+    """
+
+    media_base = ''
+    extract_delay = 0.0
+    search_delay = 0.0
+    # video_id -> Event; a download for that id blocks until the event is set
+    gates: Dict[str, threading.Event] = {}
+
+    def __init__(self, params: Optional[Dict[str, Any]] = None):
+        self.params = dict(params or {})
+        if not isinstance(self.params.get('outtmpl'), dict):
+            self.params['outtmpl'] = {'default': self.params.get('outtmpl') or '%(id)s.%(ext)s'}
+        self.hooks = list(self.params.get('progress_hooks') or [])
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        pass
+
+    def add_progress_hook(self, hook):
+        self.hooks.append(hook)
+
+    def get_info_extractor(self, name: str):
+        return None
+
+    def extract_info(self, url: str, download: bool = True, process: bool = True, **kwargs) -> Dict[str, Any]:
+        if url.startswith('ytsearch'):
+            time.sleep(self.search_delay)
+            count, _, query = url[len('ytsearch'):].partition(':')
+            return {'entries': [
+                {'id': f"s{abs(hash((query, i))) % 10 ** 10:010d}", 'title': f"{query} #{i}", 'uploader': 'bench', 'duration': 60}
+                for i in range(int(count or 1))
+            ]}
+        time.sleep(self.extract_delay)
+        video_id = url[-11:]
+        info = {
+            'id': video_id,
+            'title': f"Benchmark track {video_id}",
+            'duration': 60,
+            'uploader': 'bench',
+            'ext': 'wav',
+            'acodec': 'pcm_s16le',
+            'vcodec': 'none',
+            'url': f"{self.media_base}/media/{video_id}.wav",
+            'webpage_url': url,
+        }
+        if download and process:
+            return self.process_ie_result(info, download=True)
+        return info
+
+    def process_ie_result(self, info: Dict[str, Any], download: bool = True) -> Dict[str, Any]:
+        gate = self.gates.get(info['id'])
+        if gate is not None:
+            gate.wait()
+        final_path = self.params['outtmpl']['default'].replace('%(ext)s', info['ext']).replace('%(id)s', info['id'])
+        part_path = final_path + '.part'
+        host, _, path = info['url'][len('http://'):].partition('/')
+        conn = http.client.HTTPConnection(host, timeout=30)
+        try:
+            conn.request('GET', '/' + path)
+            response = conn.getresponse()
+            total = int(response.getheader('Content-Length') or 0)
+            downloaded = 0
+            started = time.monotonic()
+            with open(part_path, 'wb') as f:
+                while True:
+                    data = response.read(256 * 1024)
+                    if not data:
+                        break
+                    f.write(data)
+                    downloaded += len(data)
+                    elapsed = time.monotonic() - started
+                    self._progress({
+                        'status': 'downloading', 'filename': final_path, 'tmpfilename': part_path,
+                        'downloaded_bytes': downloaded, 'total_bytes': total,
+                        'speed': downloaded / elapsed if elapsed else None,
+                    })
+        finally:
+            conn.close()
+        os.replace(part_path, final_path)
+        self._progress({'status': 'finished', 'filename': final_path, 'downloaded_bytes': downloaded, 'total_bytes': total})
+        info = dict(info)
+        info['requested_downloads'] = [{'filepath': final_path}]
+        return info
+
+    def _progress(self, d: Dict[str, Any]):
+        for hook in self.hooks:
+            hook(d)
+
+
+def latency_summary(samples: List[float]) -> Dict[str, Any]:
+    """Percentiles in milliseconds (nearest rank)."""
+    if not samples:
+        return {'count': 0}
+    ordered = sorted(samples)
+
+    def pct(p: float) -> float:
+        return round(ordered[min(len(ordered) - 1, max(0, math.ceil(p * len(ordered)) - 1))] * 1000, 2)
+
+    return {
+        'count': len(ordered),
+        'mean': round(sum(ordered) / len(ordered) * 1000, 2),
+        'p50': pct(0.50),
+        'p90': pct(0.90),
+        'p99': pct(0.99),
+        'max': round(ordered[-1] * 1000, 2),
+    }
+
+
+def run_concurrent(fn: Callable[[int], Any], count: int, concurrency: int) -> tuple:
+    """Call fn(i) for i in range(count) on `concurrency` threads; returns (results, errors, elapsed)."""
+    results, errors = [], []
+    started = time.monotonic()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        for future in [pool.submit(fn, i) for i in range(count)]:
+            try:
+                results.append(future.result())
+            except Exception as e:
+                errors.append(str(e))
+    return results, errors, time.monotonic() - started
+
+
+class Bench:
+    def __init__(self, args: argparse.Namespace):
+        self.args = args
+        self.workdir = tempfile.mkdtemp(prefix='flac-bench-')
+        os.environ.update({
+            'AUDIO_DIR': os.path.join(self.workdir, 'audio'),
+            'LIBRARY_DB': os.path.join(self.workdir, 'library.db'),
+            'CACHE_FILE': os.path.join(self.workdir, 'cache.json'),
+            'AUDIO_QUOTA_MB': str(args.quota_mb),
+            'DOWNLOAD_WORKERS': str(args.download_workers),
+            'SEARCH_CACHE_TTL': str(args.search_cache_ttl),
+        })
+        if args.event_hub_port:
+            os.environ['EVENT_HUB_PORT'] = str(args.event_hub_port)
+        os.environ.pop('YT_COOKIES_FILE', None)
+
+        self.media = MediaServer(synthetic_wav(args.track_seconds), args.media_mbps * 1024 * 1024)
+        StubYoutubeDL.media_base = self.media.base_url
+        StubYoutubeDL.extract_delay = args.extract_ms / 1000
+        StubYoutubeDL.search_delay = args.search_ms / 1000
+
+        import yt_dlp
+        yt_dlp.YoutubeDL = StubYoutubeDL
+        sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+        import server
+        server.yt_dlp.YoutubeDL = StubYoutubeDL
+        if not args.verbose:
+            logging.disable(logging.INFO)
+        self.server = server
+
+        from werkzeug.serving import make_server
+        self.httpd = make_server('127.0.0.1', 0, server.app, threaded=True)
+        self.port = self.httpd.server_port
+        self.sse_port = server.EVENT_HUB_PORT or self.port
+        threading.Thread(target=self.httpd.serve_forever, daemon=True).start()
+        self.sequence = 0
+        self.lock = threading.Lock()
+
+    def close(self):
+        self.httpd.shutdown()
+        self.media.close()
+        shutil.rmtree(self.workdir, ignore_errors=True)
+
+    def new_video_id(self) -> str:
+        with self.lock:
+            self.sequence += 1
+            return f"bench{self.sequence:06d}"
+
+    def request(self, method: str, path: str, body: Optional[Dict[str, Any]] = None,
+                headers: Optional[Dict[str, str]] = None) -> tuple:
+        conn = http.client.HTTPConnection('127.0.0.1', self.port, timeout=self.args.timeout)
+        try:
+            payload = json.dumps(body) if body is not None else None
+            all_headers = {'Content-Type': 'application/json'} if body is not None else {}
+            all_headers.update(headers or {})
+            conn.request(method, path, body=payload, headers=all_headers)
+            response = conn.getresponse()
+            return response.status, response.read()
+        finally:
+            conn.close()
+
+    def open_events(self, job_id: str) -> socket.socket:
+        sock = socket.create_connection(('127.0.0.1', self.sse_port), timeout=self.args.timeout)
+        sock.sendall(f"GET /jobs/{job_id}/events HTTP/1.1\r\nHost: bench\r\nAccept: text/event-stream\r\n\r\n".encode())
+        return sock
+
+    @staticmethod
+    def read_until_terminal(sock: socket.socket) -> Optional[str]:
+        """Read SSE frames until a job snapshot with a terminal status; returns that status."""
+        buffer = b''
+        while True:
+            data = sock.recv(65536)
+            if not data:
+                return None
+            buffer += data
+            while b'\n\n' in buffer:
+                frame, buffer = buffer.split(b'\n\n', 1)
+                for line in frame.split(b'\n'):
+                    if not line.startswith(b'data:'):
+                        continue
+                    try:
+                        event = json.loads(line[5:])
+                    except ValueError:
+                        continue
+                    if event.get('status') in ('completed', 'failed', 'cancelled'):
+                        return event['status']
+
+    def scenario_job_manager(self) -> Dict[str, Any]:
+        jobs = []
+        started = time.monotonic()
+        for _ in range(self.args.jobs):
+            vid = self.new_video_id()
+            jobs.append((time.monotonic(), self.server.job_manager.create_job(vid, f"https://www.youtube.com/watch?v={vid}", "", pinned=True)))
+        latencies, failed = [], 0
+        for created, job in jobs:
+            job.done.wait(self.args.timeout)
+            if job.status != 'completed':
+                failed += 1
+            latencies.append(time.monotonic() - created)
+        elapsed = time.monotonic() - started
+        return {
+            'jobs': len(jobs),
+            'failed': failed,
+            'elapsed_seconds': round(elapsed, 3),
+            'jobs_per_sec': round(len(jobs) / elapsed, 2),
+            'latency_ms': latency_summary(latencies),
+        }
+
+    def scenario_jobs_sse(self) -> Dict[str, Any]:
+        def one(_):
+            vid = self.new_video_id()
+            started = time.monotonic()
+            status, body = self.request('POST', '/jobs', {'url': f"https://www.youtube.com/watch?v={vid}"})
+            if status != 200:
+                raise RuntimeError(f"POST /jobs returned {status}")
+            sock = self.open_events(json.loads(body)['job_id'])
+            try:
+                final = self.read_until_terminal(sock)
+            finally:
+                sock.close()
+            if final != 'completed':
+                raise RuntimeError(f"job ended {final}")
+            return time.monotonic() - started
+
+        latencies, errors, elapsed = run_concurrent(one, self.args.jobs, self.args.concurrency)
+        return {
+            'jobs': self.args.jobs,
+            'concurrency': self.args.concurrency,
+            'failed': len(errors),
+            'elapsed_seconds': round(elapsed, 3),
+            'jobs_per_sec': round(len(latencies) / elapsed, 2),
+            'latency_ms': latency_summary(latencies),
+        }
+
+    def scenario_download(self) -> Dict[str, Any]:
+        vids = [self.new_video_id() for _ in range(self.args.jobs)]
+
+        def one(i):
+            started = time.monotonic()
+            status, body = self.request('GET', f"/download?url=https://www.youtube.com/watch?v={vids[i]}")
+            if status != 200:
+                raise RuntimeError(f"/download returned {status}")
+            return time.monotonic() - started, json.loads(body).get('cached')
+
+        report = {}
+        for phase in ('cold', 'warm'):
+            results, errors, elapsed = run_concurrent(one, len(vids), self.args.concurrency)
+            report[phase] = {
+                'requests': len(vids),
+                'failed': len(errors),
+                'cached': sum(1 for _, cached in results if cached),
+                'requests_per_sec': round(len(results) / elapsed, 2),
+                'latency_ms': latency_summary([latency for latency, _ in results]),
+            }
+        return report
+
+    def scenario_stream(self) -> Dict[str, Any]:
+        library = (self.server.cached_job(vid, touch=False) for vid, _ in list(self.server.cache.items()))
+        urls = [job['stream_url'] for job in library if job]
+        if not urls:
+            return {'skipped': 'no tracks in the library'}
+        size = len(self.media.payload)
+        range_bytes = self.args.range_kb * 1024
+        deadline = time.monotonic() + self.args.stream_seconds
+        latencies: List[float] = []
+        totals = {'bytes': 0, 'errors': 0}
+        rng = random.Random(1)
+
+        def worker():
+            conn = http.client.HTTPConnection('127.0.0.1', self.port, timeout=self.args.timeout)
+            local_latencies, local_bytes, local_errors = [], 0, 0
+            while time.monotonic() < deadline:
+                headers = {}
+                if range_bytes and range_bytes < size:
+                    start = rng.randrange(0, size - range_bytes)
+                    headers['Range'] = f"bytes={start}-{start + range_bytes - 1}"
+                started = time.monotonic()
+                try:
+                    conn.request('GET', rng.choice(urls), headers=headers)
+                    response = conn.getresponse()
+                    body = response.read()
+                    if response.status not in (200, 206):
+                        local_errors += 1
+                        continue
+                except (OSError, http.client.HTTPException):
+                    local_errors += 1
+                    conn.close()
+                    conn = http.client.HTTPConnection('127.0.0.1', self.port, timeout=self.args.timeout)
+                    continue
+                local_latencies.append(time.monotonic() - started)
+                local_bytes += len(body)
+            conn.close()
+            with self.lock:
+                latencies.extend(local_latencies)
+                totals['bytes'] += local_bytes
+                totals['errors'] += local_errors
+
+        started = time.monotonic()
+        threads = [threading.Thread(target=worker) for _ in range(self.args.concurrency)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        elapsed = time.monotonic() - started
+        return {
+            'files': len(urls),
+            'range_bytes': range_bytes or None,
+            'concurrency': self.args.concurrency,
+            'requests': len(latencies),
+            'failed': totals['errors'],
+            'bytes': totals['bytes'],
+            'mb_per_sec': round(totals['bytes'] / elapsed / (1024 * 1024), 2),
+            'requests_per_sec': round(len(latencies) / elapsed, 2),
+            'latency_ms': latency_summary(latencies),
+        }
+
+    def scenario_search(self) -> Dict[str, Any]:
+        distinct = max(1, self.args.search_distinct)
+        before = self.server.search_cache.stats()
+
+        def one(i):
+            query = f"benchmark query {i % distinct}"
+            started = time.monotonic()
+            status, _ = self.request('GET', f"/search?q={query.replace(' ', '+')}&limit=10")
+            if status != 200:
+                raise RuntimeError(f"/search returned {status}")
+            return time.monotonic() - started
+
+        latencies, errors, elapsed = run_concurrent(one, self.args.searches, self.args.concurrency)
+        after = self.server.search_cache.stats()
+        return {
+            'requests': self.args.searches,
+            'distinct_queries': distinct,
+            'failed': len(errors),
+            'requests_per_sec': round(len(latencies) / elapsed, 2),
+            'cache_hits': after['hits'] - before['hits'],
+            'upstream_calls': after['upstream_calls'] - before['upstream_calls'],
+            'latency_ms': latency_summary(latencies),
+        }
+
+    def scenario_sse_fanout(self) -> Dict[str, Any]:
+        vid = self.new_video_id()
+        gate = StubYoutubeDL.gates[vid] = threading.Event()
+        job = self.server.job_manager.create_job(vid, f"https://www.youtube.com/watch?v={vid}", "", pinned=True)
+        subscribers = self.args.sse_subscribers
+        connected = threading.Barrier(subscribers + 1, timeout=self.args.timeout)
+        received: List[Optional[float]] = [None] * subscribers
+        connect_latencies: List[float] = []
+
+        def subscriber(i):
+            started = time.monotonic()
+            try:
+                sock = self.open_events(job.job_id)
+                sock.recv(1)
+            except OSError:
+                connected.abort()
+                return
+            with self.lock:
+                connect_latencies.append(time.monotonic() - started)
+            try:
+                connected.wait()
+                if self.read_until_terminal(sock) == 'completed':
+                    received[i] = time.monotonic()
+            except (OSError, threading.BrokenBarrierError):
+                pass
+            finally:
+                sock.close()
+
+        threads = [threading.Thread(target=subscriber, args=(i,)) for i in range(subscribers)]
+        for t in threads:
+            t.start()
+        try:
+            connected.wait()
+        except threading.BrokenBarrierError:
+            pass
+        gate.set()
+        job.done.wait(self.args.timeout)
+        finished = time.monotonic()
+        for t in threads:
+            t.join(self.args.timeout)
+        del StubYoutubeDL.gates[vid]
+        delivered = [at - finished for at in received if at is not None]
+        return {
+            'subscribers': subscribers,
+            'connected': len(connect_latencies),
+            'received_final': len(delivered),
+            'connect_ms': latency_summary(connect_latencies),
+            'delivery_ms': latency_summary([max(0.0, d) for d in delivered]),
+            'event_hub': bool(self.server.EVENT_HUB_PORT),
+        }
+
+    def run(self) -> Dict[str, Any]:
+        scenarios = {}
+        for name in self.args.scenarios:
+            started = time.monotonic()
+            print(f"[bench] {name}...", file=sys.stderr)
+            scenarios[name] = getattr(self, f"scenario_{name}")()
+            scenarios[name]['wall_seconds'] = round(time.monotonic() - started, 3)
+        return {
+            'timestamp': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()),
+            'environment': {
+                'python': platform.python_version(),
+                'platform': platform.platform(),
+                'cpu_count': os.cpu_count(),
+            },
+            'config': {k: v for k, v in vars(self.args).items() if k not in ('output', 'compare', 'verbose')},
+            'scenarios': scenarios,
+            'server': {
+                'pipeline': self.server.job_manager.pipeline_stats(),
+                'jobs': self.server.job_manager.job_stats(),
+                'extractors': self.server.extractor_pool.stats(),
+            },
+        }
+
+
+# (scenario, path to a number, True if larger is better) checked by --compare
+REGRESSION_KEYS = [
+    ('job_manager', 'jobs_per_sec', True),
+    ('job_manager', 'latency_ms.p99', False),
+    ('jobs_sse', 'jobs_per_sec', True),
+    ('jobs_sse', 'latency_ms.p99', False),
+    ('download', 'cold.requests_per_sec', True),
+    ('download', 'warm.latency_ms.p99', False),
+    ('stream', 'mb_per_sec', True),
+    ('stream', 'latency_ms.p99', False),
+    ('search', 'requests_per_sec', True),
+    ('search', 'latency_ms.p99', False),
+    ('sse_fanout', 'received_final', True),
+    ('sse_fanout', 'delivery_ms.p99', False),
+]
+
+
+def _lookup(report: Dict[str, Any], scenario: str, path: str) -> Optional[float]:
+    value: Any = report.get('scenarios', {}).get(scenario)
+    for part in path.split('.'):
+        if not isinstance(value, dict):
+            return None
+        value = value.get(part)
+    return value if isinstance(value, (int, float)) else None
+
+
+def compare(current: Dict[str, Any], baseline: Dict[str, Any], tolerance: float) -> List[str]:
+    """Metrics that got worse than the baseline by more than `tolerance` (a fraction)."""
+    regressions = []
+    for scenario, path, higher_is_better in REGRESSION_KEYS:
+        new, old = _lookup(current, scenario, path), _lookup(baseline, scenario, path)
+        if new is None or not old:
+            continue
+        change = (new - old) / old
+        if (higher_is_better and change < -tolerance) or (not higher_is_better and change > tolerance):
+            regressions.append(f"{scenario}.{path}: {old} -> {new} ({change:+.1%})")
+    return regressions
+
+
+SCENARIOS = ['job_manager', 'jobs_sse', 'download', 'stream', 'search', 'sse_fanout']
+
+
+def parse_args(argv: Optional[List[str]] = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--scenarios', default=','.join(SCENARIOS),
+                        type=lambda s: [x for x in s.split(',') if x],
+                        help='comma-separated subset of: ' + ', '.join(SCENARIOS))
+    parser.add_argument('--jobs', type=int, default=50, help='tracks per job/download scenario')
+    parser.add_argument('--concurrency', type=int, default=8, help='client threads')
+    parser.add_argument('--download-workers', type=int, default=3, help='DOWNLOAD_WORKERS for the server')
+    parser.add_argument('--track-seconds', type=float, default=30, help='length of the synthetic WAV (30 s = ~2.6 MB)')
+    parser.add_argument('--media-mbps', type=float, default=0, help='throttle the media server to this many MB/s per download (0: unthrottled)')
+    parser.add_argument('--extract-ms', type=float, default=0, help='simulated info extraction latency')
+    parser.add_argument('--search-ms', type=float, default=50, help='simulated upstream search latency')
+    parser.add_argument('--searches', type=int, default=500)
+    parser.add_argument('--search-distinct', type=int, default=50, help='distinct queries among --searches')
+    parser.add_argument('--search-cache-ttl', type=int, default=600)
+    parser.add_argument('--stream-seconds', type=float, default=5)
+    parser.add_argument('--range-kb', type=int, default=256, help='Range read size for the stream scenario (0: whole files)')
+    parser.add_argument('--sse-subscribers', type=int, default=200)
+    parser.add_argument('--event-hub-port', type=int, default=0, help='serve SSE from the asyncio event hub on this port')
+    parser.add_argument('--quota-mb', type=int, default=100000)
+    parser.add_argument('--timeout', type=float, default=120)
+    parser.add_argument('--output', help='write the JSON report here instead of stdout')
+    parser.add_argument('--compare', help='earlier JSON report to check for regressions')
+    parser.add_argument('--tolerance', type=float, default=0.2, help='allowed relative regression for --compare')
+    parser.add_argument('--verbose', action='store_true', help='keep the server INFO logs')
+    args = parser.parse_args(argv)
+    unknown = [s for s in args.scenarios if s not in SCENARIOS]
+    if unknown:
+        parser.error(f"unknown scenario(s): {', '.join(unknown)}")
+    return args
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    args = parse_args(argv)
+    bench = Bench(args)
+    try:
+        report = bench.run()
+    finally:
+        bench.close()
+
+    text = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(text + '\n')
+        print(f"[bench] report written to {args.output}", file=sys.stderr)
+    else:
+        print(text)
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        regressions = compare(report, baseline, args.tolerance)
+        for line in regressions:
+            print(f"[bench] REGRESSION {line}", file=sys.stderr)
+        if regressions:
+            return 1
+        print(f"[bench] no regressions beyond {args.tolerance:.0%} against {args.compare}", file=sys.stderr)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
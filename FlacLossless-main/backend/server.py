@@ -3,7 +3,7 @@ FlacLossless Backend: yt-dlp Job Manager with SSE Progress Streaming
 Downloads audio from YouTube with real-time progress updates via Server-Sent Events.
 """
 
-from flask import Flask, request, send_file, jsonify, Response
+from flask import Flask, request, jsonify, Response, redirect
 from flask_cors import CORS
 import yt_dlp
 import os
@@ -13,13 +13,26 @@ import threading
 import time
 from pathlib import Path
 import shutil
-from datetime import datetime, timedelta
+from datetime import datetime, timezone
 import logging
 import re
+import unicodedata
 from queue import Queue
 from typing import Dict, Optional, Any
 import tempfile
 import subprocess
+import sqlite3
+import heapq
+import asyncio
+import copy
+import struct
+import hashlib
+from collections import deque, OrderedDict
+
+try:
+    import numpy as np
+except ImportError:  # waveform and loudness analysis are skipped without NumPy
+    np = None
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
@@ -27,115 +40,2111 @@ logger = logging.getLogger(__name__)
 app = Flask(__name__)
 CORS(app, origins="*", supports_credentials=True)
 
-AUDIO_DIR = os.path.abspath(os.getenv('AUDIO_DIR', './audio'))
-CACHE_FILE = os.getenv('CACHE_FILE', './cache.json')
-CLEANUP_HOURS = int(os.getenv('CLEANUP_HOURS', 24))
-MAX_CONCURRENT_JOBS = 3
+AUDIO_DIR = os.path.abspath(os.getenv('AUDIO_DIR', './audio'))
+CACHE_FILE = os.getenv('CACHE_FILE', './cache.json')
+LIBRARY_DB = os.getenv('LIBRARY_DB', './library.db')
+AUDIO_QUOTA_MB = int(os.getenv('AUDIO_QUOTA_MB', 2048))
+EVICTION_POLICY = os.getenv('EVICTION_POLICY', 'lru').lower()
+EVICTION_HIGH_WATERMARK = float(os.getenv('EVICTION_HIGH_WATERMARK', 0.9))
+EVICTION_LOW_WATERMARK = float(os.getenv('EVICTION_LOW_WATERMARK', 0.75))
+STATS_FLUSH_SECONDS = int(os.getenv('STATS_FLUSH_SECONDS', 300))
+# Off by default: tracks are kept in the container yt-dlp fetched (m4a/webm/opus), which browsers play natively
+TRANSCODE_TO_MP3 = os.getenv('TRANSCODE_TO_MP3', 'false').lower() == 'true'
+PROGRESSIVE_PLAYBACK = os.getenv('PROGRESSIVE_PLAYBACK', 'false').lower() == 'true' and not TRANSCODE_TO_MP3
+PROGRESSIVE_MIN_BYTES = int(os.getenv('PROGRESSIVE_MIN_BYTES', 256 * 1024))
+PROGRESSIVE_WAIT_SECONDS = int(os.getenv('PROGRESSIVE_WAIT_SECONDS', 30))
+# Serve SSE from an asyncio listener on this port instead of holding a WSGI thread per client
+EVENT_HUB_PORT = int(os.getenv('EVENT_HUB_PORT', 0))
+EVENT_HUB_HOST = os.getenv('EVENT_HUB_HOST', '0.0.0.0')
+# Public base URL of the event hub when it sits behind a proxy (default: request host + EVENT_HUB_PORT)
+EVENT_HUB_URL = os.getenv('EVENT_HUB_URL', '').rstrip('/')
+# Progress updates are coalesced to this rate per job; status transitions are always sent at once
+PROGRESS_EVENTS_PER_SEC = float(os.getenv('PROGRESS_EVENTS_PER_SEC', 4))
+PROGRESS_EVENT_INTERVAL = 1.0 / PROGRESS_EVENTS_PER_SEC if PROGRESS_EVENTS_PER_SEC > 0 else 0.0
+SSE_RETRY_MS = 3000
+STREAM_BLOCK_SIZE = 256 * 1024
+MAX_STREAM_RANGES = 16
+# Stored filenames are never reused for different content, so clients and proxies may cache them for good
+STREAM_CACHE_CONTROL = 'public, max-age=31536000, immutable'
+# Ingest-time waveform peaks (needs NumPy): level 0 has one min/max pair per WAVEFORM_BASE_SAMPLES
+# decoded samples at 48 kHz, each further level halves the resolution; WAVEFORM_BITS is 8 or 16
+WAVEFORM_PEAKS = os.getenv('WAVEFORM_PEAKS', 'true').lower() == 'true'
+WAVEFORM_BASE_SAMPLES = int(os.getenv('WAVEFORM_BASE_SAMPLES', 256))
+WAVEFORM_LEVELS = int(os.getenv('WAVEFORM_LEVELS', 8))
+WAVEFORM_BITS = 16 if os.getenv('WAVEFORM_BITS', '8') == '16' else 8
+# /waveform is addressed by video_id, so it is revalidated against the ETag after a week rather than immutable
+WAVEFORM_CACHE_CONTROL = 'public, max-age=604800'
+ANALYSIS_SAMPLE_RATE = 48000
+ANALYSIS_TIMEOUT = int(os.getenv('ANALYSIS_TIMEOUT', 300))
+# EBU R128 integrated loudness, loudness range and true peak per track, stored in metadata (needs NumPy)
+LOUDNESS_ANALYSIS = os.getenv('LOUDNESS_ANALYSIS', 'true').lower() == 'true'
+# ReplayGain 2.0 reference level the suggested track gain aims for
+REPLAYGAIN_REFERENCE_LUFS = float(os.getenv('REPLAYGAIN_REFERENCE_LUFS', -18))
+# Threads used by POST /cache/analyze to backfill library entries
+ANALYSIS_WORKERS = int(os.getenv('ANALYSIS_WORKERS', 2))
+# /waveform requests for unanalyzed tracks are refused with 503 once this many analyses are pending
+ANALYSIS_QUEUE_SIZE = int(os.getenv('ANALYSIS_QUEUE_SIZE', 64))
+# Also cut each stored track into SEGMENT_SECONDS fMP4 segments with an HLS playlist, served from /hls
+SEGMENTED_OUTPUT = os.getenv('SEGMENTED_OUTPUT', 'false').lower() == 'true'
+SEGMENT_SECONDS = int(os.getenv('SEGMENT_SECONDS', 6))
+# Tracks stored before segmenting was enabled are segmented on first /hls request on this many threads;
+# beyond SEGMENT_QUEUE_SIZE pending ones new requests are refused with 503
+SEGMENT_WORKERS = int(os.getenv('SEGMENT_WORKERS', 1))
+SEGMENT_QUEUE_SIZE = int(os.getenv('SEGMENT_QUEUE_SIZE', 16))
+# Renditions for /stream/<video_id>/<profile> are encoded lazily on this many threads;
+# beyond RENDITION_QUEUE_SIZE pending encodes new requests are refused with 503
+RENDITION_WORKERS = int(os.getenv('RENDITION_WORKERS', 2))
+RENDITION_QUEUE_SIZE = int(os.getenv('RENDITION_QUEUE_SIZE', 32))
+# How long a profile request waits for its first encode before answering 503 + Retry-After
+RENDITION_WAIT_SECONDS = int(os.getenv('RENDITION_WAIT_SECONDS', 60))
+# Network-bound download stage and CPU-bound post-process stage are sized independently
+DOWNLOAD_WORKERS = int(os.getenv('DOWNLOAD_WORKERS', 3))
+# Download queue aging: a queued job outranks interactive requests made this many seconds after it
+PRIORITY_PREFETCH_OFFSET = float(os.getenv('PRIORITY_PREFETCH_OFFSET', 30))
+PRIORITY_BULK_OFFSET = float(os.getenv('PRIORITY_BULK_OFFSET', 300))
+# An unpinned job whose last SSE subscriber or /download waiter left is cancelled after this long
+CANCEL_GRACE_SECONDS = float(os.getenv('CANCEL_GRACE_SECONDS', 20))
+# Largest accepted POST /jobs/batch
+BATCH_MAX_ITEMS = int(os.getenv('BATCH_MAX_ITEMS', 500))
+# Finished/failed jobs stay queryable for this long, and at most this many are kept
+JOB_TTL_SECONDS = int(os.getenv('JOB_TTL_SECONDS', 900))
+MAX_FINISHED_JOBS = int(os.getenv('MAX_FINISHED_JOBS', 1000))
+# Idle YoutubeDL instances kept warm for reuse (connections, cookie jar, extractors)
+EXTRACTOR_POOL_SIZE = int(os.getenv('EXTRACTOR_POOL_SIZE', 8))
+EXTRACTOR_IDLE_SECONDS = int(os.getenv('EXTRACTOR_IDLE_SECONDS', 300))
+EXTRACTOR_MAX_USES = int(os.getenv('EXTRACTOR_MAX_USES', 50))
+# Download strategies are ranked on outcomes from the last STRATEGY_WINDOW attempts within STRATEGY_WINDOW_SECONDS
+STRATEGY_WINDOW = int(os.getenv('STRATEGY_WINDOW', 50))
+STRATEGY_WINDOW_SECONDS = int(os.getenv('STRATEGY_WINDOW_SECONDS', 3600))
+# A strategy below this success rate (with at least STRATEGY_MIN_SAMPLES outcomes) is skipped until its window ages out
+STRATEGY_SKIP_BELOW = float(os.getenv('STRATEGY_SKIP_BELOW', 0.05))
+STRATEGY_MIN_SAMPLES = int(os.getenv('STRATEGY_MIN_SAMPLES', 8))
+# Extracted info dicts (format lists included) are reused across fallback attempts for this long
+INFO_CACHE_TTL = int(os.getenv('INFO_CACHE_TTL', 1800))
+INFO_CACHE_SIZE = int(os.getenv('INFO_CACHE_SIZE', 256))
+# /search results are reused for identical (normalized) queries for this long
+SEARCH_CACHE_TTL = int(os.getenv('SEARCH_CACHE_TTL', 600))
+SEARCH_CACHE_SIZE = int(os.getenv('SEARCH_CACHE_SIZE', 512))
+POSTPROCESS_WORKERS = int(os.getenv('POSTPROCESS_WORKERS', os.cpu_count() or 2))
+POSTPROCESS_QUEUE_SIZE = int(os.getenv('POSTPROCESS_QUEUE_SIZE', 2 * POSTPROCESS_WORKERS))
+
+Path(AUDIO_DIR).mkdir(parents=True, exist_ok=True)
+
+if np is None and WAVEFORM_PEAKS:
+    logger.warning("WAVEFORM_PEAKS is enabled but NumPy is not installed: no waveform peaks will be computed")
+if np is None and LOUDNESS_ANALYSIS:
+    logger.warning("LOUDNESS_ANALYSIS is enabled but NumPy is not installed: tracks get no loudness or ReplayGain data")
+
+
+def _metric_labels(labels: Dict[str, Any]) -> str:
+    if not labels:
+        return ''
+    escaped = (
+        f'{k}="' + str(v).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') + '"'
+        for k, v in labels.items()
+    )
+    return '{' + ','.join(escaped) + '}'
+
+
+class Metrics:
+    """
+    Counters and latency histograms rendered in the Prometheus text format.
+    Families are declared once with their help text; each distinct label set
+    gets its own series. Values that other components already track (cache
+    stats, pool sizes, disk usage) are read by collectors at scrape time
+    instead of being mirrored here.
+    """
+
+    BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        # name -> (type, help)
+        self.families: Dict[str, tuple] = {}
+        # name -> {label tuple: value} for counters, {label tuple: [bucket counts..., sum, count]} for histograms
+        self.series: Dict[str, Dict[tuple, Any]] = {}
+        self.collectors: list = []
+
+    def counter(self, name: str, help_text: str):
+        self.families[name] = ('counter', help_text)
+        self.series[name] = {}
+
+    def histogram(self, name: str, help_text: str):
+        self.families[name] = ('histogram', help_text)
+        self.series[name] = {}
+
+    def collector(self, fn):
+        """Register fn() -> [(name, type, help, [(labels, value), ...]), ...], called on every scrape."""
+        self.collectors.append(fn)
+        return fn
+
+    def inc(self, name: str, amount: float = 1, **labels):
+        key = tuple(sorted(labels.items()))
+        with self.lock:
+            series = self.series[name]
+            series[key] = series.get(key, 0) + amount
+
+    def observe(self, name: str, value: float, **labels):
+        key = tuple(sorted(labels.items()))
+        with self.lock:
+            rec = self.series[name].get(key)
+            if rec is None:
+                rec = self.series[name][key] = [0] * (len(self.BUCKETS) + 2)
+            for i, bound in enumerate(self.BUCKETS):
+                if value <= bound:
+                    rec[i] += 1
+            rec[-2] += value
+            rec[-1] += 1
+
+    def render(self) -> str:
+        lines = []
+        with self.lock:
+            snapshot = {name: {k: list(v) if isinstance(v, list) else v for k, v in series.items()}
+                        for name, series in self.series.items()}
+        for name, (kind, help_text) in self.families.items():
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} {kind}")
+            for key, value in snapshot[name].items():
+                labels = dict(key)
+                if kind == 'counter':
+                    lines.append(f"{name}{_metric_labels(labels)} {value}")
+                    continue
+                for bound, n in zip(self.BUCKETS, value):
+                    lines.append(f"{name}_bucket{_metric_labels({**labels, 'le': bound})} {n}")
+                lines.append(f"{name}_bucket{_metric_labels({**labels, 'le': '+Inf'})} {value[-1]}")
+                lines.append(f"{name}_sum{_metric_labels(labels)} {round(value[-2], 6)}")
+                lines.append(f"{name}_count{_metric_labels(labels)} {value[-1]}")
+        for fn in self.collectors:
+            try:
+                families = fn()
+            except Exception as e:
+                logger.warning(f"Metrics collector {fn.__name__} failed: {e}")
+                continue
+            for name, kind, help_text, samples in families:
+                lines.append(f"# HELP {name} {help_text}")
+                lines.append(f"# TYPE {name} {kind}")
+                for labels, value in samples:
+                    lines.append(f"{name}{_metric_labels(labels)} {value}")
+        return '\n'.join(lines) + '\n'
+
+
+metrics = Metrics()
+metrics.histogram('flac_queue_wait_seconds', 'Time a job waited in the download queue, by priority class.')
+metrics.histogram('flac_extract_seconds', 'yt-dlp info extraction time (info cache misses only).')
+metrics.histogram('flac_download_seconds', 'Media download time of the strategy that succeeded.')
+metrics.histogram('flac_transcode_seconds', 'FFmpeg time per job, by operation (mp3 transcode or audio remux).')
+metrics.histogram('flac_finalize_seconds', 'Time to index and register a finished file.')
+metrics.histogram('flac_analysis_seconds', 'Ingest-time audio analysis per track, by kind.')
+metrics.counter('flac_library_lookups_total', 'Library lookups for requested tracks, by result (hit or miss).')
+metrics.counter('flac_download_strategy_total', 'Download strategy attempts, by strategy and result.')
+metrics.counter('flac_jobs_finished_total', 'Jobs that reached a terminal status, by status.')
+metrics.counter('flac_stream_bytes_total', 'Body bytes served by /stream.')
+metrics.counter('flac_blob_dedup_total', 'Ingested files whose content was already stored.')
+metrics.counter('flac_blob_dedup_bytes_total', 'Bytes not stored again thanks to deduplication.')
+
+
+class LibraryIndex:
+    """
+    Index of downloaded tracks keyed by video_id.
+    Entries live in memory for reads and are persisted one row at a time to
+    SQLite in WAL mode, so completing a job never rewrites the whole library.
+    """
+
+    def __init__(self, db_path: str, legacy_json: Optional[str] = None):
+        self.db_path = db_path
+        self.lock = threading.RLock()
+        self.entries: Dict[str, Dict[str, Any]] = {}
+        # stored file basename -> video_ids whose entry points at it
+        self.by_file: Dict[str, set] = {}
+        # blob digest -> profile -> encoded rendition of that blob
+        self.renditions: Dict[str, Dict[str, Dict[str, Any]]] = {}
+        self.conn = sqlite3.connect(db_path, check_same_thread=False, isolation_level=None)
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.execute('PRAGMA synchronous=NORMAL')
+        self.conn.execute(
+            'CREATE TABLE IF NOT EXISTS library ('
+            'video_id TEXT PRIMARY KEY, data TEXT NOT NULL, updated_at REAL NOT NULL)'
+        )
+        self.conn.execute(
+            'CREATE TABLE IF NOT EXISTS renditions ('
+            'digest TEXT NOT NULL, profile TEXT NOT NULL, data TEXT NOT NULL, updated_at REAL NOT NULL, '
+            'PRIMARY KEY (digest, profile))'
+        )
+        if legacy_json:
+            self._migrate_json(legacy_json)
+        for video_id, data in self.conn.execute('SELECT video_id, data FROM library'):
+            try:
+                self._link(video_id, json.loads(data))
+            except ValueError:
+                logger.warning(f"Skipping corrupt library entry: {video_id}")
+        for digest, profile, data in self.conn.execute('SELECT digest, profile, data FROM renditions'):
+            try:
+                self.renditions.setdefault(digest, {})[profile] = json.loads(data)
+            except ValueError:
+                logger.warning(f"Skipping corrupt rendition entry: {digest} {profile}")
+        logger.info(f"Library index loaded: {len(self.entries)} entries from {db_path}")
+
+    def _migrate_json(self, path: str):
+        """One-shot import of a legacy cache.json, renamed afterwards so it only runs once."""
+        if not os.path.exists(path):
+            return
+        try:
+            with open(path, 'r') as f:
+                legacy = json.load(f)
+        except Exception as e:
+            logger.warning(f"Could not read legacy cache {path}: {e}")
+            return
+        now = time.time()
+        with self.lock:
+            self.conn.execute('BEGIN')
+            try:
+                self.conn.executemany(
+                    'INSERT OR IGNORE INTO library (video_id, data, updated_at) VALUES (?, ?, ?)',
+                    [(vid, json.dumps(entry), now) for vid, entry in legacy.items() if isinstance(entry, dict)]
+                )
+                self.conn.execute('COMMIT')
+            except Exception:
+                self.conn.execute('ROLLBACK')
+                raise
+        os.replace(path, path + '.migrated')
+        logger.info(f"Migrated {len(legacy)} entries from {path} into {self.db_path}")
+
+    def put(self, video_id: str, entry: Dict[str, Any]):
+        with self.lock:
+            self.conn.execute(
+                'INSERT INTO library (video_id, data, updated_at) VALUES (?, ?, ?) '
+                'ON CONFLICT(video_id) DO UPDATE SET data = excluded.data, updated_at = excluded.updated_at',
+                (video_id, json.dumps(entry), time.time())
+            )
+            self._unlink(video_id)
+            self._link(video_id, entry)
+
+    def update(self, video_id: str, **fields):
+        with self.lock:
+            entry = self.entries.get(video_id)
+            if entry is None:
+                return
+            self.put(video_id, {**entry, **fields})
+
+    def delete(self, video_id: str) -> Optional[Dict[str, Any]]:
+        with self.lock:
+            self.conn.execute('DELETE FROM library WHERE video_id = ?', (video_id,))
+            return self._unlink(video_id)
+
+    def _link(self, video_id: str, entry: Dict[str, Any]):
+        self.entries[video_id] = entry
+        if entry.get('file'):
+            self.by_file.setdefault(os.path.basename(entry['file']), set()).add(video_id)
+
+    def _unlink(self, video_id: str) -> Optional[Dict[str, Any]]:
+        entry = self.entries.pop(video_id, None)
+        if entry and entry.get('file'):
+            name = os.path.basename(entry['file'])
+            owners = self.by_file.get(name)
+            if owners:
+                owners.discard(video_id)
+                if not owners:
+                    del self.by_file[name]
+        return entry
+
+    def owners(self, name: str) -> list:
+        """video_ids whose entry points at the stored file `name`."""
+        return list(self.by_file.get(name, ()))
+
+    def get(self, video_id: str, default=None):
+        return self.entries.get(video_id, default)
+
+    def put_rendition(self, digest: str, profile: str, record: Dict[str, Any]):
+        with self.lock:
+            self.conn.execute(
+                'INSERT INTO renditions (digest, profile, data, updated_at) VALUES (?, ?, ?, ?) '
+                'ON CONFLICT(digest, profile) DO UPDATE SET data = excluded.data, updated_at = excluded.updated_at',
+                (digest, profile, json.dumps(record), time.time())
+            )
+            self.renditions.setdefault(digest, {})[profile] = record
+
+    def update_rendition(self, digest: str, profile: str, **fields):
+        with self.lock:
+            record = self.renditions.get(digest, {}).get(profile)
+            if record is not None:
+                self.put_rendition(digest, profile, {**record, **fields})
+
+    def delete_rendition(self, digest: str, profile: str) -> Optional[Dict[str, Any]]:
+        with self.lock:
+            self.conn.execute('DELETE FROM renditions WHERE digest = ? AND profile = ?', (digest, profile))
+            profiles = self.renditions.get(digest, {})
+            record = profiles.pop(profile, None)
+            if not profiles:
+                self.renditions.pop(digest, None)
+            return record
+
+    def get_rendition(self, digest: str, profile: str) -> Optional[Dict[str, Any]]:
+        return self.renditions.get(digest, {}).get(profile)
+
+    def renditions_of(self, digest: str) -> Dict[str, Dict[str, Any]]:
+        with self.lock:
+            return dict(self.renditions.get(digest, {}))
+
+    def rendition_items(self) -> list:
+        with self.lock:
+            return [(d, p, r) for d, profiles in self.renditions.items() for p, r in profiles.items()]
+
+    def items(self):
+        return list(self.entries.items())
+
+    def __contains__(self, video_id: str) -> bool:
+        return video_id in self.entries
+
+    def __getitem__(self, video_id: str) -> Dict[str, Any]:
+        return self.entries[video_id]
+
+    def __setitem__(self, video_id: str, entry: Dict[str, Any]):
+        self.put(video_id, entry)
+
+    def __delitem__(self, video_id: str):
+        if self.delete(video_id) is None:
+            raise KeyError(video_id)
+
+    def __len__(self) -> int:
+        return len(self.entries)
+
+cache = LibraryIndex(LIBRARY_DB, legacy_json=CACHE_FILE)
+
+
+class DiskBudget:
+    """
+    Size-bounded eviction for AUDIO_DIR.
+    Every stored file is tracked with its size, last access time and hit count.
+    A heap ordered by the policy key (LRU: last access, LFU: hits then last
+    access) yields the next victim in O(log n); heap entries made stale by a
+    touch are skipped when popped. Eviction runs when a new file pushes usage
+    past the high watermark and stops once it is back under the low watermark.
+    """
+
+    def __init__(self, quota_bytes: int, policy: str, high: float, low: float, on_evict):
+        self.quota = quota_bytes
+        self.policy = policy if policy in ('lru', 'lfu') else 'lru'
+        self.high = high
+        self.low = min(low, high)
+        self.on_evict = on_evict
+        self.lock = threading.Lock()
+        # name -> [size, last_access, hits, version]
+        self.files: Dict[str, list] = {}
+        self.heap: list = []
+        self.used = 0
+        self.dirty: set = set()
+        self.evictions = 0
+        self.bytes_evicted = 0
+        self.hits = 0
+
+    def _key(self, rec: list):
+        if self.policy == 'lfu':
+            return (rec[2], rec[1])
+        return (rec[1],)
+
+    def _push(self, name: str, rec: list):
+        rec[3] += 1
+        heapq.heappush(self.heap, (self._key(rec), rec[3], name))
+        if len(self.heap) > 2 * len(self.files) + 64:
+            self.heap = [(self._key(r), r[3], n) for n, r in self.files.items()]
+            heapq.heapify(self.heap)
+
+    def track(self, name: str, size: int, last_access: Optional[float] = None, hits: int = 0, evict: bool = True):
+        """Start accounting for a stored file, evicting others if it pushes usage over budget."""
+        with self.lock:
+            old = self.files.pop(name, None)
+            if old:
+                self.used -= old[0]
+            rec = [size, last_access or time.time(), hits, 0]
+            self.files[name] = rec
+            self.used += size
+            self._push(name, rec)
+            victims = self._select_victims(protect=name) if evict else []
+        for victim in victims:
+            self._evict(victim)
+
+    def touch(self, name: str, hit: bool = True, source: Optional[str] = None):
+        """
+        Record an access to `name`. `source` is the stored file it was
+        derived from; it is refreshed along with it, so a source is never
+        colder than a rendition being played and is not evicted under it.
+        """
+        with self.lock:
+            rec = self.files.get(name)
+            if not rec:
+                return
+            now = time.time()
+            if hit:
+                self.hits += 1
+            for key in (name, source):
+                rec = self.files.get(key) if key else None
+                if not rec:
+                    continue
+                rec[1] = now
+                if hit:
+                    rec[2] += 1
+                self.dirty.add(key)
+                self._push(key, rec)
+
+    def __contains__(self, name: str) -> bool:
+        with self.lock:
+            return name in self.files
+
+    def grow(self, name: str, delta: int):
+        """Charge derived files (waveform peaks, segments) to the stored file they belong to."""
+        with self.lock:
+            rec = self.files.get(name)
+            if rec:
+                rec[0] += delta
+                self.used += delta
+
+    def forget(self, name: str):
+        with self.lock:
+            rec = self.files.pop(name, None)
+            if rec:
+                self.used -= rec[0]
+            self.dirty.discard(name)
+
+    def _select_victims(self, protect: str) -> list:
+        if self.used <= self.quota * self.high:
+            return []
+        target = self.quota * self.low
+        victims, skipped = [], []
+        while self.used > target and self.heap:
+            entry = heapq.heappop(self.heap)
+            _, version, name = entry
+            rec = self.files.get(name)
+            if not rec or rec[3] != version:
+                continue
+            if name == protect:
+                skipped.append(entry)
+                continue
+            del self.files[name]
+            self.dirty.discard(name)
+            self.used -= rec[0]
+            self.evictions += 1
+            self.bytes_evicted += rec[0]
+            victims.append(name)
+        for entry in skipped:
+            heapq.heappush(self.heap, entry)
+        return victims
+
+    def _evict(self, name: str):
+        try:
+            self.on_evict(name)
+        except Exception as e:
+            logger.warning(f"Eviction of {name} failed: {e}")
+
+    def take_dirty(self) -> Dict[str, tuple]:
+        """Access stats changed since the last call, as name -> (last_access, hits)."""
+        with self.lock:
+            changed = {n: (self.files[n][1], self.files[n][2]) for n in self.dirty if n in self.files}
+            self.dirty.clear()
+        return changed
+
+    def stats(self) -> Dict[str, Any]:
+        with self.lock:
+            return {
+                'policy': self.policy,
+                'quota_bytes': self.quota,
+                'used_bytes': self.used,
+                'high_watermark': self.high,
+                'low_watermark': self.low,
+                'files': len(self.files),
+                'hits': self.hits,
+                'evictions': self.evictions,
+                'bytes_evicted': self.bytes_evicted,
+            }
+
+
+# Guards the check-then-link steps of blob ingest against eviction and deletes
+blob_lock = threading.RLock()
+_BLOB_RE = re.compile(r'^([0-9a-f]{64})\.[a-z0-9]+$')
+# Encoded renditions of a blob: <sha256>.<profile>.<ext>
+_RENDITION_RE = re.compile(r'^([0-9a-f]{64})\.([a-z0-9_]+)\.[a-z0-9]+$')
+
+
+def _evict_file(name: str):
+    """Drop every index entry pointing at a stored file, then the file itself."""
+    with blob_lock:
+        # The budget dropped `name` before this call; a concurrent ingest of the
+        # same digest may have tracked and linked it again since, so it is live
+        if name in disk_budget:
+            logger.info(f"Skipped eviction of {name}: stored again meanwhile")
+            return
+        rendition = _RENDITION_RE.match(name)
+        if rendition:
+            # A rendition goes on its own; the source and its other profiles stay
+            _remove_rendition(rendition.group(1), rendition.group(2))
+            logger.info(f"Evicted {name}")
+            return
+        for video_id in cache.owners(name):
+            cache.delete(video_id)
+        file_path = os.path.join(AUDIO_DIR, name)
+        _remove_sidecars(file_path)
+        if os.path.exists(file_path):
+            os.remove(file_path)
+    logger.info(f"Evicted {name}")
+
+
+def _peaks_path(file_path: str) -> str:
+    return f"{os.path.splitext(file_path)[0]}.peaks"
+
+
+def _segments_root(file_path: str) -> str:
+    return f"{os.path.splitext(file_path)[0]}.hls"
+
+
+def _segments_dir(file_path: str, seconds: int = SEGMENT_SECONDS) -> str:
+    # Segment length is part of the path, so a cached playlist never changes under its URL
+    return os.path.join(_segments_root(file_path), str(seconds))
+
+
+def _remove_sidecars(file_path: str):
+    """Delete files derived from a stored track (waveform peaks, HLS segments, renditions)."""
+    try:
+        os.remove(_peaks_path(file_path))
+    except FileNotFoundError:
+        pass
+    shutil.rmtree(_segments_root(file_path), ignore_errors=True)
+    blob = _BLOB_RE.match(os.path.basename(file_path))
+    if blob:
+        for profile in cache.renditions_of(blob.group(1)):
+            _remove_rendition(blob.group(1), profile)
+
+
+def _remove_rendition(digest: str, profile: str) -> bool:
+    with blob_lock:
+        record = cache.delete_rendition(digest, profile)
+        if not record:
+            return False
+        disk_budget.forget(os.path.basename(record['file']))
+        try:
+            os.remove(record['file'])
+        except FileNotFoundError:
+            pass
+    return True
+
+
+def _sidecar_bytes(file_path: str) -> int:
+    total = os.path.getsize(_peaks_path(file_path)) if os.path.exists(_peaks_path(file_path)) else 0
+    for root, _, files in os.walk(_segments_root(file_path)):
+        total += sum(os.path.getsize(os.path.join(root, f)) for f in files)
+    return total
+
+
+def _entry_timestamp(entry: Dict[str, Any]) -> float:
+    last_access = entry.get('last_access')
+    if last_access:
+        return float(last_access)
+    try:
+        return datetime.fromisoformat(entry.get('downloaded_at', '')).timestamp()
+    except (TypeError, ValueError):
+        return time.time()
+
+
+disk_budget = DiskBudget(
+    AUDIO_QUOTA_MB * 1024 * 1024, EVICTION_POLICY,
+    EVICTION_HIGH_WATERMARK, EVICTION_LOW_WATERMARK, _evict_file
+)
+for _video_id, _entry in cache.items():
+    _file = _entry.get('file', '')
+    if _file and os.path.exists(_file) and os.path.basename(_file) not in disk_budget:
+        disk_budget.track(os.path.basename(_file), os.path.getsize(_file) + _sidecar_bytes(_file),
+                          _entry_timestamp(_entry), _entry.get('hits', 0), evict=False)
+for _digest, _profile, _record in cache.rendition_items():
+    if os.path.exists(_record['file']):
+        disk_budget.track(os.path.basename(_record['file']), os.path.getsize(_record['file']),
+                          _record.get('last_access'), _record.get('hits', 0), evict=False)
+    else:
+        cache.delete_rendition(_digest, _profile)
+
+# Work filenames announced for progressive playback -> the blob they were stored as
+stream_aliases: OrderedDict = OrderedDict()
+STREAM_ALIAS_LIMIT = 1024
+
+
+def _file_digest(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _store_blob(video_id: str, path: str, entry: Dict[str, Any]) -> str:
+    """
+    Move a finished file into the content-addressed store and point
+    `video_id` at it. Files are named `<sha256>.<ext>`, so identical bytes
+    from different videos (or a re-download after eviction) share one blob
+    and one stream URL; the index entries pointing at a blob are its
+    references. Returns the blob path.
+    """
+    digest = _file_digest(path)
+    name = f"{digest}.{path.rsplit('.', 1)[-1].lower()}"
+    blob_path = os.path.join(AUDIO_DIR, name)
+    with blob_lock:
+        previous = cache.get(video_id)
+        existed = os.path.exists(blob_path)
+        if not existed:
+            os.replace(path, blob_path)
+        elif path != blob_path:
+            os.remove(path)
+        cache[video_id] = {**entry, 'file': blob_path, 'digest': digest}
+        if existed and name in disk_budget:
+            disk_budget.touch(name, hit=False)
+            metrics.inc('flac_blob_dedup_total')
+            metrics.inc('flac_blob_dedup_bytes_total', os.path.getsize(blob_path))
+            logger.info(f"{video_id} deduplicated onto existing blob {name}")
+        else:
+            disk_budget.track(name, os.path.getsize(blob_path))
+        if previous and previous.get('file') and os.path.basename(previous['file']) != name:
+            _release_blob(os.path.basename(previous['file']))
+    return blob_path
+
+
+def _release_blob(name: str) -> bool:
+    """Delete a stored file once no index entry references it; True if it was removed."""
+    with blob_lock:
+        if cache.owners(name):
+            return False
+        disk_budget.forget(name)
+        file_path = os.path.join(AUDIO_DIR, name)
+        _remove_sidecars(file_path)
+        if not os.path.exists(file_path):
+            return False
+        os.remove(file_path)
+    logger.info(f"Removed unreferenced blob {name}")
+    return True
+
+
+def _alias_stream(work_name: str, blob_name: str):
+    with blob_lock:
+        stream_aliases[work_name] = blob_name
+        while len(stream_aliases) > STREAM_ALIAS_LIMIT:
+            stream_aliases.popitem(last=False)
+
+def _cookie_items(content: str) -> Optional[list]:
+    """Cookie dicts from a browser-extension JSON export, or None if `content` is not one."""
+    try:
+        parsed = json.loads(content)
+    except ValueError:
+        return None
+    if isinstance(parsed, dict):
+        # common formats: { cookies: [...] } or a single cookie object
+        parsed = parsed['cookies'] if isinstance(parsed.get('cookies'), list) else [parsed]
+    if not isinstance(parsed, list):
+        return None
+    return [it for it in parsed if isinstance(it, dict) and it.get('name') and (it.get('domain') or it.get('host'))]
+
+
+def _netscape_cookies(items: list) -> str:
+    lines = ['# Netscape HTTP Cookie File', '# Converted from a JSON cookie export by FlacLossless', '']
+    for it in items:
+        domain = str(it.get('domain') or it.get('host'))
+        if it.get('hostOnly'):
+            domain = domain.lstrip('.')
+        expires = it.get('expirationDate') or it.get('expires') or it.get('expiry') or 0
+        if it.get('session'):
+            expires = 0
+        lines.append('\t'.join([
+            domain,
+            'TRUE' if domain.startswith('.') else 'FALSE',
+            str(it.get('path') or '/'),
+            'TRUE' if it.get('secure') else 'FALSE',
+            str(int(float(expires))),
+            str(it['name']),
+            str(it.get('value', '')),
+        ]))
+    return '\n'.join(lines) + '\n'
+
+
+class CookieResolver:
+    """
+    Chooses the cookie file handed to yt-dlp.
+    Candidates are checked in order: YT_COOKIES_FILE, the POST /cookies upload
+    location, then the legacy default paths. Each file's verdict is cached
+    against its (mtime, size), so a lookup costs a stat per candidate and
+    files are only re-read when they change. JSON exports are converted to a
+    Netscape cookie file once per version, since that is what yt-dlp reads.
+    """
+
+    def __init__(self, converted_dir: str):
+        self.converted_dir = converted_dir
+        self.lock = threading.Lock()
+        # path -> ((mtime_ns, size), usable path or None, source format)
+        self.checked: Dict[str, tuple] = {}
+        self.current: Optional[str] = None
+        self.lookups = 0
+        self.loads = 0
+        self.conversions = 0
+
+    @staticmethod
+    def candidates() -> list:
+        paths = [
+            os.getenv('YT_COOKIES_FILE'),
+            os.path.join(os.path.dirname(AUDIO_DIR), 'youtube_cookies.txt'),
+            './youtube_cookies.txt',
+            '../youtube_cookies.txt',
+            os.path.join(AUDIO_DIR, 'youtube_cookies.txt'),
+            os.path.expanduser('~/youtube_cookies.txt'),
+            './www.youtube.com_cookies (1).txt',
+            '../www.youtube.com_cookies (1).txt',
+        ]
+        seen = set()
+        ordered = []
+        for path in paths:
+            if path and os.path.abspath(path) not in seen:
+                seen.add(os.path.abspath(path))
+                ordered.append(path)
+        return ordered
+
+    def _load(self, path: str) -> tuple:
+        """Read and classify one candidate; returns (path for yt-dlp or None, format)."""
+        try:
+            with open(path, 'r', encoding='utf-8', errors='ignore') as f:
+                content = f.read()
+        except OSError:
+            return None, None
+        if content.lstrip().startswith(('[', '{')):
+            items = _cookie_items(content)
+            if items and any('youtube' in str(it.get('domain') or it.get('host')).lower() for it in items):
+                return self._convert(path, items), 'json'
+        lower = content.lower()
+        if 'youtube' in lower and 'your_login_here' not in lower:
+            return path, 'netscape'
+        return None, None
+
+    def _convert(self, path: str, items: list) -> Optional[str]:
+        name = f"cookies-{hashlib.sha1(os.path.abspath(path).encode()).hexdigest()[:10]}.netscape.txt"
+        converted = os.path.join(self.converted_dir, name)
+        try:
+            fd, tmp = tempfile.mkstemp(dir=self.converted_dir, suffix='.tmp')
+            with os.fdopen(fd, 'w', encoding='utf-8') as f:
+                f.write(_netscape_cookies(items))
+            os.chmod(tmp, 0o600)
+            os.replace(tmp, converted)
+        except OSError as e:
+            logger.warning(f"Could not convert JSON cookies from {path}: {e}")
+            return None
+        self.conversions += 1
+        logger.info(f"Converted JSON cookie export {path} to {converted} ({len(items)} cookies)")
+        return converted
+
+    def resolve(self) -> Optional[str]:
+        with self.lock:
+            self.lookups += 1
+            chosen = None
+            for path in self.candidates():
+                try:
+                    st = os.stat(path)
+                except OSError:
+                    continue
+                signature = (st.st_mtime_ns, st.st_size)
+                cached = self.checked.get(path)
+                if cached is None or cached[0] != signature:
+                    self.loads += 1
+                    cached = self.checked[path] = (signature, *self._load(path))
+                if cached[1]:
+                    chosen = cached[1]
+                    break
+            if chosen != self.current:
+                logger.info(f"Using cookies from file: {chosen}" if chosen else "No usable cookies file found")
+                self.current = chosen
+            return chosen
+
+    def invalidate(self):
+        with self.lock:
+            self.checked.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        with self.lock:
+            source = next((path for path, c in self.checked.items() if c[1] and c[1] == self.current), None)
+            return {
+                'path': self.current,
+                'source': source,
+                'format': self.checked[source][2] if source else None,
+                'lookups': self.lookups,
+                'loads': self.loads,
+                'conversions': self.conversions,
+            }
+
+
+cookie_resolver = CookieResolver(os.path.dirname(AUDIO_DIR))
+
+
+def get_youtube_cookies():
+    """
+    Get cookie file path for yt-dlp authentication.
+    Called on each request to pick up newly added cookie files.
+    Returns cookie file path or None if unavailable.
+    """
+    try:
+        return cookie_resolver.resolve()
+    except Exception as e:
+        logger.warning(f"Cookie extraction failed: {e}")
+        return None
+
+AUDIO_MIMETYPES = {
+    'mp3': 'audio/mpeg',
+    'm4a': 'audio/mp4',
+    'mp4': 'audio/mp4',
+    'aac': 'audio/aac',
+    'webm': 'audio/webm',
+    'opus': 'audio/ogg',
+    'ogg': 'audio/ogg',
+    'flac': 'audio/flac',
+    'wav': 'audio/wav',
+}
+
+# Audio-only container used when a codec has to be remuxed out of a video file
+CODEC_CONTAINERS = {
+    'aac': 'm4a',
+    'opus': 'opus',
+    'vorbis': 'ogg',
+    'mp3': 'mp3',
+    'flac': 'flac',
+}
+
+# Profiles /stream/<video_id>/<profile> can encode from a stored source ('source' serves it as stored);
+# bitrate is in kbps, None for lossless
+RENDITION_PROFILES = {
+    'flac': {'codec': 'flac', 'bitrate': None, 'ext': 'flac', 'format': 'flac', 'args': ['-c:a', 'flac']},
+    'opus160': {'codec': 'opus', 'bitrate': 160, 'ext': 'opus', 'format': 'opus',
+                'args': ['-c:a', 'libopus', '-b:a', '160k']},
+    'opus96': {'codec': 'opus', 'bitrate': 96, 'ext': 'opus', 'format': 'opus',
+               'args': ['-c:a', 'libopus', '-b:a', '96k']},
+    'mp3_320': {'codec': 'mp3', 'bitrate': 320, 'ext': 'mp3', 'format': 'mp3',
+                'args': ['-c:a', 'libmp3lame', '-b:a', '320k']},
+}
+
+
+def _audio_codec(acodec: Optional[str], ext: str) -> str:
+    """Normalize a yt-dlp acodec string (e.g. 'mp4a.40.2') to a codec name."""
+    acodec = (acodec or '').lower()
+    for prefix, name in (('mp4a', 'aac'), ('aac', 'aac'), ('opus', 'opus'), ('vorbis', 'vorbis'),
+                         ('mp3', 'mp3'), ('flac', 'flac')):
+        if acodec.startswith(prefix):
+            return name
+    return {'m4a': 'aac', 'mp3': 'mp3', 'opus': 'opus', 'webm': 'opus', 'ogg': 'vorbis', 'flac': 'flac'}.get(ext, 'unknown')
+
+
+class JobCancelled(Exception):
+    """Raised inside a worker (progress hook, ffmpeg wait) once its job has been cancelled."""
+
+
+def _run_ffmpeg(args: list, timeout: int, job=None) -> subprocess.CompletedProcess:
+    """
+    subprocess.run for ffmpeg that exposes the child on `job.process`, so
+    cancelling the job can terminate it. Raises JobCancelled if it was.
+    """
+    if job is not None and job.cancel_requested:
+        raise JobCancelled(job.job_id)
+    proc = subprocess.Popen(args, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
+    if job is not None:
+        job.process = proc
+    try:
+        stdout, stderr = proc.communicate(timeout=timeout)
+    except subprocess.TimeoutExpired:
+        proc.kill()
+        proc.communicate()
+        raise
+    finally:
+        if job is not None:
+            job.process = None
+    if job is not None and job.cancel_requested:
+        raise JobCancelled(job.job_id)
+    return subprocess.CompletedProcess(args, proc.returncode, stdout, stderr)
+
+
+def _remux_audio_only(src_path: str, codec: str, job=None) -> str:
+    """Copy the audio stream out of a video container without re-encoding. Returns the path to serve."""
+    dst_path = f"{os.path.splitext(src_path)[0]}.{CODEC_CONTAINERS.get(codec, 'm4a')}"
+    if dst_path == src_path:
+        dst_path = f"{os.path.splitext(src_path)[0]}.audio.{CODEC_CONTAINERS.get(codec, 'm4a')}"
+    if job is not None:
+        job.work_files.add(dst_path)
+    try:
+        result = _run_ffmpeg(['ffmpeg', '-i', src_path, '-vn', '-c:a', 'copy', '-y', dst_path], 120, job)
+        if result.returncode == 0 and os.path.exists(dst_path) and os.path.getsize(dst_path) > 0:
+            os.remove(src_path)
+            return dst_path
+        logger.error(f"FFmpeg remux failed: {result.stderr}")
+    except JobCancelled:
+        raise
+    except Exception as e:
+        logger.error(f"Remux error: {e}")
+    return src_path
+
+
+def _pcm_blocks(path: str, timeout: int = ANALYSIS_TIMEOUT, job=None):
+    """
+    Decode `path` with ffmpeg to 48 kHz stereo int16 and yield (frames, 2)
+    arrays as they arrive, so a long mix is never held in memory at once.
+    With a job, the decoder is exposed on `job.process` like _run_ffmpeg,
+    and JobCancelled is raised once the job has been cancelled.
+    """
+    if job is not None and job.cancel_requested:
+        raise JobCancelled(job.job_id)
+    proc = subprocess.Popen(
+        ['ffmpeg', '-v', 'error', '-i', path, '-vn', '-ac', '2', '-ar', str(ANALYSIS_SAMPLE_RATE), '-f', 's16le', '-'],
+        stdout=subprocess.PIPE, stderr=subprocess.DEVNULL
+    )
+    if job is not None:
+        job.process = proc
+    watchdog = threading.Timer(timeout, proc.kill)
+    watchdog.start()
+    try:
+        carry = b''
+        while True:
+            data = proc.stdout.read(1 << 18)
+            if not data:
+                break
+            data = carry + data
+            usable = len(data) - len(data) % 4
+            carry = data[usable:]
+            if usable:
+                yield np.frombuffer(data[:usable], dtype='<i2').reshape(-1, 2)
+        if job is not None and job.cancel_requested:
+            raise JobCancelled(job.job_id)
+        if proc.wait() != 0:
+            raise RuntimeError(f"ffmpeg could not decode {os.path.basename(path)} (exit {proc.returncode})")
+    finally:
+        if job is not None:
+            job.process = None
+        watchdog.cancel()
+        proc.stdout.close()
+        if proc.poll() is None:
+            proc.kill()
+            proc.wait()
+
+
+class WaveformBuilder:
+    """
+    Min/max peak pyramid built incrementally from decoded PCM blocks.
+    Stored as a little-endian header (magic, version, bits, level count,
+    first level, sample rate, samples per peak at the first level), one
+    uint32 peak count per level, then each level's interleaved min/max
+    values as int8 or int16. A single level is served in the same layout.
+    """
+
+    MAGIC = b'FLPK'
+    HEADER = struct.Struct('<4sBBBBII')
+
+    def __init__(self, base_samples: int = WAVEFORM_BASE_SAMPLES, levels: int = WAVEFORM_LEVELS,
+                 bits: int = WAVEFORM_BITS):
+        self.base = base_samples
+        self.levels = max(1, levels)
+        self.bits = bits
+        self.mins: list = []
+        self.maxs: list = []
+        self.carry_min = np.empty(0, dtype=np.int16)
+        self.carry_max = np.empty(0, dtype=np.int16)
+
+    def feed(self, block):
+        lo = np.concatenate((self.carry_min, block.min(axis=1)))
+        hi = np.concatenate((self.carry_max, block.max(axis=1)))
+        whole = len(lo) // self.base * self.base
+        if whole:
+            self.mins.append(lo[:whole].reshape(-1, self.base).min(axis=1))
+            self.maxs.append(hi[:whole].reshape(-1, self.base).max(axis=1))
+        self.carry_min, self.carry_max = lo[whole:], hi[whole:]
+
+    def finish(self) -> bytes:
+        if len(self.carry_min):
+            self.mins.append(self.carry_min.min(keepdims=True))
+            self.maxs.append(self.carry_max.max(keepdims=True))
+        lo = np.concatenate(self.mins) if self.mins else np.zeros(1, dtype=np.int16)
+        hi = np.concatenate(self.maxs) if self.maxs else np.zeros(1, dtype=np.int16)
+        pyramid = [(lo, hi)]
+        while len(pyramid) < self.levels and len(lo) > 1:
+            if len(lo) % 2:
+                lo, hi = np.append(lo, lo[-1]), np.append(hi, hi[-1])
+            lo, hi = lo.reshape(-1, 2).min(axis=1), hi.reshape(-1, 2).max(axis=1)
+            pyramid.append((lo, hi))
+        counts = struct.pack(f'<{len(pyramid)}I', *(len(level_lo) for level_lo, _ in pyramid))
+        header = self.HEADER.pack(self.MAGIC, 1, self.bits, len(pyramid), 0, ANALYSIS_SAMPLE_RATE, self.base)
+        return header + counts + b''.join(self._encode(level_lo, level_hi) for level_lo, level_hi in pyramid)
+
+    def _encode(self, lo, hi) -> bytes:
+        pairs = np.stack((lo, hi), axis=1).ravel()
+        if self.bits == 8:
+            return (pairs >> 8).astype(np.int8).tobytes()
+        return pairs.astype('<i2').tobytes()
+
+    @classmethod
+    def read_level(cls, data: bytes, level: int) -> Optional[bytes]:
+        """One level of a stored pyramid in the single-level layout, or None if it does not exist."""
+        magic, version, bits, levels, first, rate, base = cls.HEADER.unpack_from(data)
+        if magic != cls.MAGIC or not 0 <= level < levels:
+            return None
+        counts = struct.unpack_from(f'<{levels}I', data, cls.HEADER.size)
+        width = 2 * (bits // 8)
+        offset = cls.HEADER.size + 4 * levels + width * sum(counts[:level])
+        return (cls.HEADER.pack(cls.MAGIC, version, bits, 1, first + level, rate, base << level)
+                + struct.pack('<I', counts[level])
+                + data[offset:offset + width * counts[level]])
+
+
+def _k_weighting_response(taps: int = 8192):
+    """
+    Impulse response of the BS.1770 K-weighting filter (high shelf + RLB
+    high-pass, 48 kHz coefficients), truncated where it has decayed below
+    1e-15 so it can be applied block-wise by FFT convolution.
+    """
+    stages = (
+        ((1.53512485958697, -2.69169618940638, 1.19839281085285), (-1.69065929318241, 0.73248077421585)),
+        ((1.0, -2.0, 1.0), (-1.99004745483398, 0.99007225036621)),
+    )
+    signal = [1.0] + [0.0] * (taps - 1)
+    for (b0, b1, b2), (a1, a2) in stages:
+        out, x1, x2, y1, y2 = [], 0.0, 0.0, 0.0, 0.0
+        for x in signal:
+            y = b0 * x + b1 * x1 + b2 * x2 - a1 * y1 - a2 * y2
+            out.append(y)
+            x1, x2, y1, y2 = x, x1, y, y1
+        signal = out
+    return np.array(signal)
+
+
+def _true_peak_phases(factor: int = 4, taps_per_phase: int = 12):
+    """Polyphase windowed-sinc interpolator for 4x oversampled true-peak detection."""
+    n = np.arange(factor * taps_per_phase)
+    centre = (len(n) - 1) / 2
+    h = np.sinc((n - centre) / factor) * np.hanning(len(n))
+    phases = h.reshape(taps_per_phase, factor).T
+    return phases / phases.sum(axis=1, keepdims=True)
+
+
+class LoudnessMeter:
+    """
+    EBU R128 / ITU-R BS.1770-4 measurement over streamed 48 kHz stereo PCM.
+    Each block is K-weighted by FFT convolution (the filter tail is carried
+    into the next block) and reduced to per-channel energy per 100 ms step;
+    gating runs once at the end over those steps: integrated loudness on
+    400 ms blocks (absolute -70 LUFS, relative -10 LU gates), loudness range
+    on 3 s windows (-20 LU relative gate, 10th-95th percentile spread), and
+    true peak from a 4x polyphase interpolation of the unfiltered signal.
+    """
+
+    STEP = ANALYSIS_SAMPLE_RATE // 10
+    _weighting = None
+    _phases = None
+    # FFT size -> spectrum of the K-weighting response
+    _spectra: Dict[int, Any] = {}
+
+    def __init__(self):
+        if LoudnessMeter._weighting is None:
+            LoudnessMeter._weighting = _k_weighting_response()
+            LoudnessMeter._phases = _true_peak_phases()
+        self.tail = np.zeros((len(self._weighting) - 1, 2))
+        self.pending = np.zeros((0, 2))
+        self.steps: list = []
+        self.history = np.zeros((self._phases.shape[1] - 1, 2))
+        self.peak = 0.0
+
+    def feed(self, block):
+        x = block / 32768.0
+        self._measure_peak(x)
+        y = self._k_weight(x)
+        y = np.concatenate((self.pending, y))
+        whole = len(y) // self.STEP * self.STEP
+        if whole:
+            self.steps.append(np.square(y[:whole]).reshape(-1, self.STEP, 2).sum(axis=1))
+        self.pending = y[whole:]
+
+    def _k_weight(self, x):
+        taps = self._weighting
+        n = len(x) + len(taps) - 1
+        size = 1 << (n - 1).bit_length()
+        spectrum = self._spectra.get(size)
+        if spectrum is None:
+            spectrum = self._spectra[size] = np.fft.rfft(taps, size)[:, None]
+        y = np.fft.irfft(np.fft.rfft(x, size, axis=0) * spectrum, size, axis=0)[:n]
+        y[:len(self.tail)] += self.tail
+        self.tail = y[len(x):]
+        return y[:len(x)]
+
+    def _measure_peak(self, x):
+        padded = np.concatenate((self.history, x))
+        self.history = padded[len(padded) - len(self.history):]
+        windows = np.lib.stride_tricks.sliding_window_view(padded, self._phases.shape[1], axis=0)
+        self.peak = max(self.peak, float(np.abs(x).max()), float(np.abs(windows @ self._phases.T).max()))
+
+    @staticmethod
+    def _lufs(energy):
+        with np.errstate(divide='ignore'):
+            return -0.691 + 10 * np.log10(energy)
+
+    def _gated(self, windows, steps: int, relative_gate: float):
+        """Loudness of each window of `steps` steps that passes both gates, plus their mean energy."""
+        energy = (windows[steps:] - windows[:-steps]).sum(axis=1) / (steps * self.STEP)
+        loudness = self._lufs(energy)
+        above = loudness > -70
+        if not above.any():
+            return loudness[:0], None
+        threshold = self._lufs(energy[above].mean()) + relative_gate
+        keep = above & (loudness > threshold)
+        return loudness[keep], energy[keep].mean()
+
+    def finish(self) -> Dict[str, Any]:
+        steps = np.concatenate(self.steps) if self.steps else np.zeros((0, 2))
+        cumulative = np.vstack((np.zeros((1, 2)), np.cumsum(steps, axis=0)))
+        integrated = loudness_range = None
+        if len(steps) >= 4:
+            _, energy = self._gated(cumulative, 4, -10)
+            if energy is not None:
+                integrated = round(float(self._lufs(energy)), 2)
+        if len(steps) >= 30:
+            short_term, _ = self._gated(cumulative, 30, -20)
+            if len(short_term):
+                low, high = np.percentile(short_term, [10, 95])
+                loudness_range = round(float(high - low), 2)
+        true_peak = round(float(20 * np.log10(self.peak)), 2) if self.peak > 0 else None
+        return {
+            'integrated_lufs': integrated,
+            'range_lu': loudness_range,
+            'true_peak_dbtp': true_peak,
+            'replaygain_track_gain_db': round(REPLAYGAIN_REFERENCE_LUFS - integrated, 2) if integrated is not None else None,
+            'replaygain_track_peak': round(self.peak, 6),
+        }
+
+
+def _analyze_track(file_path: str, loudness: bool = False, job=None) -> Dict[str, Any]:
+    """
+    Decode a stored track once and run whatever analysis it still lacks:
+    the waveform sidecar (written next to it) and, when asked, loudness.
+    Returns {'loudness': {...}} when loudness was measured; problems are
+    logged and never fail the job.
+    """
+    if np is None:
+        return {}
+    peaks_path = _peaks_path(file_path)
+    waveform = WaveformBuilder() if WAVEFORM_PEAKS and not os.path.exists(peaks_path) else None
+    meter = LoudnessMeter() if loudness and LOUDNESS_ANALYSIS else None
+    if waveform is None and meter is None:
+        return {}
+    started = time.monotonic()
+    result: Dict[str, Any] = {}
+    try:
+        for block in _pcm_blocks(file_path, job=job):
+            if waveform is not None:
+                waveform.feed(block)
+            if meter is not None:
+                meter.feed(block)
+        if waveform is not None:
+            data = waveform.finish()
+            tmp_path = f"{peaks_path}.{uuid.uuid4().hex}.tmp"
+            with open(tmp_path, 'wb') as f:
+                f.write(data)
+            os.replace(tmp_path, peaks_path)
+            disk_budget.grow(os.path.basename(file_path), len(data))
+        if meter is not None:
+            result['loudness'] = meter.finish()
+    except JobCancelled:
+        raise
+    except Exception as e:
+        logger.warning(f"Audio analysis of {os.path.basename(file_path)} failed: {e}")
+        return {}
+    kind = '+'.join(k for k, on in (('waveform', waveform), ('loudness', meter)) if on is not None)
+    metrics.observe('flac_analysis_seconds', time.monotonic() - started, kind=kind)
+    return result
+
+
+# Codecs fMP4 segments can carry as-is; anything else is re-encoded to AAC for segmenting
+SEGMENT_COPY_CODECS = {'aac', 'mp3', 'opus', 'flac'}
+HLS_MIMETYPES = {
+    'm3u8': 'application/vnd.apple.mpegurl',
+    'mp4': 'audio/mp4',
+    'm4s': 'audio/mp4',
+}
+_HLS_FILE_RE = re.compile(r'^(index\.m3u8|init\.mp4|seg\d{5}\.m4s)$')
+
+
+def _segment_track(file_path: str, codec: str, job=None) -> bool:
+    """
+    Cut a stored track into fixed-duration fMP4 segments plus a VOD HLS
+    playlist next to it, copying the audio stream when the codec fits in
+    fMP4. Output is built in a scratch directory and renamed into place,
+    so a playlist is never visible half-written. Returns True when new
+    segments were written; failures are logged and never fail the job.
+    """
+    target = _segments_dir(file_path)
+    if os.path.exists(os.path.join(target, 'index.m3u8')):
+        return False
+    scratch = f"{target}.{uuid.uuid4().hex}.tmp"
+    os.makedirs(scratch)
+    audio_args = ['-c:a', 'copy'] if codec in SEGMENT_COPY_CODECS else ['-c:a', 'aac', '-b:a', '192k']
+    started = time.monotonic()
+    try:
+        result = _run_ffmpeg(
+            ['ffmpeg', '-v', 'error', '-i', file_path, '-vn', '-map', '0:a:0', *audio_args,
+             '-f', 'hls', '-hls_time', str(SEGMENT_SECONDS), '-hls_playlist_type', 'vod',
+             '-hls_segment_type', 'fmp4', '-hls_fmp4_init_filename', 'init.mp4',
+             '-hls_segment_filename', os.path.join(scratch, 'seg%05d.m4s'),
+             os.path.join(scratch, 'index.m3u8')],
+            300, job
+        )
+        if result.returncode != 0 or not os.path.exists(os.path.join(scratch, 'index.m3u8')):
+            logger.warning(f"Segmenting {os.path.basename(file_path)} failed: {result.stderr}")
+            return False
+        size = sum(os.path.getsize(os.path.join(scratch, f)) for f in os.listdir(scratch))
+        try:
+            os.rename(scratch, target)
+        except OSError:
+            # Another worker segmented the same blob first
+            return False
+    except JobCancelled:
+        raise
+    except Exception as e:
+        logger.warning(f"Segmenting {os.path.basename(file_path)} failed: {e}")
+        return False
+    finally:
+        shutil.rmtree(scratch, ignore_errors=True)
+    disk_budget.grow(os.path.basename(file_path), size)
+    metrics.observe('flac_transcode_seconds', time.monotonic() - started, operation='segment')
+    return True
+
+
+class SegmentPool:
+    """
+    Segments stored tracks on demand on SEGMENT_WORKERS threads, started on
+    first use. Keyed by blob, so concurrent first requests for a track (or
+    for videos sharing its blob) run one ffmpeg; at most `max_pending`
+    blobs are queued or running, and a blob that failed is not retried.
+    """
+
+    def __init__(self, workers: int, max_pending: int):
+        self.workers = max(1, workers)
+        self.max_pending = max(1, max_pending)
+        self.queue: Queue = Queue()
+        self.lock = threading.Lock()
+        self.pending: set = set()
+        self.failures: set = set()
+        self.started = False
+        self.done = 0
+        self.failed = 0
+
+    def request(self, file_path: str, codec: str) -> str:
+        """Queue segmenting of a stored file: 'pending' (queued now or before), 'full' or 'failed'."""
+        name = os.path.basename(file_path)
+        with self.lock:
+            if name in self.pending:
+                return 'pending'
+            if name in self.failures:
+                return 'failed'
+            if len(self.pending) >= self.max_pending:
+                return 'full'
+            self.pending.add(name)
+            if not self.started:
+                self.started = True
+                for _ in range(self.workers):
+                    threading.Thread(target=self._worker, daemon=True).start()
+        self.queue.put((file_path, codec))
+        return 'pending'
+
+    def _worker(self):
+        while True:
+            file_path, codec = self.queue.get()
+            try:
+                _segment_track(file_path, codec)
+            except Exception as e:
+                logger.error(f"Segmenting {os.path.basename(file_path)} failed: {e}")
+            ok = os.path.exists(os.path.join(_segments_dir(file_path), 'index.m3u8'))
+            with self.lock:
+                self.pending.discard(os.path.basename(file_path))
+                if ok:
+                    self.done += 1
+                else:
+                    self.failed += 1
+                    self.failures.add(os.path.basename(file_path))
+
+    def stats(self) -> Dict[str, Any]:
+        with self.lock:
+            return {'workers': self.workers, 'pending': len(self.pending), 'done': self.done, 'failed': self.failed}
+
+
+segment_pool = SegmentPool(SEGMENT_WORKERS, SEGMENT_QUEUE_SIZE)
+
+
+def _blob_loudness(name: str) -> Optional[Dict[str, Any]]:
+    """Loudness already measured for a stored file by any video that references it."""
+    for video_id in cache.owners(name):
+        loudness = (cache.get(video_id) or {}).get('metadata', {}).get('loudness')
+        if loudness:
+            return loudness
+    return None
+
+
+def _analyze_entry(video_id: str) -> bool:
+    """Backfill analysis for one library entry; the loudness lands in every entry sharing the file."""
+    entry = cache.get(video_id)
+    if not entry or not os.path.exists(entry.get('file', '')):
+        return False
+    name = os.path.basename(entry['file'])
+    loudness = entry.get('metadata', {}).get('loudness') or _blob_loudness(name)
+    if loudness is None:
+        loudness = _analyze_track(entry['file'], loudness=True).get('loudness')
+        if loudness is None and LOUDNESS_ANALYSIS:
+            return False
+    else:
+        _analyze_track(entry['file'])
+    if loudness:
+        for owner in cache.owners(name):
+            metadata = (cache.get(owner) or {}).get('metadata', {})
+            if metadata.get('loudness') != loudness:
+                cache.update(owner, metadata={**metadata, 'loudness': loudness})
+    return not WAVEFORM_PEAKS or os.path.exists(_peaks_path(entry['file']))
+
+
+class AnalysisBackfill:
+    """
+    Analyzes library entries stored before waveform/loudness analysis
+    existed (or while it was disabled) on ANALYSIS_WORKERS threads, started
+    on first use. A video_id already queued is not queued again. On-demand
+    requests (a /waveform for an unanalyzed track) are bounded by
+    `max_pending` and not retried after a failure; an explicit backfill is
+    neither.
+    """
+
+    def __init__(self, workers: int, max_pending: int):
+        self.workers = max(1, workers)
+        self.max_pending = max(1, max_pending)
+        self.queue: Queue = Queue()
+        self.lock = threading.Lock()
+        self.pending: set = set()
+        # video_ids whose last analysis failed; cleared by an explicit backfill
+        self.failures: set = set()
+        self.started = False
+        self.done = 0
+        self.failed = 0
+
+    def request(self, video_id: str) -> str:
+        """Queue one on-demand analysis: 'pending' (queued now or before), 'full' or 'failed'."""
+        with self.lock:
+            if video_id in self.pending:
+                return 'pending'
+            if video_id in self.failures:
+                return 'failed'
+            if len(self.pending) >= self.max_pending:
+                return 'full'
+        self.submit([video_id], retry=False)
+        return 'pending'
+
+    def submit(self, video_ids: list, retry: bool = True) -> int:
+        with self.lock:
+            if retry:
+                self.failures.difference_update(video_ids)
+            fresh = [vid for vid in video_ids if vid not in self.pending]
+            self.pending.update(fresh)
+            if fresh and not self.started:
+                self.started = True
+                for _ in range(self.workers):
+                    threading.Thread(target=self._worker, daemon=True).start()
+        for video_id in fresh:
+            self.queue.put(video_id)
+        return len(fresh)
+
+    def _worker(self):
+        while True:
+            video_id = self.queue.get()
+            try:
+                ok = _analyze_entry(video_id)
+            except Exception as e:
+                logger.error(f"Analysis backfill of {video_id} failed: {e}")
+                ok = False
+            with self.lock:
+                self.pending.discard(video_id)
+                if ok:
+                    self.done += 1
+                else:
+                    self.failed += 1
+                    self.failures.add(video_id)
+
+    def stats(self) -> Dict[str, Any]:
+        with self.lock:
+            return {'workers': self.workers, 'pending': len(self.pending), 'done': self.done, 'failed': self.failed}
+
+
+analysis_backfill = AnalysisBackfill(ANALYSIS_WORKERS, ANALYSIS_QUEUE_SIZE)
+
+
+def _source_fits(entry: Dict[str, Any], profile: str) -> bool:
+    """True if the stored source already is `profile` (same codec, no higher bitrate), so encoding would only lose quality."""
+    spec = RENDITION_PROFILES[profile]
+    if entry.get('codec') != spec['codec']:
+        return False
+    if spec['bitrate'] is None:
+        return True
+    return bool(entry.get('bitrate')) and entry['bitrate'] <= spec['bitrate']
+
+
+def _rendition_file(entry: Dict[str, Any], profile: str) -> Optional[str]:
+    """Stored file that serves `profile` for a library entry, or None if it still has to be encoded."""
+    if profile == 'source' or _source_fits(entry, profile):
+        return entry['file']
+    record = cache.get_rendition(entry.get('digest', ''), profile)
+    if record and os.path.exists(record['file']):
+        return record['file']
+    return None
+
+
+def _encode_rendition(entry: Dict[str, Any], profile: str) -> str:
+    """
+    Encode `profile` from a library entry's stored source (the file as
+    downloaded, the best quality the library has) and index it as its own
+    file with its own disk budget record. Returns the rendition path.
+    """
+    spec = RENDITION_PROFILES[profile]
+    digest = entry['digest']
+    path = os.path.join(AUDIO_DIR, f"{digest}.{profile}.{spec['ext']}")
+    scratch = f"{path}.{uuid.uuid4().hex}.tmp"
+    started = time.monotonic()
+    try:
+        result = _run_ffmpeg(
+            ['ffmpeg', '-v', 'error', '-i', entry['file'], '-vn', '-map', '0:a:0', *spec['args'],
+             '-f', spec['format'], '-y', scratch],
+            300
+        )
+        if result.returncode != 0 or not os.path.exists(scratch) or os.path.getsize(scratch) == 0:
+            raise RuntimeError(f"ffmpeg could not encode {profile}: {result.stderr.strip()[-500:]}")
+        os.replace(scratch, path)
+    finally:
+        if os.path.exists(scratch):
+            os.remove(scratch)
+    metrics.observe('flac_transcode_seconds', time.monotonic() - started, operation=profile)
+    with blob_lock:
+        if not cache.owners(os.path.basename(entry['file'])):
+            # The source was evicted or deleted while encoding
+            os.remove(path)
+            raise RuntimeError(f"{os.path.basename(entry['file'])} is no longer stored")
+        cache.put_rendition(digest, profile, {
+            'file': path,
+            'source': os.path.basename(entry['file']),
+            'codec': spec['codec'],
+            'bitrate': spec['bitrate'],
+            'mimetype': AUDIO_MIMETYPES.get(spec['ext'], 'application/octet-stream'),
+            'created_at': datetime.now().isoformat(),
+            'hits': 0,
+        })
+        disk_budget.track(os.path.basename(path), os.path.getsize(path))
+    logger.info(f"Encoded {profile} rendition of {os.path.basename(entry['file'])}")
+    return path
+
+
+class RenditionPool:
+    """
+    Encodes renditions on a bounded set of threads, started on first use.
+    Concurrent requests for the same (blob, profile) share one encode, and
+    at most `max_pending` encodes are queued or running at a time.
+    """
+
+    def __init__(self, workers: int, max_pending: int):
+        self.workers = max(1, workers)
+        self.max_pending = max(1, max_pending)
+        self.queue: Queue = Queue()
+        self.lock = threading.Lock()
+        # (digest, profile) -> task shared by every request waiting on that encode
+        self.pending: Dict[tuple, Dict[str, Any]] = {}
+        self.started = False
+        self.done = 0
+        self.failed = 0
+        self.rejected = 0
+
+    def submit(self, entry: Dict[str, Any], profile: str) -> Optional[Dict[str, Any]]:
+        """Queue an encode, or join the one already pending; None if the pool is full."""
+        key = (entry['digest'], profile)
+        with self.lock:
+            task = self.pending.get(key)
+            if task is not None:
+                return task
+            if len(self.pending) >= self.max_pending:
+                self.rejected += 1
+                return None
+            task = {'entry': entry, 'profile': profile, 'event': threading.Event(), 'path': None, 'error': None}
+            self.pending[key] = task
+            if not self.started:
+                self.started = True
+                for _ in range(self.workers):
+                    threading.Thread(target=self._worker, daemon=True).start()
+        self.queue.put(task)
+        return task
+
+    def _worker(self):
+        while True:
+            task = self.queue.get()
+            try:
+                task['path'] = _encode_rendition(task['entry'], task['profile'])
+            except Exception as e:
+                logger.error(f"Encoding {task['profile']} of {task['entry']['digest']} failed: {e}")
+                task['error'] = str(e)
+            with self.lock:
+                self.pending.pop((task['entry']['digest'], task['profile']), None)
+                if task['error'] is None:
+                    self.done += 1
+                else:
+                    self.failed += 1
+            task['event'].set()
+
+    def stats(self) -> Dict[str, Any]:
+        with self.lock:
+            return {
+                'workers': self.workers,
+                'pending': len(self.pending),
+                'done': self.done,
+                'failed': self.failed,
+                'rejected': self.rejected,
+            }
+
+
+rendition_pool = RenditionPool(RENDITION_WORKERS, RENDITION_QUEUE_SIZE)
+
+
+class GrowingFile:
+    """
+    An audio file yt-dlp is still writing, served to readers while it grows.
+    The progress hook advances it; readers block on the condition until the
+    bytes they need are on disk, the download finishes, or it fails.
+    """
+
+    def __init__(self, name: str, part_path: str, final_path: str):
+        self.name = name
+        self.part_path = part_path
+        self.final_path = final_path
+        self.mimetype = AUDIO_MIMETYPES.get(name.rsplit('.', 1)[-1], 'application/octet-stream')
+        self.size = 0
+        self.expected_size: Optional[int] = None
+        self.complete = False
+        self.failed = False
+        self.cond = threading.Condition()
+
+    def advance(self, size: int, expected_size: Optional[int] = None):
+        with self.cond:
+            self.size = max(self.size, size)
+            if expected_size:
+                self.expected_size = expected_size
+            self.cond.notify_all()
+
+    def finish(self):
+        with self.cond:
+            if os.path.exists(self.final_path):
+                self.size = os.path.getsize(self.final_path)
+                self.expected_size = self.size
+                self.complete = True
+            else:
+                self.failed = True
+            self.cond.notify_all()
+
+    def fail(self):
+        with self.cond:
+            if not self.complete:
+                self.failed = True
+            self.cond.notify_all()
+
+    def open(self):
+        """Open whichever of the .part or final file currently exists; the handle survives the rename."""
+        for path in (self.part_path, self.final_path):
+            try:
+                return open(path, 'rb')
+            except FileNotFoundError:
+                continue
+        raise FileNotFoundError(self.final_path)
+
+    def wait_for(self, f, offset: int, timeout: float) -> int:
+        """Block until there are bytes past `offset` on disk (or the file is done); return the on-disk size."""
+        deadline = time.time() + timeout
+        with self.cond:
+            while True:
+                available = os.fstat(f.fileno()).st_size
+                if available > offset or self.complete or self.failed:
+                    return available
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    return available
+                self.cond.wait(min(remaining, 1.0))
+
+
+# stream filename -> file still being downloaded
+growing_files: Dict[str, GrowingFile] = {}
+growing_lock = threading.Lock()
+
+
+def _release_growing(growing: Optional[GrowingFile], completed: bool):
+    if growing is None:
+        return
+    if completed:
+        growing.finish()
+    else:
+        growing.fail()
+    with growing_lock:
+        if growing_files.get(growing.name) is growing:
+            del growing_files[growing.name]
+
+
+class _PooledExtractor:
+    __slots__ = ('ydl', 'key', 'cookie_mtime', 'created', 'last_used', 'uses', 'hook')
+
+    def __init__(self, ydl, key: str, cookie_mtime: Optional[float]):
+        self.ydl = ydl
+        self.key = key
+        self.cookie_mtime = cookie_mtime
+        self.created = time.monotonic()
+        self.last_used = self.created
+        self.uses = 0
+        self.hook = None
+
+    def dispatch(self, d):
+        hook = self.hook
+        if hook is not None:
+            hook(d)
+
+
+def _cookie_mtime(opts: Dict[str, Any]) -> Optional[float]:
+    cookiefile = opts.get('cookiefile')
+    try:
+        return os.path.getmtime(cookiefile) if cookiefile else None
+    except OSError:
+        return None
+
+
+class ExtractorPool:
+    """
+    Warm yt_dlp.YoutubeDL instances keyed by their options.
+    Building a YoutubeDL re-creates its request director (HTTP sessions),
+    cookie jar and extractor instances; a leased instance keeps all three, so
+    repeated jobs reuse keep-alive connections to the same hosts. The output
+    template and progress hook vary per job and are excluded from the key:
+    each instance carries one dispatching hook and gets its template set on
+    lease. Instances are retired after EXTRACTOR_MAX_USES leases, after
+    sitting idle EXTRACTOR_IDLE_SECONDS, when their cookie file changes, or
+    when a lease ends in an unexpected error.
+    """
+
+    def __init__(self, max_idle: int, idle_seconds: int, max_uses: int):
+        self.max_idle = max_idle
+        self.idle_seconds = idle_seconds
+        self.max_uses = max_uses
+        self.lock = threading.Lock()
+        # key -> idle instances, most recently used last
+        self.idle: Dict[str, list] = {}
+        self.idle_count = 0
+        self.leased = 0
+        self.created = 0
+        self.reused = 0
+        self.retired = 0
+
+    @staticmethod
+    def _key(opts: Dict[str, Any]) -> str:
+        keyed = {k: v for k, v in opts.items() if k not in ('outtmpl', 'progress_hooks')}
+        return json.dumps(keyed, sort_keys=True, default=str)
+
+    def _healthy(self, entry: _PooledExtractor, now: float) -> bool:
+        return (entry.uses < self.max_uses
+                and now - entry.last_used < self.idle_seconds
+                and entry.cookie_mtime == _cookie_mtime(entry.ydl.params))
+
+    def _create(self, opts: Dict[str, Any], key: str) -> _PooledExtractor:
+        params = copy.deepcopy({k: v for k, v in opts.items() if k not in ('outtmpl', 'progress_hooks')})
+        ydl = yt_dlp.YoutubeDL(params)
+        entry = _PooledExtractor(ydl, key, _cookie_mtime(params))
+        ydl.add_progress_hook(entry.dispatch)
+        # Instantiate the YouTube extractor up front rather than on the first URL
+        ydl.get_info_extractor('Youtube')
+        with self.lock:
+            self.created += 1
+        return entry
+
+    def _close(self, entry: _PooledExtractor):
+        try:
+            entry.ydl.close()
+        except Exception as e:
+            logger.warning(f"Closing pooled extractor failed: {e}")
+
+    def _acquire(self, opts: Dict[str, Any]) -> _PooledExtractor:
+        key = self._key(opts)
+        stale = []
+        entry = None
+        now = time.monotonic()
+        with self.lock:
+            bucket = self.idle.get(key)
+            while bucket:
+                candidate = bucket.pop()
+                self.idle_count -= 1
+                if self._healthy(candidate, now):
+                    entry = candidate
+                    self.reused += 1
+                    break
+                stale.append(candidate)
+                self.retired += 1
+            if bucket is not None and not bucket:
+                del self.idle[key]
+            self.leased += 1
+        for old in stale:
+            self._close(old)
+        return entry or self._create(opts, key)
+
+    def _return(self, entry: _PooledExtractor, reusable: bool):
+        entry.hook = None
+        entry.uses += 1
+        entry.last_used = time.monotonic()
+        evicted = []
+        with self.lock:
+            self.leased -= 1
+            if reusable and entry.uses < self.max_uses:
+                self.idle.setdefault(entry.key, []).append(entry)
+                self.idle_count += 1
+            else:
+                evicted.append(entry)
+            for key in list(self.idle):
+                bucket = self.idle[key]
+                while bucket and entry.last_used - bucket[0].last_used >= self.idle_seconds:
+                    evicted.append(bucket.pop(0))
+                    self.idle_count -= 1
+                if not bucket:
+                    del self.idle[key]
+            # Beyond the idle budget, drop the least recently used instances
+            while self.idle_count > self.max_idle:
+                oldest_key = min(self.idle, key=lambda k: self.idle[k][0].last_used)
+                evicted.append(self.idle[oldest_key].pop(0))
+                self.idle_count -= 1
+                if not self.idle[oldest_key]:
+                    del self.idle[oldest_key]
+            self.retired += len(evicted)
+        for old in evicted:
+            self._close(old)
+
+    def lease(self, opts: Dict[str, Any], outtmpl: Optional[str] = None, progress_hook=None):
+        """Context manager yielding a YoutubeDL configured with `opts`, returned to the pool on exit."""
+        return _ExtractorLease(self, opts, outtmpl, progress_hook)
+
+    def warm(self, opts: Dict[str, Any]):
+        """Build an instance for `opts` ahead of the first lease."""
+        entry = self._create(opts, self._key(opts))
+        with self.lock:
+            self.idle.setdefault(entry.key, []).append(entry)
+            self.idle_count += 1
+
+    def stats(self) -> Dict[str, Any]:
+        with self.lock:
+            return {
+                'idle': self.idle_count,
+                'leased': self.leased,
+                'created': self.created,
+                'reused': self.reused,
+                'retired': self.retired,
+            }
+
+
+class _ExtractorLease:
+    def __init__(self, pool: ExtractorPool, opts: Dict[str, Any], outtmpl: Optional[str], progress_hook):
+        self.pool = pool
+        self.opts = opts
+        self.outtmpl = outtmpl
+        self.progress_hook = progress_hook
+        self.entry: Optional[_PooledExtractor] = None
+
+    def __enter__(self):
+        self.entry = self.pool._acquire(self.opts)
+        ydl = self.entry.ydl
+        if self.outtmpl is not None:
+            # YoutubeDL normalizes outtmpl to a dict of templates on construction
+            ydl.params['outtmpl']['default'] = self.outtmpl
+        self.entry.hook = self.progress_hook
+        return ydl
+
+    def __exit__(self, exc_type, exc, tb):
+        # yt-dlp reports extraction/download failures as DownloadError and stays usable
+        reusable = exc_type is None or issubclass(exc_type, (yt_dlp.utils.DownloadError, JobCancelled))
+        self.pool._return(self.entry, reusable)
+        return False
+
+
+extractor_pool = ExtractorPool(EXTRACTOR_POOL_SIZE, EXTRACTOR_IDLE_SECONDS, EXTRACTOR_MAX_USES)
+
+
+def _download_opts() -> Dict[str, Any]:
+    """yt-dlp options for the primary download attempt (output template and hooks are set per lease)."""
+    ffmpeg_location = shutil.which('ffmpeg') or '/home/runner/.nix-profile/bin/ffmpeg'
+    
+    ydl_opts = {
+        'format': 'bestaudio[ext=m4a]/bestaudio/best',
+        'quiet': False,
+        'no_warnings': False,
+        'nocheckcertificate': True,
+        'geo_bypass': True,
+        'geo_bypass_country': 'US',
+        'noplaylist': True,
+        'extractor_args': {
+            'youtube': {
+                'player_client': ['android', 'web'],
+                'player_skip': ['configs'],
+            }
+        },
+        'source_address': '0.0.0.0',
+        'socket_timeout': 30,
+        'retries': 5,
+        'fragment_retries': 5,
+        'skip_unavailable_fragments': True,
+        'ffmpeg_location': os.path.dirname(ffmpeg_location),
+        'http_headers': {
+            'User-Agent': 'Mozilla/5.0 (Linux; Android 13; SM-G991B) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Mobile Safari/537.36',
+            'Accept-Language': 'en-US,en;q=0.9',
+            'Accept': 'text/html,application/xhtml+xml,application/xml;q=0.9,*/*;q=0.8',
+        },
+        # Conversion happens in the post-process stage, never inside the download worker
+        'postprocessors': [],
+    }
+    
+    # Progressive playback serves the container while it downloads, so it must not be rewritten afterwards
+    if PROGRESSIVE_PLAYBACK:
+        ydl_opts['fixup'] = 'never'
+        ydl_opts['continuedl'] = False
+    return ydl_opts
+
+
+# Fallback chain, in the order tried before anything has been learned.
+# `kind` decides when a strategy is worth trying after another one failed:
+# 'primary' always, 'auth' after a bot/sign-in rejection, 'format' after a
+# format error. The primary strategy is always tried first.
+DOWNLOAD_STRATEGIES = [
+    {'name': 'default', 'kind': 'primary'},
+    {
+        'name': 'android_embedded',
+        'kind': 'auth',
+        'clients': ['android_embedded', 'android', 'web'],
+        'ua': 'Mozilla/5.0 (Linux; Android 13) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Mobile Safari/537.36',
+    },
+    {
+        'name': 'mweb',
+        'kind': 'auth',
+        'clients': ['mweb', 'android', 'web'],
+        'ua': 'Mozilla/5.0 (iPhone; CPU iPhone OS 17_0 like Mac OS X) AppleWebKit/605.1.15 (KHTML, like Gecko) Version/17.0 Mobile/15E148 Safari/604.1',
+    },
+    {
+        'name': 'cookies',
+        'kind': 'auth',
+        'clients': ['mweb', 'android', 'web'],
+        'ua': 'Mozilla/5.0 (iPhone; CPU iPhone OS 17_0 like Mac OS X) AppleWebKit/605.1.15 (KHTML, like Gecko) Version/17.0 Mobile/15E148 Safari/604.1',
+        'cookies': True,
+    },
+    {'name': 'format:bestaudio', 'kind': 'format', 'format': 'bestaudio'},
+    {'name': 'format:best', 'kind': 'format', 'format': 'best'},
+    {'name': 'format:worstaudio', 'kind': 'format', 'format': 'worstaudio'},
+    {'name': 'format:worst', 'kind': 'format', 'format': 'worst'},
+]
+
+
+def _strategy_opts(strategy: Dict[str, Any], base: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+    """Options for `strategy` derived from the primary ones, or None if it cannot run right now."""
+    opts = dict(base)
+    if strategy.get('clients'):
+        opts['extractor_args'] = {
+            'youtube': {
+                'player_client': strategy['clients'],
+                'player_skip': ['configs', 'webpage'],
+            }
+        }
+        opts['http_headers'] = dict(base['http_headers'], **{'User-Agent': strategy['ua']})
+    if strategy.get('cookies'):
+        cookies_file = get_youtube_cookies()
+        if not cookies_file:
+            return None
+        opts['cookiefile'] = cookies_file
+    if strategy.get('format'):
+        opts['format'] = strategy['format']
+    return opts
+
+
+def _strategy_applies(strategy: Dict[str, Any], error_msg: str) -> bool:
+    if strategy['kind'] == 'auth':
+        return 'sign in' in error_msg or 'bot' in error_msg or 'authentication' in error_msg
+    if strategy['kind'] == 'format':
+        return 'format' in error_msg or 'no formats' in error_msg or 'requested format' in error_msg
+    return True
+
+
+def _is_video_error(error_msg: str) -> bool:
+    """Failures no strategy can fix: they say nothing about the strategy that hit them."""
+    return any(keyword in error_msg for keyword in [
+        'video unavailable',
+        'private video',
+        'has been removed',
+        'not available in your country',
+        'members-only',
+    ])
+
+
+class StrategyStats:
+    """
+    Sliding-window outcomes per download strategy.
+    Strategies are only reordered within their kind, and kinds keep the
+    primary -> auth -> format order, so a fallback never runs ahead of the
+    primary strategy. Auth strategies are ranked by expected successes per
+    second of trying, (successes + 1) / (attempts + 2) over the mean attempt
+    latency, so a cheap reliable one comes first and an unexplored one ranks
+    ahead of one that keeps timing out. Format fallbacks are a quality
+    ladder and keep their DOWNLOAD_STRATEGIES order. Latency is extraction
+    time for a success and time-to-failure for a failure, never media
+    download time, which only measures how big the chosen format was.
+    Strategies that are nearly always failing are dropped from the plan
+    until their outcomes age out of the window.
+    """
+
+    # Latency assumed for a strategy with no outcomes yet
+    PRIOR_LATENCY = 10.0
+    KIND_ORDER = ('primary', 'auth', 'format')
+    # Kinds whose declared order is kept whatever their outcomes
+    FIXED_KINDS = ('format',)
+
+    def __init__(self, strategies: list, window: int, window_seconds: int):
+        self.strategies = strategies
+        self.window_seconds = window_seconds
+        self.lock = threading.Lock()
+        # name -> deque of (finished_at, success, latency)
+        self.outcomes: Dict[str, deque] = {s['name']: deque(maxlen=window) for s in strategies}
+
+    def record(self, name: str, success: bool, latency: float):
+        with self.lock:
+            self.outcomes[name].append((time.monotonic(), success, latency))
+
+    def _summary(self, name: str, now: float) -> tuple:
+        window = self.outcomes[name]
+        while window and window[0][0] < now - self.window_seconds:
+            window.popleft()
+        attempts = len(window)
+        successes = sum(1 for _, ok, _ in window if ok)
+        latency = sum(t for _, _, t in window) / attempts if attempts else self.PRIOR_LATENCY
+        return attempts, successes, latency
+
+    def _ranked(self) -> list:
+        now = time.monotonic()
+        ranked = []
+        with self.lock:
+            for index, strategy in enumerate(self.strategies):
+                attempts, successes, latency = self._summary(strategy['name'], now)
+                rate = successes / attempts if attempts else None
+                score = (successes + 1) / (attempts + 2) / max(latency, 0.1)
+                skipped = attempts >= STRATEGY_MIN_SAMPLES and rate < STRATEGY_SKIP_BELOW
+                ranked.append({
+                    'name': strategy['name'],
+                    'kind': strategy['kind'],
+                    'attempts': attempts,
+                    'successes': successes,
+                    'success_rate': round(rate, 4) if rate is not None else None,
+                    'avg_latency': round(latency, 3) if attempts else None,
+                    'score': round(score, 5),
+                    'skipped': skipped,
+                    'index': index,
+                })
+        ranked.sort(key=lambda r: (
+            self.KIND_ORDER.index(r['kind']),
+            0 if r['kind'] in self.FIXED_KINDS else -r['score'],
+            r['index'],
+        ))
+        return ranked
+
+    def plan(self) -> list:
+        """Strategies to try, best first."""
+        ranked = self._ranked()
+        active = [r for r in ranked if not r['skipped']] or ranked
+        return [self.strategies[r['index']] for r in active]
+
+    def stats(self) -> list:
+        ranked = self._ranked()
+        for r in ranked:
+            del r['index']
+        return ranked
+
+
+strategy_stats = StrategyStats(DOWNLOAD_STRATEGIES, STRATEGY_WINDOW, STRATEGY_WINDOW_SECONDS)
+
+
+def _info_metadata(info: Dict[str, Any], fallback_title: str = "") -> Dict[str, Any]:
+    thumbnail = info.get('thumbnail') or ((info.get('thumbnails') or [{}])[-1].get('url') or '')
+    return {
+        'title': info.get('title', fallback_title or 'Unknown'),
+        'duration': info.get('duration', 0),
+        'thumbnail': thumbnail,
+        'uploader': info.get('uploader', info.get('channel', 'Unknown')),
+    }
+
+
+class InfoCache:
+    """
+    TTL + LRU cache of unprocessed yt-dlp info dicts.
+    Keyed by video and by the options that shape extraction (player client,
+    headers, cookies), but not by format selector: format fallbacks re-run
+    only format selection and the download against the cached format list.
+    Entries expire well before YouTube's signed media URLs do.
+    """
+
+    def __init__(self, ttl: int, max_entries: int):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.lock = threading.Lock()
+        # key -> (expires_at, info)
+        self.entries: OrderedDict = OrderedDict()
+        # video_id -> metadata of the latest extraction
+        self.metadata_by_video: OrderedDict = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def key(video_id: str, opts: Dict[str, Any]) -> str:
+        return f"{video_id}|{ExtractorPool._key({k: v for k, v in opts.items() if k != 'format'})}"
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None or entry[0] < time.monotonic():
+                if entry is not None:
+                    del self.entries[key]
+                self.misses += 1
+                return None
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def put(self, key: str, video_id: str, info: Dict[str, Any]):
+        with self.lock:
+            self.entries[key] = (time.monotonic() + self.ttl, info)
+            self.entries.move_to_end(key)
+            self.metadata_by_video[video_id] = _info_metadata(info)
+            self.metadata_by_video.move_to_end(video_id)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+            while len(self.metadata_by_video) > self.max_entries:
+                self.metadata_by_video.popitem(last=False)
+
+    def invalidate(self, key: str):
+        with self.lock:
+            self.entries.pop(key, None)
+
+    def metadata(self, video_id: str) -> Optional[Dict[str, Any]]:
+        with self.lock:
+            return self.metadata_by_video.get(video_id)
+
+    def stats(self) -> Dict[str, Any]:
+        with self.lock:
+            return {'entries': len(self.entries), 'hits': self.hits, 'misses': self.misses, 'ttl_seconds': self.ttl}
 
-Path(AUDIO_DIR).mkdir(parents=True, exist_ok=True)
 
-def load_cache():
-    if os.path.exists(CACHE_FILE):
-        try:
-            with open(CACHE_FILE, 'r') as f:
-                return json.load(f)
-        except:
-            return {}
-    return {}
+info_cache = InfoCache(INFO_CACHE_TTL, INFO_CACHE_SIZE)
 
-def save_cache(cache_data):
-    with open(CACHE_FILE, 'w') as f:
-        json.dump(cache_data, f, indent=2)
 
-cache = load_cache()
+TERMINAL_STATUSES = ('completed', 'failed', 'cancelled')
 
-def get_youtube_cookies():
-    """
-    Get cookie file path for yt-dlp authentication.
-    Called on each request to pick up newly added cookie files.
-    Returns cookie file path or None if unavailable.
-    """
-    try:
-        cookie_file = os.getenv('YT_COOKIES_FILE')
-        if cookie_file and os.path.exists(cookie_file):
-            try:
-                with open(cookie_file, 'r', encoding='utf-8', errors='ignore') as f:
-                    content = f.read()
-            except Exception:
-                content = ''
-
-            # Accept plain text (contains youtube) or JSON cookie exports
-            lower = content.lower()
-            if 'youtube' in lower and 'your_login_here' not in lower:
-                logger.info(f"Using cookies from file: {cookie_file}")
-                return cookie_file
-            # Try parsing JSON cookie exports
-            try:
-                parsed = json.loads(content)
-                # parsed could be a dict with list of cookies
-                items = []
-                if isinstance(parsed, dict):
-                    # common formats: { cookies: [...] } or top-level list under some key
-                    if 'cookies' in parsed and isinstance(parsed['cookies'], list):
-                        items = parsed['cookies']
-                    else:
-                        # if dict looks like a single cookie, treat as single
-                        items = [parsed]
-                elif isinstance(parsed, list):
-                    items = parsed
-
-                for it in items:
-                    domain = ''
-                    if isinstance(it, dict):
-                        domain = str(it.get('domain', '') or it.get('host', '')).lower()
-                    if 'youtube' in domain:
-                        logger.info(f"Using JSON-format cookies from file: {cookie_file}")
-                        return cookie_file
-            except Exception:
-                pass
-        
-        default_paths = [
-            './youtube_cookies.txt',
-            '../youtube_cookies.txt',
-            os.path.join(AUDIO_DIR, 'youtube_cookies.txt'),
-            os.path.expanduser('~/youtube_cookies.txt'),
-            './www.youtube.com_cookies (1).txt',
-            '../www.youtube.com_cookies (1).txt',
-        ]
-        
-        for path in default_paths:
-            if os.path.exists(path):
-                try:
-                    with open(path, 'r', encoding='utf-8', errors='ignore') as f:
-                        content = f.read()
-                        lower = content.lower()
-                        if 'youtube' in lower and 'your_login_here' not in lower:
-                            logger.info(f"Found valid cookies file at: {path}")
-                            return path
-                        # Try JSON parse for cookie-exporters that save JSON
-                        try:
-                            parsed = json.loads(content)
-                            items = parsed if isinstance(parsed, list) else parsed.get('cookies', []) if isinstance(parsed, dict) else []
-                            for it in items:
-                                domain = ''
-                                if isinstance(it, dict):
-                                    domain = str(it.get('domain', '') or it.get('host', '')).lower()
-                                if 'youtube' in domain:
-                                    logger.info(f"Found JSON-format cookies file at: {path}")
-                                    return path
-                        except Exception:
-                            pass
-                except Exception:
-                    continue
-        
-        return None
-            
-    except Exception as e:
-        logger.warning(f"Cookie extraction failed: {e}")
-        return None
 
 class DownloadJob:
-    def __init__(self, job_id: str, video_id: str, url: str, title: str = ""):
+    __slots__ = (
+        'job_id', 'video_id', 'url', 'title', 'status', 'progress', 'stage', 'error',
+        'stream_url', 'metadata', 'created_at', 'file_path', 'attach_count', 'growing',
+        'event_id', 'emitted_id', 'emitted_status', 'last_emit', 'flush_pending', 'emit_lock',
+        'downloaded_bytes', 'total_bytes', 'batch_ids', 'priority',
+        'done', 'cancel_requested', 'process', 'work_files', 'work_prefix', 'pinned', 'waiters', 'last_seen',
+    )
+
+    def __init__(self, job_id: str, video_id: str, url: str, title: str = "", priority: str = "interactive"):
         self.job_id = job_id
         self.video_id = video_id
         self.url = url
@@ -145,10 +2154,37 @@ class DownloadJob:
         self.stage = "Waiting..."
         self.error: Optional[str] = None
         self.stream_url: Optional[str] = None
-        self.metadata: Dict[str, Any] = {}
-        self.created_at = datetime.now()
-        self.subscribers: list = []
+        self.metadata: Optional[Dict[str, Any]] = None
+        self.created_at = time.time()
         self.file_path: Optional[str] = None
+        self.attach_count = 1
+        self.growing: Optional[GrowingFile] = None
+        # Incremented on every state change; SSE id of the state last sent to subscribers
+        self.event_id = 0
+        self.emitted_id = 0
+        self.emitted_status = ""
+        self.last_emit = 0.0
+        self.flush_pending = False
+        self.emit_lock = threading.Lock()
+        self.downloaded_bytes = 0
+        self.total_bytes = 0
+        # Batches this job reports to; their event channels are woken with the job's
+        self.batch_ids: tuple = ()
+        self.priority = priority
+        # Set once the job reaches a terminal status
+        self.done = threading.Event()
+        self.cancel_requested = False
+        # ffmpeg child currently working on this job, terminated on cancel
+        self.process: Optional[subprocess.Popen] = None
+        # Download and conversion files this job has written or is writing, removed on cancel
+        self.work_files: set = set()
+        # AUDIO_DIR/<work_prefix>.* also belong to this job, for files yt-dlp never reported
+        self.work_prefix: Optional[str] = None
+        # Pinned jobs run to completion even when nobody is listening
+        self.pinned = False
+        # Open SSE subscriptions and blocked /download requests
+        self.waiters = 0
+        self.last_seen = time.monotonic()
         
     def to_dict(self):
         return {
@@ -161,379 +2197,1149 @@ class DownloadJob:
             "stage": self.stage,
             "error": self.error,
             "stream_url": self.stream_url,
-            "metadata": self.metadata,
-            "created_at": self.created_at.isoformat()
+            "metadata": self.metadata or {},
+            "attach_count": self.attach_count,
+            "priority": self.priority,
+            "downloaded_bytes": self.downloaded_bytes,
+            "total_bytes": self.total_bytes,
+            "created_at": datetime.fromtimestamp(self.created_at).isoformat()
         }
     
-    def notify_subscribers(self):
-        event_data = json.dumps(self.to_dict())
-        for q in self.subscribers:
-            try:
-                q.put(event_data)
-            except:
-                pass
+    def notify_subscribers(self, force: bool = False):
+        """
+        Record a state change and tell subscribers, at most PROGRESS_EVENTS_PER_SEC
+        times a second. Status transitions (and `force`) are sent immediately;
+        throttled updates are flushed by a trailing timer on the event hub.
+        """
+        self.event_id += 1
+        if not any(event_hub.has_subscribers(channel) for channel in self._channels()):
+            return
+        elapsed = time.monotonic() - self.last_emit
+        if not force and self.status == self.emitted_status and elapsed < PROGRESS_EVENT_INTERVAL:
+            if not self.flush_pending:
+                self.flush_pending = True
+                event_hub.call_later(PROGRESS_EVENT_INTERVAL - elapsed, self._flush)
+            return
+        self._emit()
+    
+    def _flush(self):
+        self.flush_pending = False
+        if self.emitted_id < self.event_id:
+            self._emit()
+    
+    def _channels(self) -> tuple:
+        return (self.job_id,) + tuple(f"batch:{batch_id}" for batch_id in self.batch_ids)
+    
+    def _emit(self):
+        with self.emit_lock:
+            self.last_emit = time.monotonic()
+            self.emitted_status = self.status
+            self.emitted_id = self.event_id
+            for channel in self._channels():
+                event_hub.publish(channel)
+
+
+def cached_job(video_id: str, url: str = "", title: str = "", touch: bool = True) -> Optional[Dict[str, Any]]:
+    """
+    Job-shaped view of a track that is already in the library, or None.
+    Cache hits are answered from the index without minting a DownloadJob;
+    the synthetic id `cache-<video_id>` resolves through the same endpoints.
+    """
+    entry = cache.get(video_id)
+    file_path = entry.get('file', '') if entry else ''
+    if not file_path or not os.path.exists(file_path) or os.path.getsize(file_path) == 0:
+        if touch:
+            metrics.inc('flac_library_lookups_total', result='miss')
+        return None
+    if touch:
+        metrics.inc('flac_library_lookups_total', result='hit')
+        disk_budget.touch(os.path.basename(file_path))
+    metadata = entry.get('metadata', {})
+    return {
+        "job_id": f"cache-{video_id}",
+        "video_id": video_id,
+        "url": url or f"https://www.youtube.com/watch?v={video_id}",
+        "title": title or metadata.get('title', ''),
+        "status": "completed",
+        "progress": 100,
+        "stage": "Loaded from cache",
+        "error": None,
+        "stream_url": f"/stream/{os.path.basename(file_path)}",
+        "metadata": metadata,
+        "attach_count": 0,
+        "created_at": entry.get('downloaded_at'),
+    }
+
+
+class JobRegistry:
+    """
+    Live and recently finished jobs.
+    Terminal jobs are queued in finishing order and reaped once older than
+    JOB_TTL_SECONDS or beyond MAX_FINISHED_JOBS, so memory is bounded by
+    in-flight work plus a fixed tail. Per-status counts are maintained on
+    every transition instead of scanning the table.
+    Callers hold JobManager.lock.
+    """
 
-class JobManager:
     def __init__(self):
         self.jobs: Dict[str, DownloadJob] = {}
-        self.active_count = 0
+        self.finished: deque = deque()
+        self.counts: Dict[str, int] = {}
+        self.reaped_total = 0
+
+    def add(self, job: DownloadJob):
+        self.jobs[job.job_id] = job
+        self.counts[job.status] = self.counts.get(job.status, 0) + 1
+        self.reap()
+
+    def get(self, job_id: str) -> Optional[DownloadJob]:
+        return self.jobs.get(job_id)
+
+    def set_status(self, job: DownloadJob, status: str):
+        if job.status == status:
+            return
+        self.counts[job.status] -= 1
+        self.counts[status] = self.counts.get(status, 0) + 1
+        job.status = status
+        if status in TERMINAL_STATUSES:
+            self.finished.append((time.monotonic(), job.job_id))
+
+    def reap(self):
+        cutoff = time.monotonic() - JOB_TTL_SECONDS
+        while self.finished and (self.finished[0][0] < cutoff or len(self.finished) > MAX_FINISHED_JOBS):
+            _, job_id = self.finished.popleft()
+            job = self.jobs.pop(job_id, None)
+            if job is not None:
+                self.counts[job.status] -= 1
+                self.reaped_total += 1
+                if job.batch_ids:
+                    batch_manager.job_reaped(job)
+
+    def active(self) -> int:
+        return self.counts.get('queued', 0) + self.counts.get('downloading', 0)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            'tracked': len(self.jobs),
+            'by_status': {status: n for status, n in self.counts.items() if n},
+            'reaped': self.reaped_total,
+            'ttl_seconds': JOB_TTL_SECONDS,
+        }
+
+class PriorityScheduler:
+    """
+    Download queue ordered by priority class with aging.
+    A job's rank is its enqueue time plus its class offset (interactive 0,
+    prefetch PRIORITY_PREFETCH_OFFSET, bulk PRIORITY_BULK_OFFSET seconds), so
+    a click jumps ahead of a playlist import, yet a bulk job that has waited
+    longer than the offset outranks new interactive work and cannot starve.
+    Bumping re-ranks a queued job under a more urgent class; the superseded
+    heap entry is skipped when popped.
+    """
+
+    OFFSETS = {
+        'interactive': 0.0,
+        'prefetch': PRIORITY_PREFETCH_OFFSET,
+        'bulk': PRIORITY_BULK_OFFSET,
+    }
+    WAIT_WINDOW = 200
+
+    def __init__(self):
+        self.cond = threading.Condition()
+        self.heap: list = []
+        # job_id -> [rank, enqueued_at, priority, version]
+        self.queued: Dict[str, list] = {}
+        self.seq = 0
+        # priority -> recent queue waits in seconds, recorded when a worker takes the job
+        self.waits: Dict[str, deque] = {p: deque(maxlen=self.WAIT_WINDOW) for p in self.OFFSETS}
+        self.bumps = 0
+
+    @classmethod
+    def normalize(cls, priority: Optional[str], default: str = 'interactive') -> str:
+        return priority if priority in cls.OFFSETS else default
+
+    def _push(self, job_id: str, rec: list):
+        self.seq += 1
+        heapq.heappush(self.heap, (rec[0], self.seq, rec[3], job_id))
+
+    def put(self, job_id: str, priority: str):
+        now = time.time()
+        with self.cond:
+            rec = [now + self.OFFSETS[priority], now, priority, 0]
+            self.queued[job_id] = rec
+            self._push(job_id, rec)
+            self.cond.notify()
+
+    def bump(self, job_id: str, priority: str) -> bool:
+        """Move a queued job to a more urgent class; False if it is not queued or already there."""
+        with self.cond:
+            rec = self.queued.get(job_id)
+            if rec is None or self.OFFSETS[priority] >= self.OFFSETS[rec[2]]:
+                return False
+            rec[0] = min(rec[0], rec[1] + self.OFFSETS[priority])
+            rec[2] = priority
+            rec[3] += 1
+            self._push(job_id, rec)
+            self.bumps += 1
+            return True
+
+    def remove(self, job_id: str) -> bool:
+        """Drop a queued job; False if a worker already took it."""
+        with self.cond:
+            return self.queued.pop(job_id, None) is not None
+
+    def get(self) -> tuple:
+        """Block until a job is queued; returns (job_id, priority)."""
+        with self.cond:
+            while True:
+                while self.heap:
+                    _, _, version, job_id = heapq.heappop(self.heap)
+                    rec = self.queued.get(job_id)
+                    if rec is None or rec[3] != version:
+                        continue
+                    del self.queued[job_id]
+                    wait = time.time() - rec[1]
+                    self.waits[rec[2]].append(wait)
+                    metrics.observe('flac_queue_wait_seconds', wait, priority=rec[2])
+                    return job_id, rec[2]
+                self.cond.wait()
+
+    def qsize(self) -> int:
+        return len(self.queued)
+
+    def stats(self) -> Dict[str, Any]:
+        with self.cond:
+            queued = {p: 0 for p in self.OFFSETS}
+            for rec in self.queued.values():
+                queued[rec[2]] += 1
+            classes = {}
+            for priority, waits in self.waits.items():
+                ordered = sorted(waits)
+                classes[priority] = {
+                    'queued': queued[priority],
+                    'offset_seconds': self.OFFSETS[priority],
+                    'dispatched': len(ordered),
+                    'avg_wait': round(sum(ordered) / len(ordered), 3) if ordered else None,
+                    'p95_wait': round(ordered[int(0.95 * (len(ordered) - 1))], 3) if ordered else None,
+                    'max_wait': round(ordered[-1], 3) if ordered else None,
+                }
+            return {'classes': classes, 'bumps': self.bumps}
+
+
+class Batch:
+    __slots__ = ('batch_id', 'job_ids', 'results', 'created_at', 'cached', 'done', 'failed', 'bytes_finished', 'finished_at')
+
+    def __init__(self, batch_id: str):
+        self.batch_id = batch_id
+        self.job_ids: list = []
+        # job_id -> final job dict, for cached tracks and for members reaped from the job registry
+        self.results: Dict[str, Dict[str, Any]] = {}
+        self.created_at = time.time()
+        self.cached = 0
+        self.done = 0
+        self.failed = 0
+        self.bytes_finished = 0
+        self.finished_at: Optional[float] = None
+
+    def summary(self) -> Dict[str, Any]:
+        total = len(self.job_ids)
+        remaining = total - self.done - self.failed
+        bytes_downloaded = self.bytes_finished
+        if remaining:
+            for job_id in self.job_ids:
+                job = job_manager.get_job(job_id)
+                if job is not None and job.status not in TERMINAL_STATUSES:
+                    bytes_downloaded += job.downloaded_bytes
+        finished = self.done + self.failed - self.cached
+        elapsed = time.time() - self.created_at
+        # Estimated from the pace of jobs that actually downloaded, cache hits excluded
+        eta = round(elapsed / finished * remaining, 1) if remaining and finished > 0 else None
+        return {
+            'batch_id': self.batch_id,
+            'total': total,
+            'done': self.done,
+            'failed': self.failed,
+            'remaining': remaining,
+            'bytes_downloaded': bytes_downloaded,
+            'eta_seconds': eta if remaining else 0,
+        }
+
+
+class BatchManager:
+    """
+    Batches created by POST /jobs/batch. Member jobs report terminal
+    transitions here, so done/failed counts are kept without scanning;
+    finished batches are reaped after JOB_TTL_SECONDS like jobs.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.batches: Dict[str, Batch] = {}
+        self.finished: deque = deque()
+
+    def create(self) -> Batch:
+        batch = Batch(str(uuid.uuid4()))
+        with self.lock:
+            self.batches[batch.batch_id] = batch
+            self._reap()
+        return batch
+
+    def get(self, batch_id: str) -> Optional[Batch]:
+        return self.batches.get(batch_id)
+
+    def add_cached(self, batch: Batch, state: Dict[str, Any]):
+        with self.lock:
+            batch.job_ids.append(state['job_id'])
+            batch.results[state['job_id']] = state
+            batch.cached += 1
+            batch.done += 1
+
+    def add_job(self, batch: Batch, job: 'DownloadJob'):
+        with self.lock:
+            batch.job_ids.append(job.job_id)
+
+    def seal(self, batch: Batch):
+        """All members added: a batch that is already complete starts its TTL now."""
+        with self.lock:
+            self._check_finished(batch)
+
+    def job_finished(self, job: 'DownloadJob'):
+        for batch_id in job.batch_ids:
+            with self.lock:
+                batch = self.batches.get(batch_id)
+                if batch is None:
+                    continue
+                if job.status == 'completed':
+                    batch.done += 1
+                else:
+                    batch.failed += 1
+                batch.bytes_finished += job.downloaded_bytes
+                self._check_finished(batch)
+
+    def job_reaped(self, job: 'DownloadJob'):
+        for batch_id in job.batch_ids:
+            batch = self.batches.get(batch_id)
+            if batch is not None:
+                batch.results[job.job_id] = job.to_dict()
+
+    def _check_finished(self, batch: Batch):
+        if batch.finished_at is None and batch.done + batch.failed == len(batch.job_ids):
+            batch.finished_at = time.monotonic()
+            self.finished.append((batch.finished_at, batch.batch_id))
+
+    def _reap(self):
+        cutoff = time.monotonic() - JOB_TTL_SECONDS
+        while self.finished and self.finished[0][0] < cutoff:
+            _, batch_id = self.finished.popleft()
+            self.batches.pop(batch_id, None)
+
+    def stats(self) -> Dict[str, Any]:
+        with self.lock:
+            self._reap()
+            return {'tracked': len(self.batches), 'finished': len(self.finished)}
+
+
+batch_manager = BatchManager()
+
+
+class JobManager:
+    """
+    Two-stage download pipeline.
+    Download workers (network bound) run the yt-dlp fallback chain and hand
+    the raw file to post-process workers (CPU bound: remux, MP3 transcode,
+    indexing) through a bounded queue, so a burst of slow downloads cannot
+    starve ffmpeg and a backlog of conversions blocks new downloads instead
+    of piling up on disk.
+    """
+
+    def __init__(self):
+        self.registry = JobRegistry()
+        # video_id -> job_id of the queued/downloading job, so duplicate requests share one download
+        self.inflight: Dict[str, str] = {}
+        self.coalesced_total = 0
         self.lock = threading.Lock()
-        self.job_queue = Queue()
-        for _ in range(MAX_CONCURRENT_JOBS):
-            worker = threading.Thread(target=self._worker, daemon=True)
+        self.scheduler = PriorityScheduler()
+        self.postprocess_queue: Queue = Queue(maxsize=POSTPROCESS_QUEUE_SIZE)
+        self.busy = {'download': 0, 'postprocess': 0}
+        for _ in range(DOWNLOAD_WORKERS):
+            worker = threading.Thread(target=self._download_worker, daemon=True)
+            worker.start()
+        for _ in range(POSTPROCESS_WORKERS):
+            worker = threading.Thread(target=self._postprocess_worker, daemon=True)
             worker.start()
     
-    def create_job(self, video_id: str, url: str, title: str = "") -> DownloadJob:
-        with self.lock:
-            if video_id in cache:
-                cached_entry = cache[video_id]
-                file_path = cached_entry.get('file', '')
-                if file_path and os.path.exists(file_path) and os.path.getsize(file_path) > 0:
-                    job = DownloadJob(str(uuid.uuid4()), video_id, url, title)
-                    job.status = "completed"
-                    job.progress = 100
-                    job.stage = "Loaded from cache"
-                    job.stream_url = f"/stream/{os.path.basename(file_path)}"
-                    job.metadata = cached_entry.get('metadata', {})
-                    job.file_path = file_path
-                    self.jobs[job.job_id] = job
-                    return job
-            
-            job = DownloadJob(str(uuid.uuid4()), video_id, url, title)
-            self.jobs[job.job_id] = job
-            self.job_queue.put(job.job_id)
+    def create_job(self, video_id: str, url: str, title: str = "", priority: str = "interactive",
+                   pinned: bool = False) -> DownloadJob:
+        """
+        Queue a download, or attach to the one already in flight. Check `cached_job` first.
+        Unpinned interactive jobs are cancelled once the last of their waiters leaves.
+        """
+        with self.lock:
+            job = self._create_locked(video_id, url, title, priority)
+            job.pinned = job.pinned or pinned or priority != 'interactive'
             return job
     
+    def create_batch_jobs(self, batch: Batch, requests: list, priority: str = "bulk") -> list:
+        """`create_job` for each (video_id, url, title), registering every job with `batch`."""
+        jobs = []
+        with self.lock:
+            for video_id, url, title in requests:
+                job = self._create_locked(video_id, url, title, priority)
+                job.pinned = True
+                job.batch_ids += (batch.batch_id,)
+                batch_manager.add_job(batch, job)
+                jobs.append(job)
+        return jobs
+    
+    def _create_locked(self, video_id: str, url: str, title: str, priority: str) -> DownloadJob:
+        inflight_id = self.inflight.get(video_id)
+        if inflight_id:
+            existing = self.registry.get(inflight_id)
+            # A job being cancelled is about to end; a new request gets a fresh one
+            if existing and existing.status in ['queued', 'downloading'] and not existing.cancel_requested:
+                existing.attach_count += 1
+                # A new requester counts as interest, so a pending grace-period cancel leaves it alone
+                existing.last_seen = time.monotonic()
+                self.coalesced_total += 1
+                logger.info(f"Attached request for {video_id} to job {existing.job_id} ({existing.attach_count} attached)")
+                # Someone now wants sooner what was queued as prefetch/bulk
+                if self.scheduler.bump(existing.job_id, priority):
+                    existing.priority = priority
+                return existing
+        
+        job = DownloadJob(str(uuid.uuid4()), video_id, url, title, priority)
+        self.registry.add(job)
+        self.inflight[video_id] = job.job_id
+        self.scheduler.put(job.job_id, priority)
+        return job
+    
+    def bump(self, job: DownloadJob, priority: str) -> bool:
+        with self.lock:
+            if not self.scheduler.bump(job.job_id, priority):
+                return False
+            job.priority = priority
+        logger.info(f"Job {job.job_id} bumped to {priority}")
+        job.notify_subscribers(force=True)
+        return True
+    
     def get_job(self, job_id: str) -> Optional[DownloadJob]:
-        return self.jobs.get(job_id)
+        return self.registry.get(job_id)
     
-    def _worker(self):
+    def job_stats(self) -> Dict[str, Any]:
+        with self.lock:
+            self.registry.reap()
+            return self.registry.stats()
+    
+    def _set_status(self, job: DownloadJob, status: str):
+        with self.lock:
+            self.registry.set_status(job, status)
+            if status in TERMINAL_STATUSES:
+                metrics.inc('flac_jobs_finished_total', status=status)
+                if job.batch_ids:
+                    batch_manager.job_finished(job)
+                job.done.set()
+    
+    def add_waiter(self, job: DownloadJob):
+        with self.lock:
+            job.waiters += 1
+            job.last_seen = time.monotonic()
+    
+    def remove_waiter(self, job: DownloadJob):
+        with self.lock:
+            job.waiters -= 1
+            job.last_seen = time.monotonic()
+            abandoned = job.waiters == 0 and not job.pinned and job.status not in TERMINAL_STATUSES
+        if abandoned:
+            # The timer lives on the hub loop, but the cancel itself (locks, file removal) runs off it
+            event_hub.call_later(CANCEL_GRACE_SECONDS, lambda: threading.Thread(
+                target=self._cancel_if_abandoned, args=(job,), daemon=True).start())
+    
+    def _cancel_if_abandoned(self, job: DownloadJob):
+        with self.lock:
+            abandoned = (job.waiters == 0 and not job.pinned
+                         and time.monotonic() - job.last_seen >= CANCEL_GRACE_SECONDS)
+        if abandoned:
+            self.cancel(job, "no one is waiting for it")
+    
+    def cancel(self, job: DownloadJob, reason: str = "cancelled by request") -> bool:
+        """
+        Stop a job wherever it is: drop it from the queue, abort the yt-dlp
+        download at its next progress callback, or terminate its ffmpeg child.
+        Returns False if the job had already finished.
+        """
+        with self.lock:
+            if job.status in TERMINAL_STATUSES or job.cancel_requested:
+                return False
+            job.cancel_requested = True
+            dequeued = self.scheduler.remove(job.job_id)
+        logger.info(f"Cancelling job {job.job_id}: {reason}")
+        if dequeued:
+            self._cancelled(job)
+        elif job.process is not None:
+            try:
+                job.process.terminate()
+            except OSError:
+                pass
+        return True
+    
+    def pipeline_stats(self) -> Dict[str, Any]:
+        return {
+            'download': {
+                'workers': DOWNLOAD_WORKERS,
+                'busy': self.busy['download'],
+                'queued': self.scheduler.qsize(),
+            },
+            'postprocess': {
+                'workers': POSTPROCESS_WORKERS,
+                'busy': self.busy['postprocess'],
+                'queued': self.postprocess_queue.qsize(),
+                'capacity': POSTPROCESS_QUEUE_SIZE,
+            },
+        }
+    
+    def _set_busy(self, stage: str, delta: int):
+        with self.lock:
+            self.busy[stage] += delta
+    
+    def _release(self, job: DownloadJob):
+        with self.lock:
+            if self.inflight.get(job.video_id) == job.job_id:
+                del self.inflight[job.video_id]
+    
+    def _download_worker(self):
         while True:
+            job_id, _ = self.scheduler.get()
             try:
-                job_id = self.job_queue.get()
-                job = self.jobs.get(job_id)
+                job = self.registry.get(job_id)
                 if job and job.status == "queued":
-                    self._process_job(job)
+                    self._set_busy('download', 1)
+                    try:
+                        source_path, info = self._download(job)
+                    except Exception as e:
+                        self._fail(job, e)
+                        continue
+                    finally:
+                        self._set_busy('download', -1)
+                    job.stage = "Waiting for processing..."
+                    job.notify_subscribers()
+                    # Blocks while the post-process stage is saturated
+                    self.postprocess_queue.put((job, source_path, info))
             except Exception as e:
-                logger.error(f"Worker error: {e}")
-            finally:
-                self.job_queue.task_done()
+                logger.error(f"Download worker error: {e}")
     
-    def _process_job(self, job: DownloadJob):
-        try:
-            job.status = "downloading"
-            job.stage = "Starting download..."
-            job.progress = 5
-            job.notify_subscribers()
-            
-            file_id = str(uuid.uuid4())
-            output_template = os.path.join(AUDIO_DIR, f"{file_id}.%(ext)s")
-            output_path = os.path.join(AUDIO_DIR, f"{file_id}.mp3")
-            
-            def progress_hook(d):
-                if d['status'] == 'downloading':
-                    total = d.get('total_bytes') or d.get('total_bytes_estimate', 0)
-                    downloaded = d.get('downloaded_bytes', 0)
-                    if total > 0:
-                        pct = int((downloaded / total) * 60) + 10
-                        job.progress = min(pct, 70)
-                    else:
-                        job.progress = min(job.progress + 1, 70)
-                    
-                    speed = d.get('speed', 0)
-                    if speed:
-                        speed_str = f"{speed/1024:.1f} KB/s" if speed < 1024*1024 else f"{speed/1024/1024:.1f} MB/s"
-                        job.stage = f"Downloading... ({speed_str})"
-                    else:
-                        job.stage = "Downloading..."
-                    job.notify_subscribers()
-                    
-                elif d['status'] == 'finished':
-                    job.progress = 75
-                    job.stage = "Converting to MP3..."
-                    job.notify_subscribers()
-            
-            ffmpeg_location = shutil.which('ffmpeg') or '/home/runner/.nix-profile/bin/ffmpeg'
-            
-            ydl_opts = {
-                'format': 'bestaudio[ext=m4a]/bestaudio/best',
-                'outtmpl': output_template,
-                'quiet': False,
-                'no_warnings': False,
-                'nocheckcertificate': True,
-                'geo_bypass': True,
-                'geo_bypass_country': 'US',
-                'noplaylist': True,
-                'extractor_args': {
-                    'youtube': {
-                        'player_client': ['android', 'web'],
-                        'player_skip': ['configs'],
-                    }
-                },
-                'source_address': '0.0.0.0',
-                'socket_timeout': 30,
-                'retries': 5,
-                'fragment_retries': 5,
-                'skip_unavailable_fragments': True,
-                'ffmpeg_location': os.path.dirname(ffmpeg_location),
-                'http_headers': {
-                    'User-Agent': 'Mozilla/5.0 (Linux; Android 13; SM-G991B) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Mobile Safari/537.36',
-                    'Accept-Language': 'en-US,en;q=0.9',
-                    'Accept': 'text/html,application/xhtml+xml,application/xml;q=0.9,*/*;q=0.8',
-                },
-            }
-            
-            job.stage = "Fetching video info..."
-            job.progress = 10
-            job.notify_subscribers()
-            
-            success = False
-            last_error = None
-            
-            ydl_opts['postprocessors'] = [{
-                'key': 'FFmpegExtractAudio',
-                'preferredcodec': 'mp3',
-                'preferredquality': '192',
-            }]
-            ydl_opts['progress_hooks'] = [progress_hook]
-            
+    def _postprocess_worker(self):
+        while True:
+            job, source_path, info = self.postprocess_queue.get()
+            self._set_busy('postprocess', 1)
             try:
-                with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-                    info = ydl.extract_info(job.url, download=True)
-                    job.metadata = {
-                        'title': info.get('title', job.title or 'Unknown'),
-                        'duration': info.get('duration', 0),
-                        'thumbnail': info.get('thumbnail', ''),
-                        'uploader': info.get('uploader', info.get('channel', 'Unknown')),
-                    }
-                    job.title = job.metadata['title']
-                    success = True
-                    logger.info(f"Download successful with MP3 conversion")
-            except Exception as e1:
-                logger.warning(f"MP3 conversion failed: {e1}")
-                last_error = e1
-            
-            if not success:
-                logger.info("Trying raw audio download without postprocessor...")
-                ydl_opts['postprocessors'] = []
-                try:
-                    with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-                        info = ydl.extract_info(job.url, download=True)
-                        job.metadata = {
-                            'title': info.get('title', job.title or 'Unknown'),
-                            'duration': info.get('duration', 0),
-                            'thumbnail': info.get('thumbnail', ''),
-                            'uploader': info.get('uploader', info.get('channel', 'Unknown')),
-                        }
-                        job.title = job.metadata['title']
-                        success = True
-                        logger.info(f"Raw audio download successful (no conversion)")
-                except Exception as e2:
-                    logger.warning(f"Raw audio download failed: {e2}")
-                    last_error = e2
-            
-            if not success:
-                error_msg = str(last_error).lower() if last_error else ""
+                if job.cancel_requested:
+                    raise JobCancelled(job.job_id)
+                self._postprocess(job, source_path, info)
+            except Exception as e:
+                self._fail(job, e)
+            finally:
+                self._set_busy('postprocess', -1)
+                self.postprocess_queue.task_done()
+    
+    def _download(self, job: DownloadJob) -> tuple:
+        """Run the yt-dlp fallback chain; returns (downloaded file path, info dict)."""
+        self._set_status(job, "downloading")
+        job.stage = "Starting download..."
+        job.progress = 5
+        job.notify_subscribers()
+        
+        file_id = str(uuid.uuid4())
+        job.work_prefix = file_id
+        output_template = os.path.join(AUDIO_DIR, f"{file_id}.%(ext)s")
+        
+        def track_growing(d):
+            final_path = d.get('filename') or ''
+            name = os.path.basename(final_path)
+            if job.growing is None or job.growing.name != name or job.growing.failed:
+                downloaded = d.get('downloaded_bytes', 0)
+                if downloaded < PROGRESSIVE_MIN_BYTES or not name.startswith(file_id):
+                    return
+                _release_growing(job.growing, completed=False)
+                job.growing = GrowingFile(name, d.get('tmpfilename') or final_path, final_path)
+                with growing_lock:
+                    growing_files[name] = job.growing
+                job.stream_url = f"/stream/{name}"
+                logger.info(f"Job {job.job_id} streamable at {job.stream_url} while downloading")
+                job.notify_subscribers(force=True)
+            job.growing.advance(d.get('downloaded_bytes', 0), d.get('total_bytes'))
+        
+        def progress_hook(d):
+            # Recorded before the cancel check, so a cancel on this callback still cleans them up
+            if d.get('filename'):
+                job.work_files.update((d['filename'], f"{d['filename']}.part", f"{d['filename']}.ytdl"))
+            if d.get('tmpfilename'):
+                job.work_files.add(d['tmpfilename'])
+            if job.cancel_requested:
+                # Propagates out of yt-dlp and ends this attempt
+                raise JobCancelled(job.job_id)
+            if PROGRESSIVE_PLAYBACK and d['status'] == 'downloading':
+                track_growing(d)
+            if d['status'] == 'downloading':
+                total = d.get('total_bytes') or d.get('total_bytes_estimate', 0)
+                downloaded = d.get('downloaded_bytes', 0)
+                job.downloaded_bytes = downloaded
+                job.total_bytes = total or 0
+                if total > 0:
+                    pct = int((downloaded / total) * 60) + 10
+                    job.progress = min(pct, 70)
+                else:
+                    job.progress = min(job.progress + 1, 70)
                 
-                if 'sign in' in error_msg or 'bot' in error_msg or 'authentication' in error_msg:
-                    # Try multiple player clients to maximize success rate
-                    client_attempts = [
-                        {
-                            'name': 'android_embedded',
-                            'clients': ['android_embedded', 'android', 'web'],
-                            'ua': 'Mozilla/5.0 (Linux; Android 13) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Mobile Safari/537.36'
-                        },
-                        {
-                            'name': 'mweb',
-                            'clients': ['mweb', 'android', 'web'],
-                            'ua': 'Mozilla/5.0 (iPhone; CPU iPhone OS 17_0 like Mac OS X) AppleWebKit/605.1.15 (KHTML, like Gecko) Version/17.0 Mobile/15E148 Safari/604.1'
-                        }
-                    ]
-                    
-                    for attempt in client_attempts:
-                        if success:
-                            break
-                        logger.info(f"Auth error detected, trying {attempt['name']} client...")
-                        ydl_opts['extractor_args'] = {
-                            'youtube': {
-                                'player_client': attempt['clients'],
-                                'player_skip': ['configs', 'webpage'],
-                            }
-                        }
-                        ydl_opts['http_headers']['User-Agent'] = attempt['ua']
-                        ydl_opts['postprocessors'] = [{
-                            'key': 'FFmpegExtractAudio',
-                            'preferredcodec': 'mp3',
-                            'preferredquality': '192',
-                        }]
-                        try:
-                            with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-                                info = ydl.extract_info(job.url, download=True)
-                                job.metadata = {
-                                    'title': info.get('title', job.title or 'Unknown'),
-                                    'duration': info.get('duration', 0),
-                                    'thumbnail': info.get('thumbnail', ''),
-                                    'uploader': info.get('uploader', info.get('channel', 'Unknown')),
-                                }
-                                job.title = job.metadata['title']
-                                success = True
-                                logger.info(f"Download successful with {attempt['name']} client")
-                        except Exception as e_client:
-                            logger.warning(f"{attempt['name']} client failed: {e_client}")
-                            last_error = e_client
-                    
-                    if not success:
-                        cookies_file = get_youtube_cookies()
-                        if cookies_file:
-                            logger.info(f"Trying with cookies as last resort: {cookies_file}")
-                            ydl_opts['cookiefile'] = cookies_file
-                            try:
-                                with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-                                    info = ydl.extract_info(job.url, download=True)
-                                    job.metadata = {
-                                        'title': info.get('title', job.title or 'Unknown'),
-                                        'duration': info.get('duration', 0),
-                                        'thumbnail': info.get('thumbnail', ''),
-                                        'uploader': info.get('uploader', info.get('channel', 'Unknown')),
-                                    }
-                                    job.title = job.metadata['title']
-                                    success = True
-                                    logger.info(f"Download successful with cookies")
-                            except Exception as e_cookies:
-                                logger.warning(f"Cookies download failed: {e_cookies}")
-                                last_error = e_cookies
+                speed = d.get('speed', 0)
+                if speed:
+                    speed_str = f"{speed/1024:.1f} KB/s" if speed < 1024*1024 else f"{speed/1024/1024:.1f} MB/s"
+                    job.stage = f"Downloading... ({speed_str})"
+                else:
+                    job.stage = "Downloading..."
+                job.notify_subscribers()
                 
-                if not success and ('format' in error_msg or 'no formats' in error_msg or 'requested format' in error_msg):
-                    logger.warning(f"Format error, trying fallback formats...")
-                    
-                    ydl_opts_fallback = ydl_opts.copy()
-                    ydl_opts_fallback['postprocessors'] = []
-                    
-                    fallback_formats = ['bestaudio', 'best', 'worstaudio', 'worst']
-                    
-                    for fmt in fallback_formats:
-                        try:
-                            logger.info(f"Trying format fallback: {fmt}")
-                            ydl_opts_fallback['format'] = fmt
-                            with yt_dlp.YoutubeDL(ydl_opts_fallback) as ydl:
-                                info = ydl.extract_info(job.url, download=True)
-                                job.metadata = {
-                                    'title': info.get('title', job.title or 'Unknown'),
-                                    'duration': info.get('duration', 0),
-                                    'thumbnail': info.get('thumbnail', ''),
-                                    'uploader': info.get('uploader', info.get('channel', 'Unknown')),
-                                }
-                                job.title = job.metadata['title']
-                                logger.info(f"Format fallback ({fmt}) successful!")
-                                success = True
-                                break
-                        except Exception as fb_error:
-                            logger.warning(f"Format fallback ({fmt}) failed: {fb_error}")
-                            last_error = fb_error
-                            continue
-                    
-                    if not success and last_error:
-                        raise last_error
-                elif not success and last_error:
-                    raise last_error
-            
-            job.progress = 85
-            job.stage = "Finalizing..."
+            elif d['status'] == 'finished':
+                if job.growing is not None and job.growing.name == os.path.basename(d.get('filename', '')):
+                    job.growing.finish()
+                job.progress = 75
+                job.stage = "Download finished"
+                job.notify_subscribers()
+        
+        ydl_opts = _download_opts()
+        
+        job.stage = "Fetching video info..."
+        job.progress = 10
+        job.notify_subscribers()
+        
+        info: Optional[Dict[str, Any]] = None
+        last_error: Optional[Exception] = None
+        
+        for strategy in strategy_stats.plan():
+            if job.cancel_requested:
+                raise JobCancelled(job.job_id)
+            name = strategy['name']
+            if last_error is not None and not _strategy_applies(strategy, str(last_error).lower()):
+                continue
+            opts = _strategy_opts(strategy, ydl_opts)
+            if opts is None:
+                continue
+            logger.info(f"Trying download strategy {name}")
+            started = time.monotonic()
+            info_key = InfoCache.key(job.video_id, opts)
+            try:
+                with extractor_pool.lease(opts, output_template, progress_hook) as ydl:
+                    extracted = info_cache.get(info_key)
+                    if extracted is None:
+                        extract_started = time.monotonic()
+                        extracted = ydl.extract_info(job.url, download=False, process=False)
+                        metrics.observe('flac_extract_seconds', time.monotonic() - extract_started)
+                        info_cache.put(info_key, job.video_id, extracted)
+                    if not job.metadata:
+                        job.metadata = _info_metadata(extracted, job.title)
+                        job.title = job.metadata['title']
+                        job.stage = "Starting download..."
+                        job.notify_subscribers(force=True)
+                    # Format selection and download run on a copy so the cached dict stays reusable
+                    download_started = time.monotonic()
+                    info = ydl.process_ie_result(copy.deepcopy(extracted), download=True)
+                    download_seconds = time.monotonic() - download_started
+            except Exception as e:
+                if job.cancel_requested:
+                    raise JobCancelled(job.job_id)
+                logger.warning(f"Download strategy {name} failed: {e}")
+                last_error = e
+                if 'format' not in str(e).lower():
+                    info_cache.invalidate(info_key)
+                if _is_video_error(str(e).lower()):
+                    break
+                strategy_stats.record(name, False, time.monotonic() - started)
+                metrics.inc('flac_download_strategy_total', strategy=name, result='failure')
+                continue
+            # Download time depends on the size of the format picked, not on the strategy
+            strategy_stats.record(name, True, time.monotonic() - started - download_seconds)
+            metrics.inc('flac_download_strategy_total', strategy=name, result='success')
+            metrics.observe('flac_download_seconds', download_seconds)
+            logger.info(f"Download successful with strategy {name}")
+            break
+        
+        if info is None:
+            raise last_error or Exception("No download strategy could run")
+        
+        job.metadata = _info_metadata(info, job.title)
+        job.title = job.metadata['title']
+        
+        source_path = None
+        for requested in info.get('requested_downloads') or []:
+            if requested.get('filepath') and os.path.exists(requested['filepath']):
+                source_path = requested['filepath']
+                break
+        if source_path is None:
+            for ext in ['mp3', 'm4a', 'mp4', 'webm', 'opus', 'ogg', 'wav', 'aac', 'flac']:
+                alt_path = os.path.join(AUDIO_DIR, f"{file_id}.{ext}")
+                if os.path.exists(alt_path) and os.path.getsize(alt_path) > 0:
+                    source_path = alt_path
+                    break
+        
+        if source_path is None or os.path.getsize(source_path) == 0:
+            raise Exception("Download failed - no output file created")
+        
+        logger.info(f"Downloaded {source_path} ({os.path.getsize(source_path)} bytes)")
+        return source_path, info
+    
+    def _postprocess(self, job: DownloadJob, source_path: str, info: Dict[str, Any]):
+        """Remux or transcode the downloaded file as configured, then index it and complete the job."""
+        job.progress = 80
+        job.stage = "Processing audio..."
+        job.notify_subscribers()
+        
+        output_path = source_path
+        ext = output_path.rsplit('.', 1)[-1].lower()
+        codec = 'mp3' if ext == 'mp3' else _audio_codec(info.get('acodec'), ext)
+        
+        if TRANSCODE_TO_MP3 and ext != 'mp3':
+            job.stage = "Converting to MP3..."
             job.notify_subscribers()
-            
-            # Debug: List all files in audio dir
-            logger.info(f"Files in {AUDIO_DIR}: {os.listdir(AUDIO_DIR) if os.path.exists(AUDIO_DIR) else 'DIR NOT FOUND'}")
-            logger.info(f"Looking for output file: {output_path}")
-            logger.info(f"Output path exists: {os.path.exists(output_path)}")
-            
-            if not os.path.exists(output_path):
-                logger.warning(f"Expected output file not found: {output_path}")
-                logger.info(f"Searching for alternative audio files with file_id: {file_id}")
-                
-                for ext in ['mp3', 'm4a', 'mp4', 'webm', 'opus', 'ogg', 'wav', 'aac', 'flac']:
-                    alt_path = os.path.join(AUDIO_DIR, f"{file_id}.{ext}")
-                    logger.info(f"Checking for: {alt_path} - exists: {os.path.exists(alt_path)}")
-                    
-                    if os.path.exists(alt_path) and os.path.getsize(alt_path) > 0:
-                        logger.info(f"Found audio file: {alt_path} (size: {os.path.getsize(alt_path)} bytes)")
-                        if ext != 'mp3':
-                            logger.info(f"Converting {ext} to MP3...")
-                            try:
-                                import subprocess
-                                result = subprocess.run(
-                                    ['ffmpeg', '-i', alt_path, '-acodec', 'libmp3lame', '-q:a', '2', '-y', output_path],
-                                    capture_output=True, timeout=120, text=True
-                                )
-                                if result.returncode == 0:
-                                    logger.info(f"Conversion successful")
-                                    os.remove(alt_path)
-                                else:
-                                    logger.error(f"FFmpeg conversion failed: {result.stderr}")
-                            except Exception as conv_err:
-                                logger.error(f"Conversion error: {conv_err}")
-                        else:
-                            output_path = alt_path
-                            logger.info(f"File is already MP3, using it directly")
-                        break
-            
-            logger.info(f"Final check - output file exists: {os.path.exists(output_path)}")
-            if os.path.exists(output_path):
-                logger.info(f"Final output file size: {os.path.getsize(output_path)} bytes")
-            
-            if not os.path.exists(output_path) or os.path.getsize(output_path) == 0:
-                raise Exception("Download failed - no output file created")
-            
-            cache[job.video_id] = {
-                'file': output_path,
-                'metadata': job.metadata,
-                'downloaded_at': datetime.now().isoformat(),
-                'file_id': file_id
-            }
-            save_cache(cache)
-            
-            job.file_path = output_path
-            job.stream_url = f"/stream/{os.path.basename(output_path)}"
-            job.progress = 100
-            job.stage = "Complete!"
-            job.status = "completed"
+            mp3_path = f"{os.path.splitext(source_path)[0]}.mp3"
+            job.work_files.add(mp3_path)
+            started = time.monotonic()
+            result = _run_ffmpeg(
+                ['ffmpeg', '-i', source_path, '-vn', '-acodec', 'libmp3lame', '-b:a', '192k', '-y', mp3_path],
+                300, job
+            )
+            metrics.observe('flac_transcode_seconds', time.monotonic() - started, operation='mp3')
+            if result.returncode == 0:
+                logger.info(f"Conversion successful")
+                os.remove(source_path)
+                output_path, ext, codec = mp3_path, 'mp3', 'mp3'
+            else:
+                logger.error(f"FFmpeg conversion failed: {result.stderr}")
+        elif info.get('vcodec') not in (None, 'none') and ext != 'mp3':
+            job.stage = "Extracting audio..."
             job.notify_subscribers()
-            
-            logger.info(f"Job {job.job_id} completed: {job.title}")
-            
-        except Exception as e:
-            error_str = str(e)
-            logger.error(f"Job {job.job_id} failed: {error_str}")
-            
-            # Check for authentication/cookie-related errors
-            if any(keyword in error_str.lower() for keyword in [
-                'sign in to confirm', 
-                'bot', 
-                'authentication',
-                'unable to download',
-                'youtube returned'
-            ]):
-                # Check if cookies are actually being used
-                cookies_file = get_youtube_cookies()
-                if cookies_file:
-                    job.error = "YouTube is blocking this server's IP address. Try: 1) Export FRESH cookies from an incognito window while logged into YouTube, 2) Upload via the Cookies button, 3) Try a different video. Cloud servers have ~50% success rate with YouTube."
-                else:
-                    job.error = "YouTube is blocking this server. Upload fresh cookies from a logged-in YouTube session via the Cookies button. Export from incognito/private window for best results."
-                job.stage = "Server Blocked"
-            # Check for format-related errors - should be caught by fallback
-            elif any(keyword in error_str.lower() for keyword in [
-                'requested format is not available',
-                'no formats found',
-                'no matching format',
-                'format not available'
-            ]):
-                job.error = "This video's format is not available. This often happens on cloud servers. Try a different video or upload fresh YouTube cookies."
-                job.stage = "Format Unavailable"
+            started = time.monotonic()
+            output_path = _remux_audio_only(output_path, codec, job)
+            metrics.observe('flac_transcode_seconds', time.monotonic() - started, operation='remux')
+            ext = output_path.rsplit('.', 1)[-1].lower()
+        
+        job.progress = 95
+        job.stage = "Finalizing..."
+        job.notify_subscribers()
+        
+        started = time.monotonic()
+        output_path = _store_blob(job.video_id, output_path, {
+            'metadata': job.metadata,
+            'downloaded_at': datetime.now().isoformat(),
+            'hits': 0,
+            'codec': codec,
+            # kbps of the stored audio, used to avoid re-encoding it into an equal or higher bitrate profile
+            'bitrate': 192 if codec == 'mp3' and TRANSCODE_TO_MP3 else info.get('abr'),
+            'mimetype': AUDIO_MIMETYPES.get(ext, 'application/octet-stream'),
+        })
+        if job.growing is not None:
+            # Players that started on the progressive URL keep seeking against it
+            _alias_stream(job.growing.name, os.path.basename(output_path))
+        _release_growing(job.growing, completed=True)
+        metrics.observe('flac_finalize_seconds', time.monotonic() - started)
+        
+        if np is not None and (WAVEFORM_PEAKS or LOUDNESS_ANALYSIS):
+            job.stage = "Analyzing audio..."
+            job.notify_subscribers()
+            # A deduplicated blob was measured when it was first stored
+            loudness = _blob_loudness(os.path.basename(output_path))
+            analysis = _analyze_track(output_path, loudness=loudness is None, job=job)
+            loudness = loudness or analysis.get('loudness')
+            if loudness:
+                job.metadata = {**job.metadata, 'loudness': loudness}
+                cache.update(job.video_id, metadata=job.metadata)
+        
+        if SEGMENTED_OUTPUT:
+            job.stage = "Segmenting..."
+            job.notify_subscribers()
+            _segment_track(output_path, codec, job)
+        
+        if job.cancel_requested:
+            # The track stays in the library; only the job ends as cancelled
+            raise JobCancelled(job.job_id)
+        job.file_path = output_path
+        job.stream_url = f"/stream/{os.path.basename(output_path)}"
+        job.progress = 100
+        job.stage = "Complete!"
+        self._set_status(job, "completed")
+        self._release(job)
+        job.notify_subscribers()
+        
+        logger.info(f"Job {job.job_id} completed: {job.title}")
+    
+    def _fail(self, job: DownloadJob, e: Exception):
+        if job.cancel_requested:
+            self._cancelled(job)
+            return
+        error_str = str(e)
+        logger.error(f"Job {job.job_id} failed: {error_str}")
+        
+        # Check for authentication/cookie-related errors
+        if any(keyword in error_str.lower() for keyword in [
+            'sign in to confirm', 
+            'bot', 
+            'authentication',
+            'unable to download',
+            'youtube returned'
+        ]):
+            # Check if cookies are actually being used
+            cookies_file = get_youtube_cookies()
+            if cookies_file:
+                job.error = "YouTube is blocking this server's IP address. Try: 1) Export FRESH cookies from an incognito window while logged into YouTube, 2) Upload via the Cookies button, 3) Try a different video. Cloud servers have ~50% success rate with YouTube."
+            else:
+                job.error = "YouTube is blocking this server. Upload fresh cookies from a logged-in YouTube session via the Cookies button. Export from incognito/private window for best results."
+            job.stage = "Server Blocked"
+        # Check for format-related errors - should be caught by fallback
+        elif any(keyword in error_str.lower() for keyword in [
+            'requested format is not available',
+            'no formats found',
+            'no matching format',
+            'format not available'
+        ]):
+            job.error = "This video's format is not available. This often happens on cloud servers. Try a different video or upload fresh YouTube cookies."
+            job.stage = "Format Unavailable"
+        else:
+            job.error = error_str
+            job.stage = "Failed"
+        
+        self._set_status(job, "failed")
+        job.stream_url = None
+        self._release(job)
+        _release_growing(job.growing, completed=False)
+        job.notify_subscribers()
+    
+    def _cancelled(self, job: DownloadJob):
+        job.stage = "Cancelled"
+        job.stream_url = None
+        self._release(job)
+        _release_growing(job.growing, completed=False)
+        paths = set(job.work_files)
+        if job.work_prefix:
+            # Fragments and partial files yt-dlp wrote before its first progress callback
+            with os.scandir(AUDIO_DIR) as entries:
+                paths.update(e.path for e in entries if e.name.startswith(job.work_prefix))
+        for path in paths:
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            except OSError as e:
+                logger.warning(f"Could not remove {os.path.basename(path)} of cancelled job: {e}")
+        self._set_status(job, "cancelled")
+        job.notify_subscribers()
+        logger.info(f"Job {job.job_id} cancelled")
+
+class _Mailbox:
+    """
+    Wake-up flag for one thread-side subscriber. Any number of publishes
+    between two reads collapse into one wake-up, and the reader then renders
+    the current state, so a slow client never accumulates a backlog.
+    """
+
+    def __init__(self):
+        self.cond = threading.Condition()
+        self.pending = False
+
+    def offer(self):
+        with self.cond:
+            self.pending = True
+            self.cond.notify()
+
+    def take(self, timeout: float) -> bool:
+        with self.cond:
+            if not self.pending:
+                self.cond.wait(timeout)
+            woke, self.pending = self.pending, False
+            return woke
+
+
+class _AsyncMailbox:
+    """Wake-up flag for one connection served by the hub's event loop (loop thread only)."""
+
+    def __init__(self):
+        self.event = asyncio.Event()
+
+    def offer(self):
+        self.event.set()
+
+    async def take(self, timeout: float) -> bool:
+        try:
+            await asyncio.wait_for(self.event.wait(), timeout)
+        except asyncio.TimeoutError:
+            return False
+        self.event.clear()
+        return True
+
+
+def _sse_event(event_id: Optional[int], payload: str) -> str:
+    if event_id is None:
+        return f"data: {payload}\n\n"
+    return f"id: {event_id}\ndata: {payload}\n\n"
+
+
+SSE_HEARTBEAT = f"data: {json.dumps({'type': 'heartbeat'})}\n\n"
+
+
+class EventHub:
+    """
+    Fan-out of job events to SSE subscribers.
+    Producers only signal that a channel changed; each subscriber holds a
+    feed that renders what its client has not seen yet (see JobFeed,
+    BatchFeed), so bursts collapse into one write and a slow client never
+    accumulates a backlog. With EVENT_HUB_PORT set, a single asyncio loop
+    thread also serves the SSE connections, so an idle subscriber costs a
+    coroutine and a socket rather than a WSGI thread; the Flask event routes
+    then redirect there. Without it those routes stream from a mailbox fed
+    by the same hub. Opening, polling and closing a feed take locks, stat
+    files and encode JSON, so the loop hands them to its executor threads.
+    """
+
+    def __init__(self, open_feed):
+        # (channel, Last-Event-ID) -> feed, or None if the channel is unknown
+        self.open_feed = open_feed
+        self.lock = threading.Lock()
+        self.sync_subscribers: Dict[str, set] = {}
+        # Only touched from the loop thread
+        self.async_subscribers: Dict[str, set] = {}
+        self.connections = 0
+        self.loop = asyncio.new_event_loop()
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def _run(self):
+        asyncio.set_event_loop(self.loop)
+        if EVENT_HUB_PORT:
+            try:
+                self.loop.run_until_complete(
+                    asyncio.start_server(self._handle_connection, EVENT_HUB_HOST, EVENT_HUB_PORT)
+                )
+                logger.info(f"Event hub serving SSE on {EVENT_HUB_HOST}:{EVENT_HUB_PORT}")
+            except OSError as e:
+                logger.error(f"Event hub could not listen on port {EVENT_HUB_PORT}: {e}")
+        self.loop.run_forever()
+
+    def call_later(self, delay: float, callback):
+        """Run `callback` on the hub loop after `delay` seconds; callable from any thread."""
+        self.loop.call_soon_threadsafe(self.loop.call_later, delay, callback)
+
+    def has_subscribers(self, channel: str) -> bool:
+        return channel in self.sync_subscribers or channel in self.async_subscribers
+
+    def publish(self, channel: str):
+        with self.lock:
+            subscribers = list(self.sync_subscribers.get(channel, ()))
+        for mailbox in subscribers:
+            mailbox.offer()
+        if channel in self.async_subscribers:
+            self.loop.call_soon_threadsafe(self._fanout, channel)
+
+    def _fanout(self, channel: str):
+        for mailbox in list(self.async_subscribers.get(channel, ())):
+            mailbox.offer()
+
+    def subscribe(self, channel: str) -> _Mailbox:
+        mailbox = _Mailbox()
+        with self.lock:
+            self.sync_subscribers.setdefault(channel, set()).add(mailbox)
+            self.connections += 1
+        return mailbox
+
+    def unsubscribe(self, channel: str, mailbox: _Mailbox):
+        with self.lock:
+            subscribers = self.sync_subscribers.get(channel)
+            if subscribers and mailbox in subscribers:
+                subscribers.discard(mailbox)
+                self.connections -= 1
+                if not subscribers:
+                    del self.sync_subscribers[channel]
+
+    async def _handle_connection(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        try:
+            request_line = await asyncio.wait_for(reader.readline(), 10)
+            headers = {}
+            while True:
+                line = await asyncio.wait_for(reader.readline(), 10)
+                if line in (b'\r\n', b'\n', b''):
+                    break
+                name, _, value = line.decode('latin-1').partition(':')
+                headers[name.strip().lower()] = value.strip()
+            parts = request_line.decode('latin-1').split()
+            if len(parts) < 2:
+                return
+            method, path = parts[0], parts[1].split('?', 1)[0]
+            if method == 'OPTIONS':
+                writer.write(
+                    b'HTTP/1.1 204 No Content\r\nAccess-Control-Allow-Origin: *\r\n'
+                    b'Access-Control-Allow-Headers: *\r\nConnection: close\r\n\r\n'
+                )
+                return
+            channel = None
+            match = re.match(r'^/(jobs|batches)/([^/]+)/events$', path)
+            if match and method == 'GET':
+                channel = match.group(2) if match.group(1) == 'jobs' else f"batch:{match.group(2)}"
+            await self._stream(channel, headers.get('last-event-id'), writer)
+        except (ConnectionError, asyncio.TimeoutError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            try:
+                await writer.drain()
+            except ConnectionError:
+                pass
+            writer.close()
+
+    async def _stream(self, channel: Optional[str], last_event_id: Optional[str], writer: asyncio.StreamWriter):
+        loop = asyncio.get_running_loop()
+        mailbox = _AsyncMailbox()
+        feed = None
+        polled = None
+        # Subscribe before the first render so no change can fall between the two
+        if channel:
+            self.async_subscribers.setdefault(channel, set()).add(mailbox)
+        try:
+            if channel:
+                feed = await loop.run_in_executor(None, self.open_feed, channel, last_event_id)
+            if feed is not None:
+                polled = await loop.run_in_executor(None, feed.poll)
+            if polled is None:
+                body = json.dumps({'error': 'Not found'}).encode()
+                writer.write(
+                    b'HTTP/1.1 404 Not Found\r\nContent-Type: application/json\r\n'
+                    b'Access-Control-Allow-Origin: *\r\nConnection: close\r\n'
+                    + f'Content-Length: {len(body)}\r\n\r\n'.encode() + body
+                )
+                return
+            with self.lock:
+                self.connections += 1
+            writer.write(
+                b'HTTP/1.1 200 OK\r\nContent-Type: text/event-stream\r\nCache-Control: no-cache\r\n'
+                b'X-Accel-Buffering: no\r\nAccess-Control-Allow-Origin: *\r\nConnection: close\r\n\r\n'
+                + f'retry: {SSE_RETRY_MS}\n\n'.encode()
+            )
+            chunks, final = polled
+            writer.write(''.join(chunks).encode())
+            await writer.drain()
+            while not final:
+                woke = await mailbox.take(30)
+                current = await loop.run_in_executor(None, feed.poll)
+                if current is None:
+                    break
+                chunks, final = current
+                if chunks:
+                    writer.write(''.join(chunks).encode())
+                elif not woke:
+                    writer.write(SSE_HEARTBEAT.encode())
+                await writer.drain()
+        finally:
+            if channel:
+                subscribers = self.async_subscribers.get(channel)
+                if subscribers is not None:
+                    subscribers.discard(mailbox)
+                    if not subscribers:
+                        del self.async_subscribers[channel]
+            if polled is not None:
+                with self.lock:
+                    self.connections -= 1
+            # Last, so a cancelled await cannot skip the bookkeeping above
+            if feed is not None:
+                await loop.run_in_executor(None, feed.close)
+
+
+def _job_snapshot(job_id: str) -> Optional[tuple]:
+    job = job_manager.get_job(job_id)
+    if not job:
+        cached = cached_job(job_id[6:], touch=False) if job_id.startswith('cache-') else None
+        return (0, json.dumps(cached), True) if cached else None
+    return job.event_id, json.dumps(job.to_dict()), job.status in TERMINAL_STATUSES
+
+
+class JobFeed:
+    """SSE rendering of one job: its full state whenever the event id moved."""
+
+    def __init__(self, job_id: str, last_event_id: Optional[str]):
+        self.job_id = job_id
+        self.sent_id = last_event_id
+        self.first = True
+        # A connected subscriber keeps an unpinned job alive
+        self.job = job_manager.get_job(job_id)
+        if self.job is not None:
+            job_manager.add_waiter(self.job)
+
+    def close(self):
+        if self.job is not None:
+            job_manager.remove_waiter(self.job)
+            self.job = None
+
+    def poll(self) -> Optional[tuple]:
+        snapshot = _job_snapshot(self.job_id)
+        if snapshot is None:
+            return None
+        event_id, payload, final = snapshot
+        chunks = []
+        # A reconnect that already saw the current state only needs new events,
+        # but a finished job is always re-sent so the client learns it is done
+        if str(event_id) != self.sent_id or (final and self.first):
+            chunks.append(_sse_event(event_id, payload))
+            self.sent_id = str(event_id)
+        self.first = False
+        return chunks, final
+
+
+class BatchFeed:
+    """
+    SSE rendering of a batch: one event per member job whose state changed
+    since the last poll, then the batch summary. A (re)connect starts with
+    every member.
+    """
+
+    def __init__(self, batch_id: str):
+        self.batch_id = batch_id
+        # job_id -> event id last sent
+        self.sent: Dict[str, int] = {}
+        self.summary = None
+
+    def close(self):
+        pass
+
+    def poll(self) -> Optional[tuple]:
+        batch = batch_manager.get(self.batch_id)
+        if batch is None:
+            return None
+        chunks = []
+        for job_id in batch.job_ids:
+            job = job_manager.get_job(job_id)
+            if job is not None:
+                if self.sent.get(job_id) == job.event_id:
+                    continue
+                self.sent[job_id] = job.event_id
+                state = job.to_dict()
             else:
-                job.error = error_str
-                job.stage = "Failed"
-            
-            job.status = "failed"
-            job.notify_subscribers()
+                # Cached track, or a finished job already reaped from the registry
+                if job_id in self.sent:
+                    continue
+                self.sent[job_id] = 0
+                state = batch.results.get(job_id)
+                if state is None:
+                    continue
+            chunks.append(_sse_event(None, json.dumps({'type': 'job', 'job': state})))
+        summary = batch.summary()
+        final = summary['remaining'] == 0
+        if chunks or summary != self.summary:
+            self.summary = summary
+            chunks.append(_sse_event(None, json.dumps(dict(summary, type='summary'))))
+        return chunks, final
+
+
+def _open_feed(channel: str, last_event_id: Optional[str]):
+    if channel.startswith('batch:'):
+        return BatchFeed(channel[6:]) if batch_manager.get(channel[6:]) else None
+    return JobFeed(channel, last_event_id) if _job_snapshot(channel) else None
+
+
+event_hub = EventHub(_open_feed)
+
 
 job_manager = JobManager()
 
@@ -555,11 +3361,66 @@ def health():
         'status': 'ok',
         'audio_dir': AUDIO_DIR,
         'cached_videos': len(cache),
-        'active_jobs': len([j for j in job_manager.jobs.values() if j.status in ['queued', 'downloading']]),
+        'active_jobs': job_manager.registry.active(),
+        'jobs': job_manager.job_stats(),
+        'coalesced_requests': job_manager.coalesced_total,
+        'pipeline': job_manager.pipeline_stats(),
+        'scheduler': job_manager.scheduler.stats(),
+        'extractors': extractor_pool.stats(),
+        'info_cache': info_cache.stats(),
+        'batches': batch_manager.stats(),
+        'sse_connections': event_hub.connections,
+        'disk': disk_budget.stats(),
+        'analysis': analysis_backfill.stats(),
+        'renditions': rendition_pool.stats(),
+        'segments': segment_pool.stats(),
         'yt_dlp_version': yt_dlp.version.__version__
     })
 
 
+@metrics.collector
+def _runtime_metrics() -> list:
+    pipeline = job_manager.pipeline_stats()
+    disk = disk_budget.stats()
+    info = info_cache.stats()
+    search = search_cache.stats()
+    with job_manager.lock:
+        by_status = dict(job_manager.registry.counts)
+    return [
+        ('flac_info_cache_lookups_total', 'counter', 'Extracted-info cache lookups, by result.',
+         [({'result': 'hit'}, info['hits']), ({'result': 'miss'}, info['misses'])]),
+        ('flac_search_cache_lookups_total', 'counter', 'Search cache lookups, by result.',
+         [({'result': 'hit'}, search['hits']), ({'result': 'miss'}, search['misses'])]),
+        ('flac_sse_connections', 'gauge', 'Open SSE connections.',
+         [({}, event_hub.connections)]),
+        ('flac_workers', 'gauge', 'Worker threads per pipeline stage.',
+         [({'stage': stage}, s['workers']) for stage, s in pipeline.items()]),
+        ('flac_workers_busy', 'gauge', 'Worker threads currently running a job, per pipeline stage.',
+         [({'stage': stage}, s['busy']) for stage, s in pipeline.items()]),
+        ('flac_queue_depth', 'gauge', 'Jobs waiting for a worker, per pipeline stage.',
+         [({'stage': stage}, s['queued']) for stage, s in pipeline.items()]),
+        ('flac_jobs', 'gauge', 'Tracked jobs by status.',
+         [({'status': status}, n) for status, n in by_status.items()]),
+        ('flac_extractors_idle', 'gauge', 'Warm YoutubeDL instances available for reuse.',
+         [({}, extractor_pool.stats()['idle'])]),
+        ('flac_library_tracks', 'gauge', 'Tracks in the library index.',
+         [({}, len(cache))]),
+        ('flac_renditions_pending', 'gauge', 'Rendition encodes queued or running.',
+         [({}, rendition_pool.stats()['pending'])]),
+        ('flac_disk_used_bytes', 'gauge', 'Bytes stored in AUDIO_DIR.',
+         [({}, disk['used_bytes'])]),
+        ('flac_disk_quota_bytes', 'gauge', 'AUDIO_DIR quota in bytes.',
+         [({}, disk['quota_bytes'])]),
+        ('flac_disk_evictions_total', 'counter', 'Files evicted to stay under the disk quota.',
+         [({}, disk['evictions'])]),
+    ]
+
+
+@app.route('/metrics')
+def prometheus_metrics():
+    return Response(metrics.render(), mimetype='text/plain; version=0.0.4')
+
+
 @app.route('/debug/test-video', methods=['GET'])
 def debug_test_video():
     """Debug endpoint to test if a specific video works and what error it returns"""
@@ -584,7 +3445,7 @@ def debug_test_video():
                 ydl_opts['cookiefile'] = cookies_file
                 logger.info(f"Using cookies: {cookies_file}")
         
-        with yt_dlp.YoutubeDL(ydl_opts) as ydl:
+        with extractor_pool.lease(ydl_opts) as ydl:
             info = ydl.extract_info(url, download=False)
             formats = info.get('formats', [])
             audio_formats = [f for f in formats if f.get('acodec') != 'none']
@@ -634,6 +3495,7 @@ def upload_cookies():
                 os.remove(cookies_path)
                 return jsonify({'success': False, 'error': 'Invalid YouTube cookies file - must contain youtube.com cookies'}), 400
         
+        cookie_resolver.invalidate()
         logger.info(f"Cookies file uploaded successfully: {cookies_path}")
         
         return jsonify({
@@ -653,10 +3515,13 @@ def get_cookies_status():
     try:
         cookies_file = get_youtube_cookies()
         if cookies_file and os.path.exists(cookies_file):
+            resolved = cookie_resolver.stats()
             return jsonify({
                 'has_cookies': True,
                 'path': cookies_file,
-                'file_size': os.path.getsize(cookies_file)
+                'file_size': os.path.getsize(cookies_file),
+                'source': resolved['source'],
+                'format': resolved['format'],
             })
         else:
             return jsonify({
@@ -670,68 +3535,174 @@ def get_cookies_status():
         return jsonify({'error': str(e)}), 500
 
 
+def _normalize_query(query: str) -> str:
+    return ' '.join(unicodedata.normalize('NFKC', query).casefold().split())
+
+
+class SearchCache:
+    """
+    TTL + LRU cache of /search results keyed by normalized query.
+    An entry fetched with a larger limit serves any smaller one, as does an
+    entry whose upstream result came back short (there is nothing more to
+    fetch). Concurrent misses for the same query wait on a single upstream
+    call when it asks for at least as many results as they need.
+    """
+
+    def __init__(self, fetch, ttl: int, max_entries: int):
+        self.fetch = fetch
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.lock = threading.Lock()
+        # key -> (expires_at, limit, results)
+        self.entries: OrderedDict = OrderedDict()
+        # key -> [limit, done event, results, error]
+        self.inflight: Dict[str, list] = {}
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self.upstream_calls = 0
+
+    def _lookup(self, key: str, limit: int) -> Optional[list]:
+        entry = self.entries.get(key)
+        if entry is None:
+            return None
+        expires_at, fetched, results = entry
+        if expires_at < time.monotonic():
+            del self.entries[key]
+            return None
+        if fetched < limit and len(results) >= fetched:
+            return None
+        self.entries.move_to_end(key)
+        return results[:limit]
+
+    def search(self, query: str, limit: int) -> list:
+        key = _normalize_query(query)
+        with self.lock:
+            results = self._lookup(key, limit)
+            if results is not None:
+                self.hits += 1
+                return results
+            self.misses += 1
+            call = self.inflight.get(key)
+            if call is not None and call[0] >= limit:
+                self.coalesced += 1
+                owner = False
+            else:
+                call = [limit, threading.Event(), None, None]
+                # A wider fetch replaces a narrower one as the call to join
+                self.inflight[key] = call
+                self.upstream_calls += 1
+                owner = True
+
+        if not owner:
+            call[1].wait()
+            if call[3] is not None:
+                raise call[3]
+            return call[2][:limit]
+
+        try:
+            call[2] = self.fetch(query, limit)
+        except Exception as e:
+            call[3] = e
+            raise
+        finally:
+            with self.lock:
+                if self.inflight.get(key) is call:
+                    del self.inflight[key]
+                if call[3] is None:
+                    current = self.entries.get(key)
+                    if current is None or current[1] <= limit or current[0] < time.monotonic():
+                        self.entries[key] = (time.monotonic() + self.ttl, limit, call[2])
+                        self.entries.move_to_end(key)
+                        while len(self.entries) > self.max_entries:
+                            self.entries.popitem(last=False)
+            call[1].set()
+        return call[2]
+
+    def stats(self) -> Dict[str, Any]:
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {
+                'entries': len(self.entries),
+                'max_entries': self.max_entries,
+                'ttl_seconds': self.ttl,
+                'hits': self.hits,
+                'misses': self.misses,
+                'coalesced': self.coalesced,
+                'upstream_calls': self.upstream_calls,
+                'hit_rate': round(self.hits / lookups, 4) if lookups else 0.0,
+            }
+
+
+def _search_upstream(query: str, max_results: int) -> list:
+    logger.info(f"Searching YouTube for: {query}")
+    
+    ydl_opts = {
+        'quiet': False,
+        'no_warnings': False,
+        'extract_flat': True,
+        'default_search': 'ytsearch',
+        'nocheckcertificate': True,
+        'geo_bypass': True,
+        'socket_timeout': 30,
+        'http_headers': {
+            'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36',
+            'Accept-Language': 'en-US,en;q=0.9',
+            'Accept-Encoding': 'gzip, deflate',
+            'Accept': 'text/html,application/xhtml+xml,application/xml;q=0.9,*/*;q=0.8',
+            'DNT': '1',
+            'Connection': 'keep-alive',
+            'Upgrade-Insecure-Requests': '1'
+        },
+        'extractor_args': {
+            'youtube': {
+                'player_client': ['android', 'web', 'mweb'],
+                'skip': ['hls', 'dash'],
+            }
+        },
+        'retries': 3,
+    }
+    
+    cookies_file = get_youtube_cookies()
+    if cookies_file:
+        ydl_opts['cookiefile'] = cookies_file
+    
+    logger.info(f"yt-dlp version: {yt_dlp.version.__version__}")
+    
+    with extractor_pool.lease(ydl_opts) as ydl:
+        logger.info(f"Attempting search: ytsearch{max_results}:{query}")
+        result = ydl.extract_info(f"ytsearch{max_results}:{query}", download=False)
+    
+    logger.info(f"Search returned {len(result.get('entries', []))} results")
+    
+    videos = []
+    for entry in result.get('entries', []):
+        if entry:
+            videos.append({
+                'id': entry.get('id', ''),
+                'title': entry.get('title', 'Unknown'),
+                'channelTitle': entry.get('uploader', entry.get('channel', 'Unknown')),
+                'thumbnail': entry.get('thumbnail', f"https://img.youtube.com/vi/{entry.get('id', '')}/mqdefault.jpg"),
+                'videoId': entry.get('id', ''),
+                'url': f"https://www.youtube.com/watch?v={entry.get('id', '')}",
+                'duration': entry.get('duration', 0),
+            })
+    return videos
+
+
+search_cache = SearchCache(_search_upstream, SEARCH_CACHE_TTL, SEARCH_CACHE_SIZE)
+
+
 @app.route('/search', methods=['GET'])
 def search_youtube():
-    query = request.args.get('q', '')
+    query = request.args.get('q', '').strip()
     max_results = int(request.args.get('limit', 10))
     
     if not query:
         return jsonify({'error': 'No query provided'}), 400
     
     try:
-        logger.info(f"Searching YouTube for: {query}")
-        
-        ydl_opts = {
-            'quiet': False,
-            'no_warnings': False,
-            'extract_flat': True,
-            'default_search': 'ytsearch',
-            'nocheckcertificate': True,
-            'geo_bypass': True,
-            'socket_timeout': 30,
-            'http_headers': {
-                'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36',
-                'Accept-Language': 'en-US,en;q=0.9',
-                'Accept-Encoding': 'gzip, deflate',
-                'Accept': 'text/html,application/xhtml+xml,application/xml;q=0.9,*/*;q=0.8',
-                'DNT': '1',
-                'Connection': 'keep-alive',
-                'Upgrade-Insecure-Requests': '1'
-            },
-            'extractor_args': {
-                'youtube': {
-                    'player_client': ['android', 'web', 'mweb'],
-                    'skip': ['hls', 'dash'],
-                }
-            },
-            'retries': 3,
-        }
-        
-        cookies_file = get_youtube_cookies()
-        if cookies_file:
-            ydl_opts['cookiefile'] = cookies_file
-        
-        logger.info(f"yt-dlp version: {yt_dlp.version.__version__}")
-        
-        with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-            logger.info(f"Attempting search: ytsearch{max_results}:{query}")
-            result = ydl.extract_info(f"ytsearch{max_results}:{query}", download=False)
-        
-        logger.info(f"Search returned {len(result.get('entries', []))} results")
-        
-        videos = []
-        for entry in result.get('entries', []):
-            if entry:
-                videos.append({
-                    'id': entry.get('id', ''),
-                    'title': entry.get('title', 'Unknown'),
-                    'channelTitle': entry.get('uploader', entry.get('channel', 'Unknown')),
-                    'thumbnail': entry.get('thumbnail', f"https://img.youtube.com/vi/{entry.get('id', '')}/mqdefault.jpg"),
-                    'videoId': entry.get('id', ''),
-                    'url': f"https://www.youtube.com/watch?v={entry.get('id', '')}",
-                    'duration': entry.get('duration', 0),
-                })
-        
+        videos = search_cache.search(query, max_results)
         logger.info(f"Returning {len(videos)} formatted videos")
         return jsonify({'results': videos})
     
@@ -740,11 +3711,18 @@ def search_youtube():
         return jsonify({'error': str(e), 'results': []}), 500
 
 
+@app.route('/search/stats')
+def search_stats():
+    return jsonify(search_cache.stats())
+
+
 @app.route('/jobs', methods=['POST'])
 def create_download_job():
     data = request.get_json() or {}
     url = data.get('url', '')
     title = data.get('title', '')
+    priority = PriorityScheduler.normalize(data.get('priority'))
+    pinned = bool(data.get('pin', False))
     
     if not url:
         return jsonify({'error': 'No URL provided'}), 400
@@ -753,7 +3731,11 @@ def create_download_job():
     if not video_id:
         return jsonify({'error': 'Invalid YouTube URL'}), 400
     
-    job = job_manager.create_job(video_id, url, title)
+    cached = cached_job(video_id, url, title)
+    if cached:
+        return jsonify(cached)
+    
+    job = job_manager.create_job(video_id, url, title, priority, pinned)
     
     return jsonify(job.to_dict())
 
@@ -762,39 +3744,77 @@ def create_download_job():
 def get_job_status(job_id: str):
     job = job_manager.get_job(job_id)
     if not job:
+        cached = cached_job(job_id[6:], touch=False) if job_id.startswith('cache-') else None
+        if cached:
+            return jsonify(cached)
         return jsonify({'error': 'Job not found'}), 404
+    # Polling clients count as interested too
+    job.last_seen = time.monotonic()
     return jsonify(job.to_dict())
 
 
-@app.route('/jobs/<job_id>/events', methods=['GET'])
-def job_events(job_id: str):
+@app.route('/jobs/<job_id>', methods=['DELETE'])
+def cancel_job(job_id: str):
+    job = job_manager.get_job(job_id)
+    if not job:
+        return jsonify({'error': 'Job not found'}), 404
+    if not job_manager.cancel(job):
+        return jsonify(dict(job.to_dict(), cancelled=False)), 409
+    return jsonify(dict(job.to_dict(), cancelled=True))
+
+
+@app.route('/jobs/<job_id>/priority', methods=['POST'])
+def bump_job(job_id: str):
+    """Raise a queued job's priority, e.g. when a user presses play on a track that is still queued."""
     job = job_manager.get_job(job_id)
     if not job:
         return jsonify({'error': 'Job not found'}), 404
+    data = request.get_json(silent=True) or {}
+    priority = PriorityScheduler.normalize(data.get('priority'))
+    bumped = job_manager.bump(job, priority)
+    return jsonify(dict(job.to_dict(), bumped=bumped))
+
+
+@app.route('/jobs/<job_id>/events', methods=['GET'])
+def job_events(job_id: str):
+    if _job_snapshot(job_id) is None:
+        return jsonify({'error': 'Job not found'}), 404
+    
+    if EVENT_HUB_PORT:
+        return _event_hub_redirect(f"/jobs/{job_id}/events")
     
+    return _sse_response(job_id, request.headers.get('Last-Event-ID'))
+
+
+def _sse_response(channel: str, last_event_id: Optional[str]) -> Response:
+    """Stream `channel` from this WSGI worker (used when the event hub has no port of its own)."""
     def generate():
-        q = Queue()
-        job.subscribers.append(q)
+        mailbox = event_hub.subscribe(channel)
+        feed = None
         
         try:
-            yield f"data: {json.dumps(job.to_dict())}\n\n"
+            feed = _open_feed(channel, last_event_id)
+            polled = feed.poll() if feed else None
+            if polled is None:
+                return
+            yield f"retry: {SSE_RETRY_MS}\n\n"
+            chunks, final = polled
+            yield ''.join(chunks)
             
-            while True:
-                try:
-                    data = q.get(timeout=30)
-                    yield f"data: {data}\n\n"
-                    
-                    event_data = json.loads(data)
-                    if event_data.get('status') in ['completed', 'failed']:
-                        break
-                except:
-                    yield f"data: {json.dumps({'type': 'heartbeat'})}\n\n"
-                    
-                    if job.status in ['completed', 'failed']:
-                        break
+            while not final:
+                woke = mailbox.take(timeout=30)
+                polled = feed.poll()
+                if polled is None:
+                    break
+                chunks, final = polled
+                if chunks:
+                    yield ''.join(chunks)
+                elif not woke:
+                    yield SSE_HEARTBEAT
         finally:
-            if q in job.subscribers:
-                job.subscribers.remove(q)
+            if feed is not None:
+                feed.close()
+            event_hub.unsubscribe(channel, mailbox)
     
     return Response(
         generate(),
@@ -808,6 +3828,93 @@ def job_events(job_id: str):
     )
 
 
+def _event_hub_redirect(path: str):
+    base = EVENT_HUB_URL or f"{request.scheme}://{request.host.rsplit(':', 1)[0]}:{EVENT_HUB_PORT}"
+    return redirect(f"{base}{path}", code=307)
+
+
+_VIDEO_ID_RE = re.compile(r'^[a-zA-Z0-9_-]{11}$')
+
+
+@app.route('/jobs/batch', methods=['POST'])
+def create_batch():
+    """
+    Queue many tracks at once. Accepts {"items": [...]} (or "urls"/"ids")
+    where each item is a URL, a bare video id, or {"url"|"id", "title"}.
+    Library hits are resolved up front; everything else becomes (or joins)
+    a download job. Progress for all of them streams from /batches/<id>/events.
+    """
+    data = request.get_json() or {}
+    items = data.get('items') or data.get('urls') or data.get('ids') or []
+    if not isinstance(items, list) or not items:
+        return jsonify({'error': 'No items provided'}), 400
+    if len(items) > BATCH_MAX_ITEMS:
+        return jsonify({'error': f'At most {BATCH_MAX_ITEMS} items per batch'}), 400
+    
+    batch = batch_manager.create()
+    invalid = []
+    pending = []
+    seen = set()
+    states = []
+    for index, item in enumerate(items):
+        if isinstance(item, dict):
+            raw, title = item.get('url') or item.get('id') or '', item.get('title', '')
+        else:
+            raw, title = str(item), ''
+        video_id = raw if _VIDEO_ID_RE.match(raw) else extract_video_id(raw)
+        if not video_id:
+            invalid.append({'index': index, 'item': raw})
+            continue
+        if video_id in seen:
+            continue
+        seen.add(video_id)
+        url = raw if raw != video_id else f"https://www.youtube.com/watch?v={video_id}"
+        cached = cached_job(video_id, url, title)
+        if cached:
+            batch_manager.add_cached(batch, cached)
+            states.append(cached)
+        else:
+            pending.append((video_id, url, title))
+    
+    cached_count = len(states)
+    priority = PriorityScheduler.normalize(data.get('priority'), default='bulk')
+    for job in job_manager.create_batch_jobs(batch, pending, priority):
+        states.append(job.to_dict())
+    batch_manager.seal(batch)
+    
+    return jsonify(dict(
+        batch.summary(),
+        cached=cached_count,
+        queued=len(pending),
+        invalid=invalid,
+        jobs=states,
+        events_url=f"/batches/{batch.batch_id}/events",
+    ))
+
+
+@app.route('/batches/<batch_id>', methods=['GET'])
+def get_batch(batch_id: str):
+    batch = batch_manager.get(batch_id)
+    if not batch:
+        return jsonify({'error': 'Batch not found'}), 404
+    jobs = []
+    for job_id in batch.job_ids:
+        job = job_manager.get_job(job_id)
+        state = job.to_dict() if job else batch.results.get(job_id)
+        if state:
+            jobs.append(state)
+    return jsonify(dict(batch.summary(), jobs=jobs))
+
+
+@app.route('/batches/<batch_id>/events', methods=['GET'])
+def batch_events(batch_id: str):
+    if not batch_manager.get(batch_id):
+        return jsonify({'error': 'Batch not found'}), 404
+    if EVENT_HUB_PORT:
+        return _event_hub_redirect(f"/batches/{batch_id}/events")
+    return _sse_response(f"batch:{batch_id}", None)
+
+
 @app.route('/download', methods=['GET', 'POST'])
 def download_audio():
     url = request.args.get('url')
@@ -822,28 +3929,27 @@ def download_audio():
     if not video_id:
         return jsonify({'error': 'Invalid YouTube URL'}), 400
     
-    if video_id in cache:
-        cached_entry = cache[video_id]
-        file_path = cached_entry.get('file', '')
-        if file_path and os.path.exists(file_path) and os.path.getsize(file_path) > 0:
-            return jsonify({
-                'file': f"/stream/{os.path.basename(file_path)}",
-                'metadata': cached_entry.get('metadata', {}),
-                'cached': True,
-                'video_id': video_id
-            })
+    cached = cached_job(video_id, url)
+    if cached:
+        return jsonify({
+            'file': cached['stream_url'],
+            'metadata': cached['metadata'],
+            'cached': True,
+            'video_id': video_id
+        })
     
     job = job_manager.create_job(video_id, url, "")
     
-    timeout = 180
-    start = time.time()
-    while job.status not in ['completed', 'failed'] and (time.time() - start) < timeout:
-        time.sleep(0.5)
+    job_manager.add_waiter(job)
+    try:
+        job.done.wait(timeout=180)
+    finally:
+        job_manager.remove_waiter(job)
     
     if job.status == 'completed':
         return jsonify({
             'file': job.stream_url,
-            'metadata': job.metadata,
+            'metadata': job.metadata or {},
             'cached': False,
             'video_id': video_id
         })
@@ -851,56 +3957,342 @@ def download_audio():
         return jsonify({'error': job.error or 'Download timed out'}), 500
 
 
+def _parse_range(header: str, size: int) -> Optional[list]:
+    """
+    Parse a bytes Range header into sorted, merged (start, end) pairs.
+    Returns None when the header should be ignored (malformed or too many
+    ranges) and an empty list when no range is satisfiable.
+    """
+    if not header.startswith('bytes='):
+        return None
+    ranges = []
+    for part in header[6:].split(','):
+        part = part.strip()
+        if not part:
+            continue
+        first, sep, last = part.partition('-')
+        if not sep:
+            return None
+        try:
+            if first == '':
+                suffix = int(last)
+                if suffix <= 0:
+                    continue
+                start, end = max(size - suffix, 0), size - 1
+            else:
+                start = int(first)
+                end = int(last) if last else size - 1
+                if last and start > end:
+                    return None
+                if start >= size:
+                    continue
+                end = min(end, size - 1)
+        except ValueError:
+            return None
+        ranges.append((start, end))
+    if len(ranges) > MAX_STREAM_RANGES:
+        return None
+    ranges.sort()
+    merged = []
+    for start, end in ranges:
+        if merged and start <= merged[-1][1] + 1:
+            merged[-1] = (merged[-1][0], max(merged[-1][1], end))
+        else:
+            merged.append((start, end))
+    return merged
+
+
+def _read_range(f, length: int):
+    try:
+        remaining = length
+        while remaining > 0:
+            data = f.read(min(STREAM_BLOCK_SIZE, remaining))
+            if not data:
+                break
+            remaining -= len(data)
+            metrics.inc('flac_stream_bytes_total', len(data))
+            yield data
+    finally:
+        f.close()
+
+
+class _FileRange:
+    """
+    WSGI body of `length` bytes read from an open file. The server calls
+    close() when the response ends, which releases the file even if the
+    body was never iterated (HEAD, or a client gone before the first chunk).
+    """
+
+    def __init__(self, f, length: int):
+        self.f = f
+        self.length = length
+
+    def __iter__(self):
+        return _read_range(self.f, self.length)
+
+    def close(self):
+        self.f.close()
+
+
+def _file_body(file_path: str, start: int, length: int):
+    """
+    Body for `length` bytes of `file_path` from `start`.
+    Uses the server's wsgi.file_wrapper when available (gunicorn/waitress
+    sendfile from the current offset, bounded by Content-Length), otherwise
+    falls back to a chunked read. Either body closes the file when the
+    server closes the response.
+    """
+    f = open(file_path, 'rb')
+    f.seek(start)
+    file_wrapper = request.environ.get('wsgi.file_wrapper')
+    if file_wrapper is not None:
+        # sendfile bypasses Python, so the announced length is what gets counted
+        metrics.inc('flac_stream_bytes_total', length)
+        return file_wrapper(f, STREAM_BLOCK_SIZE)
+    return _FileRange(f, length)
+
+
+def _multipart_body(file_path: str, ranges: list, size: int, mimetype: str, boundary: str):
+    with open(file_path, 'rb') as f:
+        for start, end in ranges:
+            yield (
+                f"\r\n--{boundary}\r\nContent-Type: {mimetype}\r\n"
+                f"Content-Range: bytes {start}-{end}/{size}\r\n\r\n"
+            ).encode()
+            f.seek(start)
+            remaining = end - start + 1
+            while remaining > 0:
+                data = f.read(min(STREAM_BLOCK_SIZE, remaining))
+                if not data:
+                    break
+                remaining -= len(data)
+                metrics.inc('flac_stream_bytes_total', len(data))
+                yield data
+        yield f"\r\n--{boundary}--\r\n".encode()
+
+
+def _serve_file(file_path: str, mimetype: str) -> Response:
+    """
+    Serve an immutable stored file with validators, conditional requests
+    (304/412) and single, suffix and multi-range requests.
+    """
+    st = os.stat(file_path)
+    size = st.st_size
+    blob = _BLOB_RE.match(os.path.basename(file_path))
+    rendition = _RENDITION_RE.match(os.path.basename(file_path))
+    # A blob's digest identifies its bytes across re-downloads; other files fall back to size+mtime
+    if blob:
+        etag = blob.group(1)
+    elif rendition:
+        etag = f"{rendition.group(1)}-{rendition.group(2)}"
+    else:
+        etag = f"{size:x}-{st.st_mtime_ns:x}"
+    last_modified = datetime.fromtimestamp(int(st.st_mtime), timezone.utc)
+    
+    def with_validators(response: Response) -> Response:
+        response.set_etag(etag)
+        response.last_modified = last_modified
+        response.headers['Accept-Ranges'] = 'bytes'
+        response.headers['Cache-Control'] = STREAM_CACHE_CONTROL
+        return response
+    
+    if request.if_match and not request.if_match.contains(etag):
+        return with_validators(Response(status=412))
+    if request.if_unmodified_since and last_modified > request.if_unmodified_since:
+        return with_validators(Response(status=412))
+    if request.if_none_match:
+        if request.if_none_match.contains_weak(etag):
+            return with_validators(Response(status=304))
+    elif request.if_modified_since and last_modified <= request.if_modified_since:
+        return with_validators(Response(status=304))
+    
+    ranges = None
+    range_header = request.headers.get('Range')
+    if range_header:
+        if_range = request.if_range
+        if if_range.etag is None and if_range.date is None:
+            ranges = _parse_range(range_header.replace(' ', ''), size)
+        elif (if_range.etag == etag
+              or (if_range.date is not None and if_range.date == last_modified)):
+            ranges = _parse_range(range_header.replace(' ', ''), size)
+    
+    if ranges == []:
+        response = with_validators(Response(status=416))
+        response.headers['Content-Range'] = f'bytes */{size}'
+        return response
+    
+    if ranges and len(ranges) == 1:
+        start, end = ranges[0]
+        length = end - start + 1
+        response = Response(
+            _file_body(file_path, start, length),
+            status=206,
+            mimetype=mimetype,
+            direct_passthrough=True
+        )
+        response.headers['Content-Range'] = f'bytes {start}-{end}/{size}'
+        response.headers['Content-Length'] = length
+        return with_validators(response)
+    
+    if ranges:
+        boundary = uuid.uuid4().hex
+        length = sum(
+            len(f"\r\n--{boundary}\r\nContent-Type: {mimetype}\r\nContent-Range: bytes {s}-{e}/{size}\r\n\r\n")
+            + (e - s + 1)
+            for s, e in ranges
+        ) + len(f"\r\n--{boundary}--\r\n")
+        response = Response(
+            _multipart_body(file_path, ranges, size, mimetype, boundary),
+            status=206,
+            content_type=f'multipart/byteranges; boundary={boundary}',
+            direct_passthrough=True
+        )
+        response.headers['Content-Length'] = length
+        return with_validators(response)
+    
+    response = Response(
+        _file_body(file_path, 0, size),
+        status=200,
+        mimetype=mimetype,
+        direct_passthrough=True
+    )
+    response.headers['Content-Length'] = size
+    return with_validators(response)
+
+
+def _follow_growing(growing: GrowingFile, f, start: int, end: Optional[int]):
+    """Yield bytes start..end (end None: until the download finishes) as they land on disk."""
+    try:
+        pos = start
+        while end is None or pos <= end:
+            available = growing.wait_for(f, pos, PROGRESSIVE_WAIT_SECONDS)
+            if growing.failed:
+                logger.warning(f"Download of {growing.name} failed while streaming at byte {pos}")
+                break
+            if available <= pos:
+                if not growing.complete:
+                    logger.warning(f"Timed out waiting for {growing.name} at byte {pos}")
+                break
+            limit = available if end is None else min(available, end + 1)
+            f.seek(pos)
+            data = f.read(min(STREAM_BLOCK_SIZE, limit - pos))
+            if not data:
+                break
+            pos += len(data)
+            metrics.inc('flac_stream_bytes_total', len(data))
+            yield data
+    finally:
+        f.close()
+
+
+def _serve_growing(growing: GrowingFile) -> Response:
+    """
+    Serve a file that is still downloading. With a known final size ranges are
+    answered in full and reads block until the bytes exist; with an unknown
+    size a full request streams until completion and a range gets what is on
+    disk now. A failed download ends the body early.
+    """
+    try:
+        f = growing.open()
+    except FileNotFoundError:
+        return 'Not Found', 404
+    
+    total = growing.expected_size
+    range_header = request.headers.get('Range', '').replace(' ', '')
+    headers = {'Accept-Ranges': 'bytes', 'Cache-Control': 'no-store'}
+    
+    if total:
+        ranges = _parse_range(range_header, total) if range_header else None
+        if ranges == []:
+            f.close()
+            headers['Content-Range'] = f'bytes */{total}'
+            return Response(status=416, headers=headers)
+        if ranges:
+            start, end = ranges[0]
+            headers['Content-Range'] = f'bytes {start}-{end}/{total}'
+            status = 206
+        else:
+            start, end = 0, total - 1
+            status = 200
+        headers['Content-Length'] = end - start + 1
+        return Response(_follow_growing(growing, f, start, end), status=status,
+                        mimetype=growing.mimetype, headers=headers, direct_passthrough=True)
+    
+    match = re.match(r'^bytes=(\d+)-(\d*)$', range_header)
+    if match:
+        start = int(match.group(1))
+        available = growing.wait_for(f, start, PROGRESSIVE_WAIT_SECONDS)
+        if available <= start:
+            f.close()
+            headers['Content-Range'] = f'bytes */{available if growing.complete else "*"}'
+            return Response(status=416, headers=headers)
+        end = available - 1
+        if match.group(2):
+            end = min(end, int(match.group(2)))
+        headers['Content-Range'] = f'bytes {start}-{end}/*'
+        headers['Content-Length'] = end - start + 1
+        return Response(_follow_growing(growing, f, start, end), status=206,
+                        mimetype=growing.mimetype, headers=headers, direct_passthrough=True)
+    
+    return Response(_follow_growing(growing, f, 0, None), status=200,
+                    mimetype=growing.mimetype, headers=headers, direct_passthrough=True)
+
+
 @app.route('/stream/<filename>')
 def stream_audio(filename):
     if '..' in filename or '/' in filename:
         return 'Forbidden', 403
     
+    growing = growing_files.get(filename)
+    if growing is not None and not growing.complete and not growing.failed:
+        return _serve_growing(growing)
+    
     file_path = os.path.join(AUDIO_DIR, filename)
     
     if not os.path.exists(file_path):
-        return 'Not Found', 404
-    
-    file_size = os.path.getsize(file_path)
+        filename = stream_aliases.get(filename, '')
+        file_path = os.path.join(AUDIO_DIR, filename)
+        if not filename or not os.path.exists(file_path):
+            return 'Not Found', 404
     
     range_header = request.headers.get('Range')
-    if range_header:
-        try:
-            byte_range = range_header.replace('bytes=', '').split('-')
-            start = int(byte_range[0]) if byte_range[0] else 0
-            end = int(byte_range[1]) if byte_range[1] else file_size - 1
-            
-            length = end - start + 1
-            
-            def generate():
-                with open(file_path, 'rb') as f:
-                    f.seek(start)
-                    remaining = length
-                    while remaining > 0:
-                        chunk_size = min(8192, remaining)
-                        data = f.read(chunk_size)
-                        if not data:
-                            break
-                        remaining -= len(data)
-                        yield data
-            
-            response = Response(
-                generate(),
-                status=206,
-                mimetype='audio/mpeg',
-                direct_passthrough=True
-            )
-            response.headers['Content-Range'] = f'bytes {start}-{end}/{file_size}'
-            response.headers['Accept-Ranges'] = 'bytes'
-            response.headers['Content-Length'] = length
-            response.headers['Cache-Control'] = 'no-cache'
-            return response
-        except Exception as e:
-            logger.warning(f"Range request error: {e}")
+    rendition = _RENDITION_RE.match(filename)
+    record = cache.get_rendition(rendition.group(1), rendition.group(2)) if rendition else None
+    # Seeks within a track refresh recency but only a play from the start counts as a hit
+    disk_budget.touch(filename, hit=not range_header or range_header.replace(' ', '').startswith('bytes=0-'),
+                      source=record.get('source') if record else None)
     
-    response = send_file(file_path, mimetype='audio/mpeg')
-    response.headers['Accept-Ranges'] = 'bytes'
-    response.headers['Content-Length'] = file_size
+    owners = cache.owners(filename)
+    entry = cache.get(owners[0], {}) if owners else {}
+    mimetype = entry.get('mimetype') or AUDIO_MIMETYPES.get(filename.rsplit('.', 1)[-1].lower(), 'application/octet-stream')
+    return _serve_file(file_path, mimetype)
+
+
+@app.route('/stream/<video_id>/<profile>')
+def stream_profile(video_id, profile):
+    """
+    Stream a track in a given profile: 'source' (as stored) or one of
+    RENDITION_PROFILES. Redirects to the rendition's immutable /stream URL,
+    encoding it from the stored source on the first request for it.
+    """
+    if profile != 'source' and profile not in RENDITION_PROFILES:
+        return jsonify({'error': f'Unknown profile: {profile}', 'profiles': ['source', *RENDITION_PROFILES]}), 400
+    entry = cache.get(video_id)
+    if not entry or not os.path.exists(entry.get('file', '')):
+        return jsonify({'error': 'Not in cache'}), 404
+    file_path = _rendition_file(entry, profile)
+    if file_path is None:
+        if not entry.get('digest'):
+            return jsonify({'error': 'Track predates the blob store; only the source profile is available'}), 409
+        task = rendition_pool.submit(entry, profile)
+        if task is None:
+            return jsonify({'error': 'Too many renditions encoding, try again shortly'}), 503, {'Retry-After': '10'}
+        if not task['event'].wait(RENDITION_WAIT_SECONDS):
+            return jsonify({'error': 'Rendition is still encoding'}), 503, {'Retry-After': '5'}
+        if task['error'] or not os.path.exists(task['path']):
+            return jsonify({'error': task['error'] or 'Rendition was evicted'}), 500
+        file_path = task['path']
+    response = redirect(f"/stream/{os.path.basename(file_path)}", code=302)
     response.headers['Cache-Control'] = 'no-cache'
     return response
 
@@ -908,17 +4300,114 @@ def stream_audio(filename):
 @app.route('/metadata/<video_id>')
 def get_metadata(video_id):
     if video_id not in cache:
-        return jsonify({'error': 'Not in cache'}), 404
+        # Still downloading: metadata is known as soon as extraction finishes
+        metadata = info_cache.metadata(video_id)
+        if metadata is None:
+            return jsonify({'error': 'Not in cache'}), 404
+        job = job_manager.get_job(job_manager.inflight.get(video_id, ''))
+        return jsonify({
+            'video_id': video_id,
+            'metadata': metadata,
+            'file': job.stream_url if job else None,
+            'pending': True,
+        })
     
     entry = cache[video_id]
     return jsonify({
         'video_id': video_id,
         'metadata': entry.get('metadata', {}),
         'file': f"/stream/{os.path.basename(entry['file'])}",
-        'downloaded_at': entry.get('downloaded_at')
+        'codec': entry.get('codec', 'mp3'),
+        'mimetype': entry.get('mimetype', 'audio/mpeg'),
+        'downloaded_at': entry.get('downloaded_at'),
+        'waveform': f"/waveform/{video_id}" if os.path.exists(_peaks_path(entry['file'])) else None,
+        'hls': f"/hls/{video_id}.m3u8" if SEGMENTED_OUTPUT else None,
+        'profiles': {
+            profile: {
+                'url': f"/stream/{video_id}/{profile}",
+                'ready': profile == 'source' or _rendition_file(entry, profile) is not None,
+            }
+            for profile in ('source', *RENDITION_PROFILES)
+        },
     })
 
 
+@app.route('/hls/<video_id>.m3u8')
+def hls_playlist(video_id):
+    """
+    Entry point for segmented playback: redirects to the track's
+    content-addressed playlist, whose segment URLs never change and are
+    served with immutable caching. Tracks stored before segmenting was
+    enabled are queued for segmenting on first request, answered with 202
+    and Retry-After until the playlist exists.
+    """
+    if not SEGMENTED_OUTPUT:
+        return jsonify({'error': 'Segmented output is disabled'}), 404
+    entry = cache.get(video_id)
+    if not entry or not os.path.exists(entry.get('file', '')):
+        return jsonify({'error': 'Not in cache'}), 404
+    if not os.path.exists(os.path.join(_segments_dir(entry['file']), 'index.m3u8')):
+        state = segment_pool.request(entry['file'], entry.get('codec', 'unknown'))
+        if state == 'failed':
+            return jsonify({'error': 'Segmenting failed'}), 500
+        if state == 'full':
+            return jsonify({'error': 'Too many tracks being segmented, try again shortly'}), 503, {'Retry-After': '10'}
+        return jsonify({'status': 'segmenting'}), 202, {'Retry-After': '2'}
+    disk_budget.touch(os.path.basename(entry['file']))
+    stem = os.path.splitext(os.path.basename(entry['file']))[0]
+    response = redirect(f"/hls/{stem}/{SEGMENT_SECONDS}/index.m3u8", code=302)
+    response.headers['Cache-Control'] = 'no-cache'
+    return response
+
+
+@app.route('/hls/<stem>/<int:seconds>/<filename>')
+def hls_file(stem, seconds, filename):
+    if not _HLS_FILE_RE.match(filename) or '..' in stem or '/' in stem:
+        return 'Forbidden', 403
+    file_path = os.path.join(AUDIO_DIR, f"{stem}.hls", str(seconds), filename)
+    if not os.path.exists(file_path):
+        return 'Not Found', 404
+    return _serve_file(file_path, HLS_MIMETYPES[filename.rsplit('.', 1)[-1]])
+
+
+@app.route('/waveform/<video_id>')
+def get_waveform(video_id):
+    """
+    One level of the track's min/max peak pyramid as compact binary
+    (see WaveformBuilder). Level 0 is the finest; each level halves it.
+    Tracks indexed before peaks existed are queued for analysis on first
+    request, answered with 202 and Retry-After until the peaks exist.
+    """
+    entry = cache.get(video_id)
+    if not entry or not os.path.exists(entry.get('file', '')):
+        return jsonify({'error': 'Not in cache'}), 404
+    peaks_path = _peaks_path(entry['file'])
+    if not os.path.exists(peaks_path):
+        state = analysis_backfill.request(video_id) if np is not None and WAVEFORM_PEAKS else 'failed'
+        if state == 'failed':
+            return jsonify({'error': 'Waveform not available'}), 404
+        if state == 'full':
+            return jsonify({'error': 'Too many tracks being analyzed, try again shortly'}), 503, {'Retry-After': '10'}
+        return jsonify({'status': 'analyzing'}), 202, {'Retry-After': '2'}
+    level = request.args.get('level', 0, type=int)
+    etag = f"{os.path.splitext(os.path.basename(entry['file']))[0]}-{level}"
+    if request.if_none_match.contains(etag):
+        response = Response(status=304)
+    else:
+        with open(peaks_path, 'rb') as f:
+            body = WaveformBuilder.read_level(f.read(), level)
+        if body is None:
+            return jsonify({'error': f'No waveform level {level}'}), 400
+        _, _, bits, _, _, rate, samples_per_peak = WaveformBuilder.HEADER.unpack_from(body)
+        response = Response(body, mimetype='application/octet-stream')
+        response.headers['X-Waveform-Bits'] = bits
+        response.headers['X-Waveform-Sample-Rate'] = rate
+        response.headers['X-Waveform-Samples-Per-Peak'] = samples_per_peak
+    response.set_etag(etag)
+    response.headers['Cache-Control'] = WAVEFORM_CACHE_CONTROL
+    return response
+
+
 @app.route('/cache')
 def list_cache():
     items = []
@@ -927,6 +4416,7 @@ def list_cache():
             'video_id': vid,
             'title': entry.get('metadata', {}).get('title', 'Unknown'),
             'downloaded_at': entry.get('downloaded_at'),
+            'digest': entry.get('digest'),
             'file_exists': os.path.exists(entry.get('file', ''))
         })
     return jsonify({'cached': len(items), 'items': items})
@@ -937,52 +4427,84 @@ def delete_cached(video_id):
     if video_id not in cache:
         return jsonify({'error': 'Not found'}), 404
     
-    entry = cache[video_id]
-    file_path = entry.get('file')
-    
     try:
-        if file_path and os.path.exists(file_path):
-            os.remove(file_path)
-        del cache[video_id]
-        save_cache(cache)
-        return jsonify({'deleted': video_id})
+        with blob_lock:
+            entry = cache.delete(video_id) or {}
+            # The file goes with its last reference; videos sharing the blob keep it
+            removed = bool(entry.get('file')) and _release_blob(os.path.basename(entry['file']))
+        return jsonify({'deleted': video_id, 'file_removed': removed})
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
 
-def cleanup_worker():
+@app.route('/strategies')
+def download_strategies():
+    """Learned ranking of the download fallback chain, best first."""
+    return jsonify({'strategies': strategy_stats.stats()})
+
+
+@app.route('/cache/analyze', methods=['POST'])
+def analyze_cached():
+    """
+    Queue library entries for waveform/loudness analysis. Accepts
+    {"video_ids": [...]}; without it, every entry missing loudness or
+    waveform peaks is queued.
+    """
+    if np is None:
+        return jsonify({'error': 'Audio analysis needs NumPy'}), 503
+    data = request.get_json(silent=True) or {}
+    video_ids = data.get('video_ids')
+    if video_ids is None:
+        video_ids = [
+            vid for vid, entry in cache.items()
+            if (LOUDNESS_ANALYSIS and 'loudness' not in entry.get('metadata', {}))
+            or (WAVEFORM_PEAKS and not os.path.exists(_peaks_path(entry.get('file', ''))))
+        ]
+    elif not isinstance(video_ids, list):
+        return jsonify({'error': 'video_ids must be a list'}), 400
+    queued = analysis_backfill.submit([vid for vid in video_ids if vid in cache])
+    return jsonify({'queued': queued, 'analysis': analysis_backfill.stats()}), 202
+
+
+@app.route('/cache/stats')
+def cache_stats():
+    with cache.lock:
+        blobs = len(cache.by_file)
+    return jsonify({**disk_budget.stats(), 'entries': len(cache), 'blobs': blobs})
+
+
+def access_stats_worker():
+    """Periodically persist access stats so LRU/LFU ordering survives restarts."""
     while True:
         try:
-            time.sleep(3600)
-            
-            now = datetime.now()
-            cutoff = now - timedelta(hours=CLEANUP_HOURS)
-            deleted = 0
+            time.sleep(STATS_FLUSH_SECONDS)
             
-            for video_id, entry in list(cache.items()):
-                try:
-                    dl_time_str = entry.get('downloaded_at')
-                    if dl_time_str:
-                        dl_time = datetime.fromisoformat(dl_time_str)
-                        if dl_time < cutoff:
-                            file_path = entry.get('file')
-                            if file_path and os.path.exists(file_path):
-                                os.remove(file_path)
-                            del cache[video_id]
-                            deleted += 1
-                except Exception as e:
-                    logger.warning(f"Cleanup error for {video_id}: {e}")
-            
-            if deleted > 0:
-                save_cache(cache)
-                logger.info(f"Cleanup: deleted {deleted} old MP3(s)")
+            changed = disk_budget.take_dirty()
+            for name, (last_access, hits) in changed.items():
+                rendition = _RENDITION_RE.match(name)
+                if rendition:
+                    cache.update_rendition(rendition.group(1), rendition.group(2), last_access=last_access, hits=hits)
+                for video_id in cache.owners(name):
+                    cache.update(video_id, last_access=last_access, hits=hits)
         
         except Exception as e:
-            logger.error(f"Cleanup worker error: {e}")
+            logger.error(f"Access stats worker error: {e}")
+
+
+stats_thread = threading.Thread(target=access_stats_worker, daemon=True)
+stats_thread.start()
+
+
+def warm_extractors():
+    """Have an extractor ready for each download worker before the first job arrives."""
+    try:
+        for _ in range(min(DOWNLOAD_WORKERS, EXTRACTOR_POOL_SIZE)):
+            extractor_pool.warm(_download_opts())
+    except Exception as e:
+        logger.warning(f"Extractor warm-up failed: {e}")
 
 
-cleanup_thread = threading.Thread(target=cleanup_worker, daemon=True)
-cleanup_thread.start()
+threading.Thread(target=warm_extractors, daemon=True).start()
 
 # Note: When using Gunicorn, don't call app.run()
 # Gunicorn will handle starting the server
@@ -0,0 +1,15 @@
+"""
+Gunicorn settings shared by every deploy target (Procfile, render.yaml, railway.json).
+
+A single worker process: jobs, SSE subscribers and the disk budget live in its
+memory, so requests for one job must reach the same process. Concurrency comes
+from gthread threads instead, and gunicorn's wsgi.file_wrapper sends /stream
+bodies with sendfile.
+"""
+import os
+
+bind = f"0.0.0.0:{os.getenv('PORT', '5000')}"
+workers = 1
+worker_class = 'gthread'
+# Each open /download wait or thread-side SSE stream holds one of these
+threads = int(os.getenv('GUNICORN_THREADS', 32))
@@ -3,7 +3,7 @@ interface DownloadJob {
   video_id: string;
   url: string;
   title: string;
-  status: 'queued' | 'downloading' | 'completed' | 'failed';
+  status: 'queued' | 'downloading' | 'completed' | 'failed' | 'cancelled';
   progress: number;
   stage: string;
   error: string | null;
@@ -123,9 +123,9 @@ class DownloadJobService {
           console.log('[DownloadJob] Download completed!');
           onComplete(job);
           this.unsubscribe(jobId);
-        } else if (job.status === 'failed') {
+        } else if (job.status === 'failed' || job.status === 'cancelled') {
           console.error('[DownloadJob] Download failed:', job.error);
-          onError(job.error || 'Download failed');
+          onError(job.error || (job.status === 'cancelled' ? 'Download cancelled' : 'Download failed'));
           this.unsubscribe(jobId);
         }
       } catch (e) {
@@ -141,8 +141,8 @@ class DownloadJobService {
         if (job) {
           if (job.status === 'completed') {
             onComplete(job);
-          } else if (job.status === 'failed') {
-            onError(job.error || 'Download failed');
+          } else if (job.status === 'failed' || job.status === 'cancelled') {
+            onError(job.error || (job.status === 'cancelled' ? 'Download cancelled' : 'Download failed'));
           } else {
             onError('Connection lost during download');
           }
@@ -1,5 +1,6 @@
 """
-WSGI entry point for Railway deployment
+WSGI entry point for deployment: `gunicorn -c gunicorn.conf.py wsgi:app`.
+Running this file directly starts the Werkzeug development server instead.
 """
 import sys
 import os